@@ -4,44 +4,95 @@ python Main.py --serial_port=none
 
 TODO:
  """
-from absl import app
-from absl import flags
+import os
+import threading
 import time
 import tkinter as tk
+from tkinter import filedialog
+from absl import app
+from absl import flags
 import customtkinter
-import threading
 import numpy as np
-from scipy.interpolate import splev
-from scipy.interpolate import splprep
-import os
 from PIL import Image
-import font_constants
-import g_code_sender
+from plotter_core import curve_fitter
+from plotter_core import g_code_sender
+from plotter_core import gcode_compiler
+from plotter_core import hershey
+from plotter_core import latency_tracer
+from plotter_core import path_optimizer
+from plotter_core import path_simplifier
+from plotter_core import stroke_buffer
+from plotter_core import stroke_index
+from plotter_core import time_estimator
+import raster
 import virtual_plotter
 
 SERIAL_PORT = flags.DEFINE_string(
     'serial_port', '/dev/ttyUSB0', 
     'Port for plotter. Something like COM9 for Windows. "" or "none" to not connect.')
-
-SPEED = 7000
-PEN_UP = (None, None)
+STATUS_RATE = flags.DEFINE_float(
+    'status_rate', g_code_sender.STATUS_RATE,
+    'Status reports requested from the plotter per second.')
+OPTIMIZE_TRAVEL = flags.DEFINE_bool(
+    'optimize_travel', False,
+    'Reorder and reverse strokes before "Draw!" to shorten pen-up travel.')
+CHORD_TOLERANCE = flags.DEFINE_float(
+    'chord_tolerance', path_simplifier.DEFAULT_TOLERANCE,
+    'How far in mm simplified paths and fitted arcs may stray from the drawn '
+    'path. 0 sends one G1 per point.')
+FIT_TOLERANCE = flags.DEFINE_float(
+    'fit_tolerance', curve_fitter.DEFAULT_TOLERANCE,
+    'How far in mm smoothed drawings may be resampled from the smoothed '
+    'stroke.')
+TRACE_LATENCY = flags.DEFINE_bool(
+    'trace_latency', True,
+    'Time each stage between drawing a point and the plotter reaching it in '
+    '"Draw as I draw" mode.')
+MACHINE_SETTINGS = flags.DEFINE_string(
+    'machine_settings', None,
+    'File with the plotter\'s FluidNC $ settings ($110, $120, $11...), as '
+    'printed by $$, for time estimates. Defaults are used without one.')
+RASTER_STYLE = flags.DEFINE_enum(
+    'raster_style', 'crosshatch', raster.STYLES, 'How "Load image" draws images.')
+FONT = flags.DEFINE_string(
+    'font', hershey.DEFAULT_FACE, 'Hershey font face to write text in, e.g. futural or scripts.')
+
+SPEED = gcode_compiler.SPEED
 BUTTON_FONT = ('Arial', 18)
 LABEL_FONT = ('Arial', 12)
-PEN_UP_GCODE = "G0 Z-5\n"
-
-customtkinter.set_appearance_mode("dark")  # Modes: system (default), light, dark
-customtkinter.set_default_color_theme("blue")  # Themes: blue (default), dark-blue, green
-customtkinter.set_widget_scaling(2)  # widget dimensions and text size
-customtkinter.DrawEngine.preferred_drawing_method = "circle_shapes"
-
-
-def fit_bspline(points):
-    if len(points) <= 3:
-        return points
-    x_coords, y_coords = zip(*points)
-    tck, u = splprep([x_coords, y_coords], k=3)
-    bspline = splev(u[::3], tck)
-    return np.array(bspline).T
+PEN_UP_GCODE = gcode_compiler.PEN_UP_GCODE
+# The stroke being drawn is redrawn at most this often (~60 fps).
+REDRAW_INTERVAL_MS = 16
+# Long strokes are split across canvas items of this many points, so
+# updating the one being drawn stays cheap.
+STROKE_CHUNK_POINTS = 256
+# In "Draw as I draw" mode points are batched for at least SYNC_MIN_DELAY,
+# so a burst of motion events goes out together, and at most
+# SYNC_MAX_DELAY. In between, and between SYNC_MIN_BATCH and SYNC_MAX_BATCH
+# points per batch, the fuller the plotter's planner the longer it waits.
+SYNC_MIN_DELAY = 0.01
+SYNC_MAX_DELAY = 0.2
+SYNC_MIN_BATCH = 2
+SYNC_MAX_BATCH = 40
+# Without Bf in status reports, this many lines waiting in the sender count
+# as a full planner.
+SYNC_QUEUE_TARGET = 16
+# The time estimate is updated this long after the drawing last changed.
+ETA_DELAY_MS = 300
+# Most seconds to wait for FluidNC to report back after a soft reset.
+RESET_TIMEOUT = 2
+# What dragging on the canvas does: draw, erase the strokes in a rectangle or
+# select them. Clicking erases or selects the stroke under the pointer.
+DRAW_TOOL, ERASE_TOOL, SELECT_TOOL = TOOLS = ('Draw', 'Erase', 'Select')
+# How near in pixels a click has to be to a stroke to pick it.
+PICK_RADIUS = 6
+SELECTION_COLOR = 'orange'
+# Every canvas item of a drawn stroke has this tag, and stroke_tag(id).
+DRAWING_TAG = 'drawing'
+
+
+def stroke_tag(stroke):
+    return f'stroke{stroke}'
 
 
 def load_image(filename, size=(20, 20)):
@@ -55,18 +106,29 @@ class DrawingApp:
         self.gcode_sender = gcode_sender
 
         # Plotter Dimensions in mm
-        self.plotter_width = 556
-        self.plotter_height = 405
+        self.plotter_width = gcode_compiler.PLOTTER_WIDTH
+        self.plotter_height = gcode_compiler.PLOTTER_HEIGHT
 
         # Canvas Size in Pixels
-        self.canvas_width = self.plotter_width * 3
-        self.canvas_height = self.plotter_height * 3
+        self.canvas_width = self.plotter_width * gcode_compiler.CANVAS_SCALE
+        self.canvas_height = self.plotter_height * gcode_compiler.CANVAS_SCALE
 
         self.old_x = None
         self.old_y = None
         self.line_width = 8
         self.color = 'light gray'
-        self.positions = []
+        self.positions = stroke_buffer.StrokeBuffer()
+        # Held to change self.positions or swap it for an empty one, as the
+        # sync thread takes points while the Tk thread adds them.
+        self._positions_lock = threading.Lock()
+        # Every stroke drawn, live or erased, for erasing, selecting and undo.
+        self.drawing = stroke_index.StrokeIndex()
+        # Strokes from this id on haven't gone to the plotter yet.
+        self.unplotted_from = 0
+        self.selection = np.empty(0, dtype=np.int64)
+        # Where the erase or select rectangle being dragged started, and its item.
+        self.region_start = None
+        self.region_item = None
         self.pen_up = True
 
         self.x_scale = self.plotter_width / self.canvas_width
@@ -74,11 +136,31 @@ class DrawingApp:
 
         self.sync_mode = False
         self.stop_sync_flag = False
+        # Set on new points, pen lifts and status reports to wake send_code_sync.
+        self._sync_wake = threading.Event()
+        # Most free planner blocks ever reported, i.e. the planner's size.
+        self._planner_size = 1
         self.straight_segment = None
-        self.text_positions = []
-        self.text_positions_anchored = []
+        # Canvas item and flattened coordinates of the stroke being drawn.
+        self.stroke_item = None
+        self.stroke_coords = []
+        self._redraw_pending = False
+        # hershey.PlacedGlyph and canvas items for each character being typed.
+        self.text_layout = []
+        self.text_scale = 1
+        self.text_positions_anchored = stroke_buffer.StrokeBuffer()
         self.text_segments = []
         self.text_left_corner = (100, self.canvas_height // 2)
+        # g_code_sender.FileJob for the last G-code file sent.
+        self.file_job = None
+        self.machine_limits = time_estimator.load_limits(MACHINE_SETTINGS.value)
+        self._eta_pending = False
+        self._eta_generation = 0
+        self.latency_tracer = latency_tracer.LatencyTracer() if TRACE_LATENCY.value else None
+        if self.latency_tracer and self.gcode_sender:
+            self.gcode_sender.status_listeners.append(self.latency_tracer.on_status)
+        if self.gcode_sender:
+            self.gcode_sender.status_listeners.append(lambda status: self._sync_wake.set())
 
         self.lay_out_ui()
 
@@ -94,6 +176,9 @@ class DrawingApp:
 
         self.canvas = tk.Canvas(left_frame, bg='white', width=self.canvas_width, height=self.canvas_height)
         self.canvas.pack(padx=10, pady=10)
+        # Kept up to date from <Configure> so bounds checks don't query Tk.
+        self.canvas_size = (self.canvas_width, self.canvas_height)
+        self.canvas.bind("<Configure>", self.on_canvas_configure)
 
         self.canvas.bind("<Button-1>", self.on_click)
         self.canvas.bind("<B1-Motion>", self.draw)
@@ -126,23 +211,48 @@ class DrawingApp:
         add_button("Pen down", self.lower_pen, frame=pen_up_down_frame, pack_side="right")
 
         add_button("Draw!", self.send_text_and_drawings)
+        self.eta_label = customtkinter.CTkLabel(right_frame, text="", font=LABEL_FONT)
+        self.eta_label.pack(side="top", anchor="w", padx=(20, 0))
         self.toggle_sync_mode_button = customtkinter.CTkSwitch(
             right_frame, text="Draw as I draw", command=self.toggle_sync_mode, font=BUTTON_FONT)
         self.toggle_sync_mode_button.pack(padx=(20, 20), pady=10, anchor='w')
-
-        add_button("Clear canvas", lambda: self.canvas.delete('all'))
+        if self.latency_tracer:
+            add_button("Sync latency", self.show_latency)
+
+        add_button("Clear canvas", self.clear_canvas)
+        undo_redo_frame = tk.Frame(right_frame, bg=self.root.cget('bg'))
+        undo_redo_frame.pack(fill='x', expand=True)
+        add_button("Undo", self.undo, frame=undo_redo_frame, pack_side="left")
+        add_button("Redo", self.redo, frame=undo_redo_frame, pack_side="right")
+        add_button("Plot selection", self.plot_selection)
+        save_load_frame = tk.Frame(right_frame, bg=self.root.cget('bg'))
+        save_load_frame.pack(fill='x', expand=True)
+        add_button("Save drawing", self.save_drawing, frame=save_load_frame, pack_side="left")
+        add_button("Load drawing", self.load_drawing, frame=save_load_frame, pack_side="right")
+        add_button("Load image", self.import_image)
+        file_frame = tk.Frame(right_frame, bg=self.root.cget('bg'))
+        file_frame.pack(fill='x', expand=True)
+        add_button("Send G-code file", self.send_file, frame=file_frame, pack_side="left")
+        add_button("Resume file", self.resume_file, frame=file_frame, pack_side="right")
         self.straight_line_var = customtkinter.StringVar(value="")
         switch = customtkinter.CTkSwitch(right_frame, text="Draw straight lines",
                                          font=BUTTON_FONT,
                                  variable=self.straight_line_var, onvalue="on", offvalue="")
         switch.pack(padx=(20, 20), pady=10, anchor='w')
+        self.tool_var = customtkinter.StringVar(value=DRAW_TOOL)
+        customtkinter.CTkSegmentedButton(right_frame, values=list(TOOLS), font=BUTTON_FONT,
+                                         variable=self.tool_var).pack(
+            padx=(20, 20), pady=10, anchor='w', fill='x')
+        self.root.bind("<Control-z>", lambda event: self.on_edit_key(event, self.undo))
+        self.root.bind("<Control-y>", lambda event: self.on_edit_key(event, self.redo))
+        self.root.bind("<Delete>", lambda event: self.on_edit_key(event, self.erase_selection))
         self.canvas.bind("<Shift-Button-1>", self.set_text_left_corner)
         self.canvas.bind("<Shift-B1-Motion>", self.set_text_left_corner)
         
-        self.entry = customtkinter.CTkEntry(right_frame, font=BUTTON_FONT,
-                                            placeholder_text="Text to write")
+        # Text to write, over as many lines as it takes.
+        self.entry = customtkinter.CTkTextbox(right_frame, font=BUTTON_FONT, height=80)
         self.entry.pack(padx=(20, 20), pady=10, anchor='w', fill='x', expand=True)
-        self.entry.bind("<Return>", self.write)
+        self.entry.bind("<KeyRelease>", self.update_text)
 
         text_options_frame = tk.Frame(right_frame, bg=self.root.cget('bg'))
         text_options_frame.pack(fill='x', expand=True)
@@ -156,12 +266,28 @@ class DrawingApp:
                                          dropdown_font=BUTTON_FONT,
                                          variable=self.font_size_var)
         optionmenu.pack(side='right', padx=(20, 20), pady=10, anchor='w')
+        self.text_align_var = customtkinter.StringVar(value=hershey.ALIGNMENTS[0])
+        customtkinter.CTkOptionMenu(text_options_frame, values=list(hershey.ALIGNMENTS),
+                                    command=self.write, font=BUTTON_FONT,
+                                    dropdown_font=BUTTON_FONT,
+                                    variable=self.text_align_var).pack(
+            side='right', padx=(20, 0), pady=10, anchor='w')
 
     def reset(self, event):
+        if self.tool_var.get() != DRAW_TOOL:
+            self.finish_region(event)
+            return
         if not self.is_within_canvas(event.x, event.y):
             # If we've run off the canvas, remove the last position for safety
             try:
-                self.positions.pop()
+                self.drawing.pop()
+                del self.stroke_coords[-2:]
+            except IndexError:
+                pass
+            # In sync mode the point may already have been sent.
+            try:
+                with self._positions_lock:
+                    self.positions.pop()
             except IndexError:
                 pass
             # If it's a straight segment we won't draw it,
@@ -172,12 +298,184 @@ class DrawingApp:
         # add the final point. Important for straight segments.
         if (self.old_x is not None and self.old_y is not None and
             not (self.old_x == event.x and self.old_y == event.y)):
-            self.positions.append((event.x, event.y))
+            self.add_point(event.x, event.y)
+            if not self.straight_segment:
+                self.stroke_coords.extend((event.x, event.y))
+        self.redraw_stroke()
+        self.stroke_item = None
+        self.stroke_coords = []
         self.old_x = None
         self.old_y = None
         self.straight_segment = None
-        self.positions.append(PEN_UP)
-        
+        with self._positions_lock:
+            self.positions.end_stroke()
+        self.drawing.end_stroke()
+        self._sync_wake.set()
+        self.schedule_eta()
+
+    def add_point(self, x, y):
+        with self._positions_lock:
+            self.positions.append(x, y)
+        self.drawing.append(x, y)
+
+    def finish_region(self, event):
+        """Erases or selects the strokes in the dragged rectangle, or the one
+        clicked on."""
+        if self.region_item is None:
+            return
+        self.canvas.delete(self.region_item)
+        self.region_item = None
+        (x0, y0), x1, y1 = self.region_start, event.x, event.y
+        if abs(x1 - x0) <= PICK_RADIUS and abs(y1 - y0) <= PICK_RADIUS:
+            picked = self.drawing.pick(x1, y1, PICK_RADIUS)
+            ids = [] if picked is None else [picked]
+        else:
+            ids = self.drawing.in_region(x0, y0, x1, y1)
+        if self.tool_var.get() == ERASE_TOOL:
+            self.apply_change(self.drawing.erase(ids))
+        else:
+            self.select(ids)
+
+    def select(self, ids):
+        """Highlights the strokes ids instead of those selected before."""
+        for stroke in self.selection.tolist():
+            self.canvas.itemconfigure(stroke_tag(stroke), fill=self.color)
+        self.selection = np.asarray(ids, dtype=np.int64)
+        for stroke in self.selection.tolist():
+            self.canvas.itemconfigure(stroke_tag(stroke), fill=SELECTION_COLOR)
+
+    def apply_change(self, change):
+        """Shows or hides the strokes an erase, undo or redo changed, and
+        keeps only live strokes waiting for "Draw!"."""
+        if change is None or not len(change.ids):
+            return
+        state = 'normal' if change.alive else 'hidden'
+        for stroke in change.ids.tolist():
+            self.canvas.itemconfigure(stroke_tag(stroke), state=state)
+        if not change.alive:
+            self.select(np.setdiff1d(self.selection, change.ids))
+        # In sync mode strokes go out as they're drawn, so there's nothing
+        # waiting to change.
+        if not self.sync_mode:
+            positions = self.drawing.strokes(self.drawing.live_ids(self.unplotted_from))
+            with self._positions_lock:
+                self.positions = positions
+        self.schedule_eta()
+
+    def undo(self):
+        self.apply_change(self.drawing.undo())
+
+    def redo(self):
+        self.apply_change(self.drawing.redo())
+
+    def erase_selection(self):
+        self.apply_change(self.drawing.erase(self.selection))
+
+    def on_edit_key(self, event, edit):
+        # Keys typed into the text box are the text box's, and strokes are
+        # left alone while one is being drawn.
+        if not isinstance(event.widget, tk.Text) and self.old_x is None:
+            edit()
+
+    def clear_canvas(self):
+        """Erases every stroke, which Undo brings back, and drops the text and
+        images."""
+        self.canvas.delete(f'!{DRAWING_TAG}')
+        self.text_positions_anchored = stroke_buffer.StrokeBuffer()
+        self.text_layout = []
+        self.text_segments = []
+        self.entry.delete('1.0', tk.END)
+        self.apply_change(self.drawing.clear())
+        self.schedule_eta()
+
+    def save_drawing(self):
+        """Saves every live stroke, plotted or not."""
+        filename = filedialog.asksaveasfilename(defaultextension='.npz',
+                                                filetypes=[('Drawings', '*.npz')])
+        if filename:
+            self.drawing.strokes(self.drawing.live_ids()).save(filename)
+
+    def load_drawing(self):
+        filename = filedialog.askopenfilename(filetypes=[('Drawings', '*.npz')])
+        if not filename:
+            return
+        drawing = stroke_buffer.StrokeBuffer.load(filename)
+        for stroke, stroke_id in zip(drawing, self.drawing.add_strokes(drawing).tolist()):
+            if len(stroke) > 1:
+                self.canvas.create_line(*stroke.ravel().tolist(),
+                                        width=self.line_width, fill=self.color,
+                                        capstyle=tk.ROUND, smooth=tk.TRUE, splinesteps=36,
+                                        tags=(DRAWING_TAG, stroke_tag(stroke_id)))
+        with self._positions_lock:
+            self.positions.extend_strokes(drawing)
+        self.schedule_eta()
+
+    def import_image(self):
+        """Hatches or stipples an image over the whole canvas, off the Tk thread."""
+        filename = filedialog.askopenfilename(
+            filetypes=[('Images', '*.png *.jpg *.jpeg *.bmp *.tif *.tiff')])
+        if not filename:
+            return
+
+        def convert():
+            strokes = raster.image_strokes(filename, RASTER_STYLE.value)
+            self.root.after(0, lambda: self.add_image(strokes))
+        threading.Thread(target=convert, daemon=True).start()
+
+    def add_image(self, strokes):
+        for stroke in strokes:
+            if len(stroke) > 1:
+                self.canvas.create_line(*stroke.ravel().tolist(), width=1, fill='black')
+            else:
+                (x, y), = stroke
+                self.canvas.create_oval(x - 1, y - 1, x + 1, y + 1, fill='black', outline='')
+        # Images are exact, like text, so they aren't smoothed like drawings.
+        self.text_positions_anchored.extend_strokes(strokes)
+        self.schedule_eta()
+
+    def send_file(self, start_line=1, filename=None):
+        if filename is None:
+            filename = filedialog.askopenfilename(filetypes=[('G-code', '*.gcode *.nc *.gc')])
+        if not filename:
+            return
+
+        # Set now, as send_file only returns once the whole file is queued.
+        job = self.file_job = g_code_sender.FileJob(filename, start_line)
+        # Big files block once the sender's queue is full.
+        threading.Thread(target=self.gcode_sender.send_file,
+                         args=(filename, start_line), kwargs={'job': job}, daemon=True).start()
+
+    def resume_file(self):
+        """Picks the last file back up after Stop or Reset, with the pen lifted."""
+        job = self.file_job
+        if job is None:
+            return
+
+        def resume():
+            # Stop only holds, so the rest of the job is still queued, here and
+            # in FluidNC's planner, and would run before the resumed job.
+            # Resetting drops it, along with the planner's unfinished lines.
+            status = self.gcode_sender.status
+            self.gcode_sender.send_soft_reset()
+            if status is not None:
+                # Lines sent while FluidNC restarts would be lost.
+                status = self.gcode_sender.wait_for_status(newer_than=status,
+                                                           timeout=RESET_TIMEOUT)
+                # A reset mid-move leaves FluidNC in Alarm, refusing every line.
+                if status is not None and status.state.startswith('Alarm'):
+                    self.gcode_sender.send_unlock(wait=True)
+                    status = self.gcode_sender.wait_for_status(
+                        newer_than=self.gcode_sender.status, timeout=RESET_TIMEOUT)
+                    if status is None or not status.state.startswith('Idle'):
+                        print(f'Not resuming {job.path}: FluidNC is '
+                              f'{status.state if status else "not reporting"}, not Idle')
+                        return
+            line = job.resume_line(self.gcode_sender.unfinished_lines())
+            print(f'Resuming {job.path} from line {line}')
+            self.file_job = g_code_sender.FileJob(job.path, line)
+            self.gcode_sender.send_file(job.path, line, job=self.file_job)
+        threading.Thread(target=resume, daemon=True).start()
+
     def pen_up_down(self, value):
         if value == "Pen Up":
             self.raise_pen()
@@ -186,10 +484,13 @@ class DrawingApp:
         self.segmented_button.set(None)
 
     def anchor_text(self):
-        self.text_positions_anchored.extend(self.text_positions)
-        self.text_positions = []
+        for placed in self.text_layout:
+            for stroke in placed.strokes:
+                self.text_positions_anchored.add_stroke(stroke)
+        self.text_layout = []
         self.text_segments = []
-        self.entry.delete(0, tk.END)
+        self.entry.delete('1.0', tk.END)
+        self.schedule_eta()
 
     def set_text_left_corner(self, event):
         if not self.is_within_canvas(event.x, event.y):
@@ -197,61 +498,58 @@ class DrawingApp:
         self.text_left_corner = (event.x, event.y)
         self.write()
 
+    def font_scale(self):
+        scale_str = self.font_size_var.get()
+        return 1 if scale_str == "Font size (1)" else int(scale_str)
+
     def write(self, entry=None):
-        text = self.entry.get()
-        for segment in self.text_segments:
-            self.canvas.delete(segment)
+        """Lays out the entry's text from scratch."""
+        for segments in self.text_segments:
+            for segment in segments:
+                self.canvas.delete(segment)
         self.text_segments = []
-        self.text_positions = []
-        left_corner = self.text_left_corner
-        scale_str = self.font_size_var.get()
-        scale = 1 if scale_str == "Font size (1)" else int(scale_str)
-        for char in text:
-            char_code = font_constants.CODE_FROM_CHAR.get(char, '')
-            if char_code:
-                left_corner = self.draw_letter(char_code, left_corner, scale)
-
-    def draw_letter(self,
-                    line,
-                    left_corner=None,
-                    scale=10):
-        left_corner = left_corner or (self.canvas_width//2, self.canvas_height//2)
-        # First 2 chars are num coord pairs
-        left_pos = scale * (ord(line[2]) - 82)  # 82 is ord("R")
-        right_pos = scale * (ord(line[3]) - 82)
-        origin = (left_corner[0] - left_pos, left_corner[1])
-        right_corner = (origin[0] + right_pos, origin[1])
-        if not self.is_within_canvas(*right_corner):
-            return right_corner
-        prev_x = prev_y = None
-        for x_char, y_char in zip(line[4:-1:2], line[5::2]):
-            if x_char == " " and y_char == "R":
-                self.text_positions.append(PEN_UP)
-                prev_x = prev_y = None
-                continue
-            x = origin[0] + (ord(x_char) - 82) * scale
-            y = origin[1] + (ord(y_char) - 82) * scale
-            # TODO: Find max and min y and don't start drawing if they hit the edge
-            if not self.is_within_canvas(x, y):
-                self.text_positions.append(PEN_UP)
-                return right_corner
-            self.text_positions.append((x, y))
-            if prev_x is not None and prev_y is not None:
-                segment = self.canvas.create_line(prev_x, prev_y, x, y,
-                                        width=2, fill='black',
-                                        capstyle=tk.ROUND, smooth=tk.TRUE, splinesteps=36)
-                self.text_segments.append(segment)
-            prev_x = x
-            prev_y = y
-        self.text_positions.append(PEN_UP)
-        return right_corner
+        self.text_layout = []
+        self.text_scale = self.font_scale()
+        self.update_text()
+
+    def update_text(self, event=None):
+        """Lays out the text again, redrawing only the characters that moved or
+        changed since last time."""
+        if self.font_scale() != self.text_scale:
+            self.write()
+            return
+        text = self.entry.get('1.0', 'end-1c')
+        # Lines wrap at the canvas's right edge.
+        lines = hershey.layout(text, self.text_left_corner, self.text_scale,
+                               width=self.canvas_width - self.text_left_corner[0],
+                               align=self.text_align_var.get(), face_name=FONT.value,
+                               fits=self.is_within_canvas)
+        layout = [placed for line in lines for placed in line.glyphs]
+        kept = 0
+        for old, new in zip(self.text_layout, layout):
+            if (old.char, old.right_corner) != (new.char, new.right_corner):
+                break
+            kept += 1
+        for segments in self.text_segments[kept:]:
+            for segment in segments:
+                self.canvas.delete(segment)
+        del self.text_segments[kept:]
+        self.text_layout = layout
+        for placed in layout[kept:]:
+            self.text_segments.append([
+                self.canvas.create_line(*stroke.ravel().tolist(), width=2, fill='black',
+                                        capstyle=tk.ROUND, joinstyle=tk.ROUND)
+                for stroke in placed.strokes if len(stroke) > 1])
+        self.schedule_eta()
 
     def toggle_sync_mode(self):
         if self.sync_mode:
             self.stop_sync_flag = True
             self.sync_mode = False
+            self._sync_wake.set()
         else:
             self.stop_sync_flag = False
+            self.sync_mode = True
             self._send_gcode_thread = threading.Thread(
                 target=self.send_code_sync,
                 args=(
@@ -259,7 +557,11 @@ class DrawingApp:
                 daemon=True,
             )
             self._send_gcode_thread.start()
-            self.sync_mode = True
+            self._update_position_thread = threading.Thread(
+                target=self.update_position,
+                daemon=True,
+            )
+            self._update_position_thread.start()
 
     def home_machine(self):
         self.gcode_sender.send_homing_command()
@@ -273,42 +575,90 @@ class DrawingApp:
 
     def raise_pen(self):
         gcode = "G0 Z-5\n"
-        self.gcode_sender.send(gcode)
+        self.gcode_sender.stream(gcode)
         self.pen_up = True
 
     def lower_pen(self):
         gcode = "G0 Z5\n"
-        self.gcode_sender.send(gcode)
+        self.gcode_sender.stream(gcode)
         self.pen_up = False
 
+    def on_canvas_configure(self, event):
+        self.canvas_size = (event.width, event.height)
+
     def is_within_canvas(self, x, y):
-        return 0 <= x <= self.canvas.winfo_width() and 0 <= y <= self.canvas.winfo_height()
+        width, height = self.canvas_size
+        return 0 <= x <= width and 0 <= y <= height
+
+    def trace_point(self, event_time):
+        if self.sync_mode:
+            if self.latency_tracer:
+                self.latency_tracer.point_added(event_time)
+            self._sync_wake.set()
 
     def on_click(self, event):
+        event_time = time.perf_counter()
+        if self.tool_var.get() != DRAW_TOOL:
+            self.region_start = (event.x, event.y)
+            self.region_item = self.canvas.create_rectangle(
+                event.x, event.y, event.x, event.y, outline='gray', dash=(4, 4))
+            return
         if self.is_within_canvas(event.x, event.y):
             self.old_x = event.x
             self.old_y = event.y
-            self.positions.append((event.x, event.y))
+            self.add_point(event.x, event.y)
+            self.trace_point(event_time)
+            self.stroke_item = None
+            self.stroke_coords = [event.x, event.y]
+
+    def redraw_stroke(self):
+        """Shows the stroke being drawn as one polyline, updated in place."""
+        self._redraw_pending = False
+        if len(self.stroke_coords) < 4:
+            return
+        if self.stroke_item is None:
+            self.stroke_item = self.canvas.create_line(
+                *self.stroke_coords, width=self.line_width, fill=self.color,
+                capstyle=tk.ROUND, joinstyle=tk.ROUND,
+                tags=(DRAWING_TAG, stroke_tag(self.drawing.next_id)))
+        else:
+            self.canvas.coords(self.stroke_item, *self.stroke_coords)
 
     def draw(self, event):
+        event_time = time.perf_counter()
+        if self.tool_var.get() != DRAW_TOOL:
+            if self.region_item is not None:
+                self.canvas.coords(self.region_item, *self.region_start, event.x, event.y)
+            return
+
         def draw_line():
             return self.canvas.create_line(self.old_x, self.old_y, event.x, event.y,
                                     width=self.line_width, fill=self.color,
-                                    capstyle=tk.ROUND, smooth=tk.TRUE, splinesteps=36)
+                                    capstyle=tk.ROUND, smooth=tk.TRUE, splinesteps=36,
+                                    tags=(DRAWING_TAG, stroke_tag(self.drawing.next_id)))
         if self.old_x == event.x and self.old_y == event.y:
-            return  # splprep doesn't like repeating points
+            return  # Repeated points add nothing
         if not self.is_within_canvas(event.x, event.y):
             if not self.straight_line_var.get():
                 self.reset(event)
             return
-        if self.old_x and self.old_y and self.is_within_canvas(event.x, event.y):
+        if self.old_x and self.old_y:
             if self.straight_line_var.get():
                 if self.straight_segment is None:
                     self.straight_segment = draw_line()
                 self.canvas.coords(self.straight_segment, self.old_x, self.old_y, event.x, event.y)
                 return
-            self.positions.append((event.x, event.y))
-            draw_line()
+            self.add_point(event.x, event.y)
+            self.trace_point(event_time)
+            self.stroke_coords.extend((event.x, event.y))
+            if len(self.stroke_coords) >= 2 * STROKE_CHUNK_POINTS:
+                # Carry on in a new item, starting from this point.
+                self.redraw_stroke()
+                self.stroke_item = None
+                self.stroke_coords = self.stroke_coords[-2:]
+            elif not self._redraw_pending:
+                self._redraw_pending = True
+                self.root.after(REDRAW_INTERVAL_MS, self.redraw_stroke)
 
         self.old_x = event.x
         self.old_y = event.y
@@ -319,48 +669,55 @@ class DrawingApp:
             xScaled = round(self.x_scale * event.x, 1)
             yScaled = round(self.y_scale * (self.canvas_height - event.y), 1)  # Flip the y coordinate
             gcode = f"G1 X{xScaled} Y{yScaled} F{SPEED}\n"
-            self.gcode_sender.send(gcode)
+            self.gcode_sender.stream(gcode)
+
+    def planner_fill(self):
+        """How full the plotter's planner is about to be, from 0 to 1."""
+        pending = self.gcode_sender.pending_lines
+        status = self.gcode_sender.status
+        if status is None or status.planner_blocks_free is None:
+            return min(pending / SYNC_QUEUE_TARGET, 1.0)
+        self._planner_size = max(self._planner_size, status.planner_blocks_free)
+        # Lines not acknowledged yet are on their way into the planner.
+        used = self._planner_size - status.planner_blocks_free + pending
+        return min(used / self._planner_size, 1.0)
 
     def send_code_sync(self):
-        self.positions = []
-        last_send_time = time.time()
-        r = 10
-        prev_x = None
-        prev_y = None
-        x = y = z = -1
-        marker_marker = self.canvas.create_oval(
-                x-r, self.canvas_height - (y-r),
-                x+r, self.canvas_height - (y+r), fill='purple')
+        """Sends points as they're drawn, batched by how busy the plotter is.
+
+        Sleeps until a point is drawn, the pen lifts or a status report
+        arrives. An idle plotter gets points almost as soon as they're
+        drawn. A busy one gets bigger, later batches, which simplify better,
+        since it has moves left to run in the meantime.
+        """
+        with self._positions_lock:
+            self.positions = stroke_buffer.StrokeBuffer()
+        first_point_time = None
         while not self.stop_sync_flag:
-            # TODO: Use self.update_position
-            position = self.gcode_sender.get_position()
-            if position is not None:
-                x, y, z = position
-                x /= self.x_scale
-                y = self.canvas_height - y / self.y_scale
-            self.canvas.moveto(marker_marker, x - r, y - r)
-
-            #-5.0 up; 5.0 down
-            if z > 2.5:
-                if prev_x is not None and prev_y is not None:
-                    self.canvas.create_line(prev_x, prev_y, x, y,
-                                    width=self.line_width, fill='black',
-                                    capstyle=tk.ROUND)
-                prev_x = x
-                prev_y = y
-
-            else:
-                prev_x = prev_y = None
-            if self.positions and self.positions[-1] == PEN_UP:
+            # Cleared before looking, so a point added meanwhile isn't missed.
+            self._sync_wake.clear()
+            with self._positions_lock:
+                stroke_ended = self.positions.stroke_ended
+                num_points = self.positions.num_points
+            timeout = None
+            if stroke_ended:
                 self.generate_gcode()
-                last_send_time = time.time()
+                first_point_time = None
                 continue
-            if len(self.positions) < 10 and time.time() - last_send_time < 0.2:
-                time.sleep(0.05)
-                continue
-            self.generate_gcode()
-            last_send_time = time.time()
-        self.canvas.delete(marker_marker)
+            if num_points:
+                now = time.monotonic()
+                if first_point_time is None:
+                    first_point_time = now
+                fill = self.planner_fill()
+                batch_points = SYNC_MIN_BATCH + fill * (SYNC_MAX_BATCH - SYNC_MIN_BATCH)
+                earliest = first_point_time + SYNC_MIN_DELAY
+                deadline = earliest + fill * (SYNC_MAX_DELAY - SYNC_MIN_DELAY)
+                if now >= deadline or (now >= earliest and num_points >= batch_points):
+                    self.generate_gcode()
+                    first_point_time = None
+                    continue
+                timeout = (earliest if now < earliest else deadline) - now
+            self._sync_wake.wait(timeout)
 
     def update_position(self):
         stationary_count = 0
@@ -408,55 +765,159 @@ class DrawingApp:
             daemon=True,
         )
         self._update_position_thread.start()
-        self.generate_gcode(is_text=True)
-        self.generate_gcode(is_text=False)
+
+        def generate_all():
+            self.generate_gcode(is_text=True)
+            self.generate_gcode(is_text=False)
+            self.schedule_eta()
+        # Queueing a big job blocks once the sender's queue is full,
+        # so keep it off the Tk thread.
+        self._generate_gcode_thread = threading.Thread(
+            target=generate_all,
+            daemon=True,
+        )
+        self._generate_gcode_thread.start()
+
+    def schedule_eta(self):
+        if not self._eta_pending:
+            self._eta_pending = True
+            self.root.after(ETA_DELAY_MS, self.update_eta)
+
+    def update_eta(self):
+        """Shows how long "Draw!" would take. Compiles off the Tk thread."""
+        self._eta_pending = False
+        self._eta_generation += 1
+        generation = self._eta_generation
+        text = list(self.text_positions_anchored)
+        text.extend(stroke for placed in self.text_layout for stroke in placed.strokes)
+        jobs = ((text, None), (list(self.positions), FIT_TOLERANCE.value))
+
+        def estimate():
+            gcode = []
+            for strokes, fit_tolerance in jobs:
+                if OPTIMIZE_TRAVEL.value and len(strokes) > 1:
+                    strokes, _ = path_optimizer.optimize_stroke_order(
+                        strokes, start=(0, self.canvas_height))
+                gcode.append(gcode_compiler.compile_strokes(
+                    strokes, self.x_scale, self.y_scale, self.canvas_height,
+                    tolerance=CHORD_TOLERANCE.value, fit_tolerance=fit_tolerance).gcode)
+            estimate = time_estimator.estimate(b''.join(gcode), self.machine_limits)
+            self.root.after(0, lambda: show(estimate))
+
+        def show(estimate):
+            # A newer estimate may have started while this one ran.
+            if generation == self._eta_generation:
+                self.eta_label.configure(
+                    text=f'About {estimate} to draw' if estimate.moves else '')
+        threading.Thread(target=estimate, daemon=True).start()
+
+    def optimize_travel(self, strokes):
+        """Reorders strokes to shorten pen-up travel."""
+        # Start from the plotter's origin, bottom left of the canvas.
+        strokes, report = path_optimizer.optimize_stroke_order(
+            strokes, start=(0, self.canvas_height))
+        before_mm = report.before * self.x_scale
+        after_mm = report.after * self.x_scale
+        print(f'Pen-up travel: {before_mm:.0f} mm -> {after_mm:.0f} mm, '
+              f'saving about {(before_mm - after_mm) / SPEED * 60:.1f} s')
+        return strokes
 
     def generate_gcode(self, is_text=False):
         if is_text:
-            positions = self.text_positions_anchored 
-            self.text_positions_anchored = []
+            positions = self.text_positions_anchored
+            self.text_positions_anchored = stroke_buffer.StrokeBuffer()
         else:
-            positions = self.positions
-            self.positions = []
-        while positions:
-            if positions[0] == PEN_UP:
-                gcode = PEN_UP_GCODE
-                self.pen_up = True
-                if self.gcode_sender:
-                    self.gcode_sender.send(gcode)
-                del positions[0]
-            try:
-                pen_up_idx = positions.index(PEN_UP)
-            except ValueError:
-                pen_up_idx = len(positions)
-            if is_text:
-                spline = positions[:pen_up_idx]
-            else:
-                spline = fit_bspline(positions[:pen_up_idx])
-            positions = positions[pen_up_idx:]
-            for x, y in spline:
-                # Scale and round the coordinates to a resolution of 0.1mm
-                xScaled = round(self.x_scale * x, 1)
-                yScaled = round(self.y_scale * (self.canvas_height - y), 1)  # Flip the y coordinate
-                gcode = f"G1 X{xScaled} Y{yScaled} F{SPEED}\n"
-
-                if self.pen_up:
-                    gcode += "G0 Z5\n"
-                    self.pen_up = False
-
-                if self.gcode_sender:
-                    self.gcode_sender.send(gcode)
-
+            with self._positions_lock:
+                positions = self.positions
+                self.positions = stroke_buffer.StrokeBuffer()
+                self.unplotted_from = self.drawing.next_id
+        point_times = None
+        if self.sync_mode and self.latency_tracer and not is_text:
+            point_times = self.latency_tracer.take_points()
+        self.plot_strokes(positions, is_text, point_times)
+
+    def plot_selection(self):
+        """Plots the selected strokes, whether or not they've been plotted before."""
+        positions = self.drawing.strokes(self.selection)
+        # Like "Draw!", off the Tk thread.
+        threading.Thread(target=self.plot_strokes, args=(positions,), daemon=True).start()
+
+    def plot_strokes(self, positions, is_text=False, point_times=None):
+        """Compiles strokes, smoothing them unless they're text, and streams them."""
+        if positions.is_empty:
+            return
+        strokes = list(positions)
+        continues = not positions.starts_with_pen_up
+        if OPTIMIZE_TRAVEL.value and not self.sync_mode:
+            strokes = self.optimize_travel(strokes)
+            continues = False
+        job = gcode_compiler.compile_strokes(
+            strokes, self.x_scale, self.y_scale, self.canvas_height,
+            fit_tolerance=None if is_text else FIT_TOLERANCE.value,
+            tolerance=CHORD_TOLERANCE.value,
+            pen_up=self.pen_up,
+            continues=continues,
+            finished=positions.stroke_ended)
+        self.pen_up = job.pen_up
+        if job.report and job.report.lines_before and not self.sync_mode:
+            print(f'Simplified {"text" if is_text else "drawing"}: {job.report}')
+        if not self.sync_mode:
+            estimate = time_estimator.estimate(job.gcode, self.machine_limits)
+            print(f'Estimated time for {"text" if is_text else "drawing"}: {estimate}')
+        if self.gcode_sender and job.gcode:
+            # Whole job goes out in one flow-controlled stream so the
+            # planner stays full; rejected lines are reported by the sender.
+            owner = None
+            if point_times is not None and len(point_times) and job.end is not None:
+                owner = self.latency_tracer.batch(point_times, job.end, job.gcode.count(b'\n'))
+            self.gcode_sender.stream(job.gcode, owner=owner)
+
+    def show_latency(self):
+        """Opens a window with sync mode's latency histograms."""
+        window = tk.Toplevel(self.root)
+        window.title("Sync latency")
+        text = tk.Text(window, width=90, height=20, font=('Courier', 12))
+        text.pack(fill='both', expand=True)
+
+        def refresh():
+            text.delete('1.0', tk.END)
+            text.insert(tk.END, self.latency_tracer.summary() + '\n\n')
+            for name, histogram in self.latency_tracer.histograms.items():
+                counts = histogram.counts
+                if not counts.any():
+                    continue
+                # One character per bin, from the first to the last non-empty one.
+                used = np.flatnonzero(counts)
+                counts = counts[used[0]:used[-1] + 1]
+                low = latency_tracer.BIN_EDGES[max(used[0] - 1, 0)] * 1000
+                high = latency_tracer.BIN_EDGES[min(used[-1], len(latency_tracer.BIN_EDGES) - 1)] * 1000
+                bars = ''.join(' ▁▂▃▄▅▆▇█'[int(np.ceil(8 * count / counts.max()))] for count in counts)
+                text.insert(tk.END, f'{name:<24} {low:.1f} ms |{bars}| {high:.1f} ms\n')
+
+        def save():
+            filename = filedialog.asksaveasfilename(defaultextension='.json',
+                                                    filetypes=[('JSON', '*.json')])
+            if filename:
+                self.latency_tracer.save(filename)
+        tk.Button(window, text="Refresh", command=refresh).pack(side='left')
+        tk.Button(window, text="Save as JSON", command=save).pack(side='left')
+        refresh()
 
 def main(argv):
     del argv  # unused
+    # Set here rather than on import, so importing this doesn't change them.
+    customtkinter.set_appearance_mode("dark")  # Modes: system (default), light, dark
+    customtkinter.set_default_color_theme("blue")  # Themes: blue (default), dark-blue, green
+    customtkinter.set_widget_scaling(2)  # widget dimensions and text size
+    customtkinter.DrawEngine.preferred_drawing_method = "circle_shapes"
     root = customtkinter.CTk()
     if SERIAL_PORT.value and SERIAL_PORT.value.lower() != 'none':
-        gcode_sender = g_code_sender.GCodeSender(SERIAL_PORT.value)
+        gcode_sender = g_code_sender.GCodeSender(SERIAL_PORT.value, status_rate=STATUS_RATE.value)
         app = DrawingApp(root, gcode_sender)
     else:
         # Loopback, port sends messages to itself.
-        gcode_sender = g_code_sender.GCodeSender(serial_port='loop://', allow_position_query=False)
+        gcode_sender = g_code_sender.GCodeSender(
+            serial_port='loop://', allow_position_query=False, flow_control=False)
         app = DrawingApp(root, gcode_sender)
         preview_app = virtual_plotter.VirtualPlotter(
             root, 
@@ -0,0 +1,282 @@
+r"""Times the drawing-to-G-code pipeline on synthetic drawings. Needs no display.
+
+python benchmarks.py --output=benchmarks.json
+
+Every benchmark runs on drawings of each --sizes points, made from seeded
+random walks so runs are comparable. send_loopback writes to loop://, with
+a thread reading the other end like the virtual plotter does, so it times
+the sender without flow control. send_flow_control streams to a simulated
+FluidNC whose moves take no time, so it times character counting and
+waiting for oks. Results are printed and saved as JSON.
+"""
+
+import dataclasses
+import json
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from absl import app
+from absl import flags
+import numpy as np
+from plotter_core import curve_fitter
+from plotter_core import g_code_sender
+from plotter_core import gcode_compiler
+from plotter_core import hershey
+from plotter_core import path_simplifier
+from plotter_core import simulated_fluidnc
+from plotter_core import stroke_buffer
+from plotter_core import stroke_index
+from plotter_core import time_estimator
+import gcode_renderer
+
+SIZES = flags.DEFINE_list('sizes', ['10', '1000', '100000', '1000000'],
+                          'Points in each synthetic drawing.')
+BENCHMARKS = flags.DEFINE_list('benchmarks', None, 'Benchmarks to run. All by default.')
+REPEATS = flags.DEFINE_integer('repeats', 5, 'Most times to run each benchmark.')
+MAX_SECONDS = flags.DEFINE_float(
+    'max_seconds', 10.0, 'Stop repeating a benchmark once it has run this long.')
+# loop:// moves bytes through a queue one at a time, ~250 kB/s.
+MAX_SERIAL_POINTS = flags.DEFINE_integer(
+    'max_serial_points', 100_000, 'Largest drawing to send to a serial port.')
+SEED = flags.DEFINE_integer('seed', 0, 'Seed for the synthetic drawings.')
+OUTPUT = flags.DEFINE_string('output', None, 'JSON file to save the results to.')
+
+CANVAS_WIDTH = gcode_compiler.PLOTTER_WIDTH * gcode_compiler.CANVAS_SCALE
+CANVAS_HEIGHT = gcode_compiler.PLOTTER_HEIGHT * gcode_compiler.CANVAS_SCALE
+SCALE = 1 / gcode_compiler.CANVAS_SCALE
+# How much faster than real time the simulated FluidNC moves, enough that
+# the planner is always empty.
+SIMULATOR_SPEEDUP = 1e9
+# Points per stroke in synthetic drawings, about one second of drawing.
+STROKE_POINTS = 200
+TEXT = 'The quick brown fox jumps over the lazy dog. '
+
+
+@dataclasses.dataclass
+class Result:
+    benchmark: str
+    points: int
+    runs: int
+    # Seconds per run.
+    best: float
+    median: float
+    # Points the benchmark produced, where that's meaningful.
+    output_points: int | None = None
+
+    @property
+    def points_per_second(self):
+        return self.points / self.best if self.best else float('inf')
+
+
+def make_drawing(points, rng, stroke_points=STROKE_POINTS):
+    """Random-walk strokes like freehand drawing, in canvas pixels.
+
+    Steps are never zero, since fit_bspline rejects repeated points.
+    """
+    drawing = stroke_buffer.StrokeBuffer(points)
+    for start in range(0, points, stroke_points):
+        count = min(stroke_points, points - start)
+        angles = np.cumsum(rng.normal(0, 0.3, count))
+        steps = rng.uniform(1, 4, count)[:, None] * np.column_stack((np.cos(angles), np.sin(angles)))
+        stroke = rng.uniform((0, 0), (CANVAS_WIDTH, CANVAS_HEIGHT)) + np.cumsum(steps, axis=0)
+        # Fold back into the canvas, keeping the path continuous.
+        size = np.array((CANVAS_WIDTH, CANVAS_HEIGHT))
+        stroke = size - np.abs(np.mod(stroke, 2 * size) - size)
+        drawing.add_stroke(stroke)
+    return drawing
+
+
+def fit_bspline(drawing, points):
+    """The original fit, for comparison with fit_strokes."""
+    strokes = list(drawing)
+    return lambda: sum(len(gcode_compiler.fit_bspline(stroke)) for stroke in strokes)
+
+
+def fit_strokes(drawing, points):
+    """curve_fitter on the whole drawing, in mm like compile_strokes runs it."""
+    strokes = [stroke * SCALE for stroke in drawing]
+    return lambda: sum(len(stroke) for stroke in curve_fitter.fit_strokes(strokes))
+
+
+def compile_polylines(drawing, points):
+    strokes = list(drawing)
+    return lambda: gcode_compiler.compile_strokes(strokes, SCALE, SCALE, CANVAS_HEIGHT)
+
+
+def compile_simplified(drawing, points):
+    strokes = list(drawing)
+    return lambda: gcode_compiler.compile_strokes(
+        strokes, SCALE, SCALE, CANVAS_HEIGHT, tolerance=path_simplifier.DEFAULT_TOLERANCE)
+
+
+def generate_gcode(drawing, points):
+    """What "Draw!" does with a drawing: fit, simplify and compile."""
+    strokes = list(drawing)
+    return lambda: gcode_compiler.compile_strokes(
+        strokes, SCALE, SCALE, CANVAS_HEIGHT, tolerance=path_simplifier.DEFAULT_TOLERANCE,
+        fit_tolerance=curve_fitter.DEFAULT_TOLERANCE)
+
+
+def _within_canvas(x, y):
+    return 0 <= x <= CANVAS_WIDTH and 0 <= y <= CANVAS_HEIGHT
+
+
+def text_layout(drawing, points):
+    """Lays out one character per point as a page of wrapped lines."""
+    text = (TEXT * (points // len(TEXT) + 1))[:points]
+
+    def lay_out():
+        hershey.glyph.cache_clear()
+        hershey.layout(text, (0, 40), 2, width=CANVAS_WIDTH, fits=_within_canvas)
+    return lay_out
+
+
+def index_queries(drawing, points):
+    """Picks a stroke and finds those in a rectangle, as erasing and
+    selecting do, once per 100 px square across the canvas."""
+    index = stroke_index.StrokeIndex()
+    index.add_strokes(drawing)
+    corners = [(x, y) for x in range(0, CANVAS_WIDTH, 100) for y in range(0, CANVAS_HEIGHT, 100)]
+
+    def query():
+        for x, y in corners:
+            index.pick(x, y, 6)
+            index.in_region(x, y, x + 100, y + 100)
+    return query
+
+
+def _polyline_gcode(drawing):
+    return gcode_compiler.compile_strokes(list(drawing), SCALE, SCALE, CANVAS_HEIGHT).gcode
+
+
+def render_preview(drawing, points):
+    """The virtual plotter's parsing and drawing, without Tk."""
+    lines = _polyline_gcode(drawing).decode().splitlines()
+    return lambda: gcode_renderer.render(lines, gcode_compiler.PLOTTER_WIDTH,
+                                         gcode_compiler.PLOTTER_HEIGHT, gcode_compiler.CANVAS_SCALE)
+
+
+def estimate_time(drawing, points):
+    gcode = _polyline_gcode(drawing)
+    return lambda: time_estimator.estimate(gcode)
+
+
+def send_loopback(drawing, points):
+    """Streams a compiled drawing through GCodeSender on loop:// until it's all read back."""
+    if points > MAX_SERIAL_POINTS.value:
+        return None
+    gcode = _polyline_gcode(drawing)
+
+    def send():
+        sender = g_code_sender.GCodeSender('loop://', allow_position_query=False,
+                                           flow_control=False)
+        port = sender.serial_instance
+        expected = len(gcode) + len('G90 G21\n')
+        received = 0
+
+        def read():
+            nonlocal received
+            while received < expected:
+                received += len(port.read(port.in_waiting or 1))
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+        sender.stream(gcode)
+        reader.join()
+        sender.close()
+    return send
+
+
+def send_flow_control(drawing, points):
+    """Streams a compiled drawing to a simulated FluidNC until every line is acknowledged."""
+    if points > MAX_SERIAL_POINTS.value:
+        return None
+    gcode = _polyline_gcode(drawing)
+
+    def send():
+        controller = simulated_fluidnc.SimulatedFluidNC(speedup=SIMULATOR_SPEEDUP)
+        sender = g_code_sender.GCodeSender(controller.url, flow_control=True)
+        sender.stream(gcode, wait=True)
+        sender.close()
+        controller.close()
+    return send
+
+
+BENCHMARK_FUNCTIONS = {
+    'fit_bspline': fit_bspline,
+    'fit_strokes': fit_strokes,
+    'compile_polylines': compile_polylines,
+    'compile_simplified': compile_simplified,
+    'generate_gcode': generate_gcode,
+    'text_layout': text_layout,
+    'index_queries': index_queries,
+    'render_preview': render_preview,
+    'estimate_time': estimate_time,
+    'send_loopback': send_loopback,
+    'send_flow_control': send_flow_control,
+}
+
+
+def run(name, setup, drawing, points):
+    """Times a benchmark, or returns None if it doesn't run at this size."""
+    function = setup(drawing, points)
+    if function is None:
+        return None
+    times = []
+    while len(times) < REPEATS.value and sum(times) < MAX_SECONDS.value:
+        start_time = time.perf_counter()
+        output = function()
+        times.append(time.perf_counter() - start_time)
+    return Result(name, points, len(times), min(times), statistics.median(times),
+                  output if isinstance(output, int) else None)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'seed': SEED.value,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def main(argv):
+    del argv  # unused
+    names = BENCHMARKS.value or list(BENCHMARK_FUNCTIONS)
+    unknown = set(names) - set(BENCHMARK_FUNCTIONS)
+    if unknown:
+        raise app.UsageError(f'Unknown benchmarks: {", ".join(sorted(unknown))}')
+    results = []
+    print(f'{"benchmark":<20} {"points":>9} {"runs":>4} {"best s":>10} {"median s":>10} '
+          f'{"points/s":>12} {"out points":>10}')
+    for points in (int(size) for size in SIZES.value):
+        drawing = make_drawing(points, np.random.default_rng(SEED.value))
+        for name in names:
+            result = run(name, BENCHMARK_FUNCTIONS[name], drawing, points)
+            if result is None:
+                continue
+            results.append(result)
+            print(f'{result.benchmark:<20} {result.points:>9} {result.runs:>4} '
+                  f'{result.best:>10.4f} {result.median:>10.4f} {result.points_per_second:>12.0f} '
+                  f'{"" if result.output_points is None else result.output_points:>10}')
+    if OUTPUT.value:
+        with open(OUTPUT.value, 'w') as f:
+            json.dump({'environment': environment(),
+                       'results': [dict(dataclasses.asdict(result),
+                                        points_per_second=result.points_per_second)
+                                   for result in results]},
+                      f, indent=2)
+        print(f'Saved results to {OUTPUT.value}')
+
+
+if __name__ == '__main__':
+    app.run(main)
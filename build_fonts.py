@@ -0,0 +1,25 @@
+r"""Packs Hershey .jhf fonts into the store hershey.py reads.
+
+python build_fonts.py plotter_core/fonts/*.jhf
+
+Each file becomes a face named after it.
+"""
+
+import os
+from absl import app
+from absl import flags
+from plotter_core import hershey
+
+OUTPUT = flags.DEFINE_string('output', hershey.STORE_PATH, 'Store to write.')
+
+
+def main(argv):
+    paths = argv[1:]
+    if not paths:
+        raise app.UsageError('Give .jhf files to pack.')
+    hershey.write_store(paths, OUTPUT.value)
+    print(f'Packed {len(paths)} faces into {OUTPUT.value}, {os.path.getsize(OUTPUT.value)} bytes')
+
+
+if __name__ == '__main__':
+    app.run(main)
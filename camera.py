@@ -0,0 +1,126 @@
+"""Reads camera frames on their own thread, keeping only the newest.
+
+A loop that reads a frame, processes it and shows it falls behind whenever
+a step is slow, and the frames queued in the driver make it fall further
+behind. Here capture, processing and display each run on their own
+thread, handing over through LatestSlots that hold one item: a new item
+replaces one that wasn't taken yet, so every stage works on the freshest
+frame and drops the rest.
+"""
+
+import dataclasses
+import threading
+import time
+import cv2
+
+
+class LatestSlot:
+    """Holds the newest item put in it, until it's taken."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self._full = False
+        self.closed = False
+        # Items put, and items replaced before they were taken.
+        self.items = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            self.items += 1
+            if self._full:
+                self.dropped += 1
+            self._item, self._full = item, True
+            self._condition.notify_all()
+
+    def get(self, timeout=None):
+        """Takes the item, waiting up to timeout seconds for one.
+
+        Returns None on timeout, or once the slot is closed and empty.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._full or self.closed, timeout)
+            item, self._item, self._full = self._item, None, False
+            return item
+
+    def close(self):
+        """No more items are coming. Wakes up anything waiting."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    @property
+    def finished(self):
+        """Closed with nothing left to take."""
+        with self._condition:
+            return self.closed and not self._full
+
+
+@dataclasses.dataclass(frozen=True)
+class Frame:
+    image: object
+    # Frames captured before this one.
+    number: int
+    # time.perf_counter() when it was read from the camera.
+    captured: float
+
+    @property
+    def age(self):
+        return time.perf_counter() - self.captured
+
+
+class Capture:
+    """Reads frames from a cv2.VideoCapture into frames until it runs out or is closed."""
+
+    def __init__(self, video_capture):
+        self.video_capture = video_capture
+        # Ask the driver not to queue frames either. Not every backend can.
+        video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.frames = LatestSlot()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='capture', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        number = 0
+        try:
+            while not self._stop.is_set():
+                ok, image = self.video_capture.read()
+                if not ok:
+                    break
+                self.frames.put(Frame(image, number, time.perf_counter()))
+                number += 1
+        finally:
+            self.frames.close()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.video_capture.release()
+
+
+def process(source, function, name='process'):
+    """Applies function to each item taken from source on a new thread.
+
+    Returns the LatestSlot the results are put in, which is closed once
+    source is finished. Results are (item, function(item)).
+    """
+    results = LatestSlot()
+
+    def run():
+        try:
+            while not source.finished:
+                item = source.get()
+                if item is not None:
+                    results.put((item, function(item)))
+        finally:
+            results.close()
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return results
+
+
+def stats(capture, results, frame):
+    """One line of frame age and dropped-frame counts for a preview."""
+    return (f'age {frame.age * 1000:.0f} ms, dropped {capture.frames.dropped} captured '
+            f'+ {results.dropped} processed of {capture.frames.items}')
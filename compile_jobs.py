@@ -0,0 +1,192 @@
+r"""Compiles drawings, SVGs, images and text into .gcode files without a display.
+
+Jobs are compiled in parallel, one per process.
+
+python compile_jobs.py --output_dir=out drawing.npz logo.svg --text="Hello"
+
+Drawings are .npz files saved from the app. SVGs are drawn at their real
+size, with the document's top left corner at the canvas's, which is the
+plotter's top left. Images (.png, .jpg...) are hatched or
+stippled to fill the plotter, as set by --raster_style.
+"""
+
+import concurrent.futures
+import dataclasses
+import os
+import time
+from absl import app
+from absl import flags
+from plotter_core import curve_fitter
+from plotter_core import gcode_compiler
+from plotter_core import hershey
+from plotter_core import path_optimizer
+from plotter_core import path_simplifier
+from plotter_core import stroke_buffer
+from plotter_core import svg_import
+from plotter_core import time_estimator
+import raster
+
+OUTPUT_DIR = flags.DEFINE_string('output_dir', '.', 'Where the .gcode files are written.')
+TEXT = flags.DEFINE_multi_string(
+    'text', [], 'Text to write in a Hershey font, with \\n between lines. One job each.')
+FONT_SIZE = flags.DEFINE_integer('font_size', 1, 'Canvas pixels per font unit for --text.')
+FONT = flags.DEFINE_string('font', hershey.DEFAULT_FACE, 'Hershey font face for --text.')
+TEXT_ALIGN = flags.DEFINE_enum('text_align', 'left', hershey.ALIGNMENTS, 'How --text lines line up.')
+TEXT_WIDTH = flags.DEFINE_float(
+    'text_width', None, 'Width in mm to wrap --text within. Defaults to the rest of the plotter.')
+WORKERS = flags.DEFINE_integer('workers', os.cpu_count(), 'Processes to compile jobs with.')
+OPTIMIZE_TRAVEL = flags.DEFINE_bool(
+    'optimize_travel', True, 'Reorder and reverse strokes to shorten pen-up travel.')
+CHORD_TOLERANCE = flags.DEFINE_float(
+    'chord_tolerance', path_simplifier.DEFAULT_TOLERANCE,
+    'How far in mm simplified paths and fitted arcs may stray from the '
+    'original. 0 sends one G1 per point.')
+FIT_TOLERANCE = flags.DEFINE_float(
+    'fit_tolerance', curve_fitter.DEFAULT_TOLERANCE,
+    'How far in mm smoothed drawings may be resampled from the smoothed '
+    'stroke.')
+RASTER_STYLE = flags.DEFINE_enum(
+    'raster_style', 'crosshatch', raster.STYLES, 'How images are drawn.')
+MACHINE_SETTINGS = flags.DEFINE_string(
+    'machine_settings', None,
+    'File with the plotter\'s FluidNC $ settings ($110, $120, $11...), as '
+    'printed by $$, for time estimates. Defaults are used without one.')
+
+CANVAS_WIDTH = gcode_compiler.PLOTTER_WIDTH * gcode_compiler.CANVAS_SCALE
+CANVAS_HEIGHT = gcode_compiler.PLOTTER_HEIGHT * gcode_compiler.CANVAS_SCALE
+# Where text starts, like the app's default text anchor.
+TEXT_LEFT_CORNER = (100, CANVAS_HEIGHT // 2)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+@dataclasses.dataclass(frozen=True)
+class Job:
+    name: str
+    # Input file, or the text to write.
+    source: str
+    is_text: bool = False
+
+
+@dataclasses.dataclass(frozen=True)
+class Options:
+    # Flags are only parsed in the main process, so workers get these.
+    output_dir: str
+    font_size: int
+    font: str
+    text_align: str
+    # In canvas pixels.
+    text_width: float
+    optimize_travel: bool
+    chord_tolerance: float
+    fit_tolerance: float
+    raster_style: str
+    machine_limits: time_estimator.MachineLimits
+
+
+@dataclasses.dataclass(frozen=True)
+class Result:
+    name: str
+    path: str
+    strokes: int
+    lines: int
+    bytes: int
+    seconds: float
+    # How long the job should take to plot.
+    estimate: time_estimator.Estimate
+
+
+def _within_canvas(x, y):
+    return 0 <= x <= CANVAS_WIDTH and 0 <= y <= CANVAS_HEIGHT
+
+
+def text_strokes(text, scale, left_corner=TEXT_LEFT_CORNER, width=None, align='left',
+                 face_name=hershey.DEFAULT_FACE):
+    """Canvas strokes for text, wrapped within width canvas pixels of left_corner."""
+    if width is None:
+        width = CANVAS_WIDTH - left_corner[0]
+    lines = hershey.layout(text, left_corner, scale, width=width, align=align,
+                           face_name=face_name, fits=_within_canvas)
+    return [stroke for line in lines for placed in line.glyphs
+            for stroke in placed.strokes if len(stroke) > 1]
+
+
+def load_strokes(job, options):
+    """Canvas strokes for a job, and the tolerance to smooth them with, if any."""
+    if job.is_text:
+        return text_strokes(job.source, options.font_size, width=options.text_width,
+                            align=options.text_align, face_name=options.font), None
+    if job.source.lower().endswith('.svg'):
+        strokes, _ = svg_import.load(job.source)
+        return [stroke * gcode_compiler.CANVAS_SCALE for stroke in strokes], None
+    if job.source.lower().endswith(IMAGE_EXTENSIONS):
+        # Jobs already have a process each.
+        return list(raster.image_strokes(job.source, options.raster_style, workers=1)), None
+    # Drawings are freehand, so they're smoothed like the app does.
+    return list(stroke_buffer.StrokeBuffer.load(job.source)), options.fit_tolerance
+
+
+def compile_job(job, options):
+    """Compiles one job to a .gcode file. Runs in a worker process."""
+    start_time = time.perf_counter()
+    strokes, fit_tolerance = load_strokes(job, options)
+    if options.optimize_travel and len(strokes) > 1:
+        strokes, _ = path_optimizer.optimize_stroke_order(strokes, start=(0, CANVAS_HEIGHT))
+    scale = 1 / gcode_compiler.CANVAS_SCALE
+    compiled = gcode_compiler.compile_strokes(
+        strokes, scale, scale, CANVAS_HEIGHT, tolerance=options.chord_tolerance,
+        fit_tolerance=fit_tolerance)
+    path = os.path.join(options.output_dir, job.name + '.gcode')
+    with open(path, 'wb') as f:
+        f.write(compiled.gcode)
+    estimate = time_estimator.estimate(compiled.gcode, options.machine_limits)
+    return Result(job.name, path, len(strokes), compiled.gcode.count(b'\n'),
+                  len(compiled.gcode), time.perf_counter() - start_time, estimate)
+
+
+def make_jobs(paths, texts):
+    jobs = [Job(os.path.splitext(os.path.basename(path))[0], path) for path in paths]
+    # Shells pass "\n" through as a backslash and an n.
+    jobs.extend(Job(f'text_{i}', text.replace('\\n', '\n'), is_text=True)
+                for i, text in enumerate(texts, 1))
+    # Two inputs with the same name would overwrite each other's output.
+    names = [job.name for job in jobs]
+    return [dataclasses.replace(job, name=f'{job.name}_{i}') if names.count(job.name) > 1 else job
+            for i, job in enumerate(jobs, 1)]
+
+
+def main(argv):
+    jobs = make_jobs(argv[1:], TEXT.value)
+    if not jobs:
+        raise app.UsageError('Give .npz, .svg or image files to compile, or --text.')
+    os.makedirs(OUTPUT_DIR.value, exist_ok=True)
+    text_width = None if TEXT_WIDTH.value is None else TEXT_WIDTH.value * gcode_compiler.CANVAS_SCALE
+    options = Options(OUTPUT_DIR.value, FONT_SIZE.value, FONT.value, TEXT_ALIGN.value, text_width,
+                      OPTIMIZE_TRAVEL.value,
+                      CHORD_TOLERANCE.value, FIT_TOLERANCE.value, RASTER_STYLE.value,
+                      time_estimator.load_limits(MACHINE_SETTINGS.value))
+    start_time = time.perf_counter()
+    failed = 0
+    plot_seconds = 0.0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=WORKERS.value) as pool:
+        futures = {pool.submit(compile_job, job, options): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f'{job.name}: failed: {e!r}')
+                continue
+            plot_seconds += result.estimate.seconds
+            print(f'{result.name}: {result.strokes} strokes, {result.lines} lines, '
+                  f'{result.bytes} bytes in {result.seconds:.2f} s -> {result.path}, '
+                  f'about {result.estimate} to plot')
+    print(f'Compiled {len(jobs) - failed} of {len(jobs)} jobs in '
+          f'{time.perf_counter() - start_time:.2f} s, about '
+          f'{time_estimator.format_duration(plot_seconds)} to plot')
+    if failed:
+        return 1
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -1,28 +1,50 @@
 """Connects to webcam and tracks the most red part of the image as if it were drawing.
 
 Works pretty well against a white background, using a pen with a red rubber band 
-scrunched around the bottom. Outputs the trajectory to a tkinter canvas.
+scrunched around the bottom. The smoothed trajectory is plotted as it's drawn,
+on the virtual plotter unless --serial_port is given.
 """
 
 import tkinter as tk
-import Main
+import time
+import camera
 import cv2
 from absl import app
 from absl import flags
 import numpy as np
-import dataclasses
+from plotter_core import g_code_sender
+from plotter_core import gcode_compiler
+import pen_tracker
+import video_plotter
+import virtual_plotter
 
 CAMERA_INDEX = flags.DEFINE_integer("camera_index", None, "Which camera to stream from.")
 BLUR_RADIUS = flags.DEFINE_integer(
-    "blur_radius", 41, "How much to blur image before finding reddest region. Odd.")
+    "blur_radius", pen_tracker.DEFAULT_BLUR_RADIUS,
+    "How much to blur image before finding reddest region. Odd.")
+TRACKER = flags.DEFINE_enum(
+    "tracker", "roi", ["roi", "full"],
+    "roi searches a downscaled copy of the frame near where the pen last was; "
+    "full blurs and searches the whole frame at full resolution.")
+TRACK_SCALE = flags.DEFINE_integer(
+    "track_scale", pen_tracker.DEFAULT_SCALE, "How much roi downscales frames for its coarse search.")
+ROI_RADIUS = flags.DEFINE_integer(
+    "roi_radius", pen_tracker.DEFAULT_ROI_RADIUS,
+    "Pixels around the last pen position that roi searches before scanning the whole frame.")
+MIN_REDNESS = flags.DEFINE_integer(
+    "min_redness", pen_tracker.DEFAULT_MIN_REDNESS,
+    "Blurred redness (0-255) below which roi treats the pen as lost.")
+SERIAL_PORT = flags.DEFINE_string(
+    "serial_port", None, "Port for plotter, e.g. /dev/ttyUSB0. Draws on the virtual plotter without one.")
+MAX_DELAY = flags.DEFINE_float(
+    "max_delay", video_plotter.DEFAULT_MAX_DELAY,
+    "Most seconds from a frame being captured to the plotter drawing it. Points "
+    "are dropped when the plotter can't keep up.")
 
 BLUE = (255, 0, 0)
-
-@dataclasses.dataclass
-class CanvasPoint:
-    x: float
-    y: float
-
+GREEN = (0, 255, 0)
+# Frames to average processing time over.
+TIMING_WINDOW = 30
 
 def reddest_pixel(image):
     """Coordinates of the brightest single pixel in the image."""
@@ -33,30 +55,95 @@ def reddest_pixel(image):
     return max_coords, cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
 
 
+def track(tracker, frame):
+    """Pen position, or None if it's lost, and the preview to show, using --tracker."""
+    if tracker is None:
+        return reddest_pixel(frame)
+    detection = tracker.track(frame)
+    x0, y0, x1, y1 = detection.region
+    cv2.rectangle(frame, (x0, y0), (x1 - 1, y1 - 1), GREEN, 1)
+    return detection.point if detection.found else None, frame
+
+
 def main(argv):
     video_capture = cv2.VideoCapture(CAMERA_INDEX.value)
-    if video_capture.isOpened(): # try to get the first frame
-        rval, frame = video_capture.read()
-        frame = cv2.rotate(frame, cv2.ROTATE_180)
+    if not video_capture.isOpened():
+        return
+    root = None
+    if SERIAL_PORT.value:
+        gcode_sender = g_code_sender.GCodeSender(SERIAL_PORT.value)
     else:
-        rval = False
-    root = tk.Tk()
+        # Loopback, port sends messages to itself.
+        gcode_sender = g_code_sender.GCodeSender(
+            serial_port="loop://", allow_position_query=False, flow_control=False)
+        root = tk.Tk()
+        root.withdraw()
+        virtual_plotter.VirtualPlotter(
+            root, gcode_sender.serial_instance,
+            plotter_width=gcode_compiler.PLOTTER_WIDTH,
+            plotter_height=gcode_compiler.PLOTTER_HEIGHT,
+            canvas_scale=gcode_compiler.CANVAS_SCALE)
     cv2.namedWindow("preview")
-    app = Main.DrawingApp(root)
-    while rval:
-        pixel, frame = reddest_pixel(frame)
-        cv2.circle(img=frame, center=pixel, radius=BLUR_RADIUS.value, color=BLUE, thickness=2)
-        pixel_in_frame = np.asarray(pixel) / np.asarray(frame.shape[:2]) * np.array((200*5, 280*5))
-        canvas_point = CanvasPoint(*pixel_in_frame)
-        app.draw(canvas_point)
-        cv2.imshow("preview", frame)
-        key = cv2.waitKey(20)
-        root.update_idletasks()
-        root.update()
-        rval, frame = video_capture.read()
-        frame = cv2.rotate(frame, cv2.ROTATE_180)
-    video_capture.release()
+    tracker = None
+    if TRACKER.value == "roi":
+        tracker = pen_tracker.PenTracker(BLUR_RADIUS.value, TRACK_SCALE.value, ROI_RADIUS.value,
+                                         MIN_REDNESS.value)
+    plotter = None
+    frame_times = []
+
+    def process(frame):
+        nonlocal plotter
+        start_time = time.perf_counter()
+        image = cv2.rotate(frame.image, cv2.ROTATE_180)
+        if plotter is None:
+            height, width = image.shape[:2]
+            plotter = video_plotter.VideoPlotter(gcode_sender, (width, height),
+                                                 max_delay=MAX_DELAY.value)
+        pixel, image = track(tracker, image)
+        smoothed = plotter.add(pixel, frame.captured)
+        frame_times.append(time.perf_counter() - start_time)
+        return pixel, smoothed, image
+
+    # Frames are captured, tracked and plotted on their own threads. This
+    # one only shows the newest result and runs Tk, which has to stay on it.
+    capture = camera.Capture(video_capture)
+    results = camera.process(capture.frames, process, name="track")
+    while not results.finished:
+        result = results.get(timeout=0.01)
+        if result is not None:
+            frame, (pixel, smoothed, image) = result
+            if pixel is not None:
+                cv2.circle(img=image, center=pixel, radius=BLUR_RADIUS.value, color=BLUE,
+                           thickness=2)
+            if smoothed is not None:
+                cv2.circle(img=image, center=tuple(round(v) for v in smoothed), radius=5,
+                           color=GREEN, thickness=-1)
+            cv2.putText(image, f"{np.mean(frame_times[-TIMING_WINDOW:]) * 1000:.1f} ms/frame, "
+                        f"{camera.stats(capture, results, frame)}", (10, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, BLUE, 2)
+            cv2.imshow("preview", image)
+        key = cv2.waitKey(1)
+        if key == 27: # exit on ESC
+            break
+        if root is not None:
+            root.update_idletasks()
+            root.update()
+    capture.close()
+    # Wait for the tracking thread, which uses plotter.
+    while not results.finished:
+        results.get()
+    if plotter is not None:
+        plotter.close()
+        print(plotter.stats)
     cv2.destroyWindow("preview")
+    if frame_times:
+        print(f"Tracked {len(frame_times)} frames, {np.median(frame_times) * 1000:.1f} ms median, "
+              f"{np.percentile(frame_times, 95) * 1000:.1f} ms 95th percentile per frame. Dropped "
+              f"{capture.frames.dropped} of {capture.frames.items} captured frames and "
+              f"{results.dropped} tracked ones.")
+    # Let the plotter finish before closing the port.
+    gcode_sender.stream("", wait=True)
+    gcode_sender.close()
 
 if __name__ == "__main__":
     app.run(main)
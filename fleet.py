@@ -0,0 +1,212 @@
+r"""Keeps several plotters busy from one shared queue of G-code jobs.
+
+python fleet.py --ports=/dev/ttyUSB0,/dev/ttyUSB1,/dev/ttyUSB2 out/*.gcode
+
+Jobs are .gcode files, e.g. from compile_jobs.py. Each plotter has its own
+GCodeSender, and an asyncio loop runs one worker per plotter: once its
+plotter reports Idle, a worker takes the next job from the queue, streams
+it and waits for the plotter to report Idle again after the last line. So
+jobs go to whichever plotter frees up first, and a plotter that's held or
+alarmed takes no more work while the others carry on.
+
+loop:// ports stand in for plotters, e.g. --ports=loop://,loop://. Each
+is a simulated FluidNC that plans, acknowledges and runs lines and reports
+status like a plotter does, --simulation_speedup times faster.
+"""
+
+import asyncio
+import dataclasses
+import os
+import time
+from absl import app
+from absl import flags
+from plotter_core import g_code_sender
+from plotter_core import simulated_fluidnc
+from plotter_core import time_estimator
+
+PORTS = flags.DEFINE_list('ports', ['loop://', 'loop://'], 'Serial port of each plotter.')
+STATUS_RATE = flags.DEFINE_float(
+    'status_rate', g_code_sender.STATUS_RATE,
+    'Status reports requested from each plotter per second.')
+SIMULATION_SPEEDUP = flags.DEFINE_float(
+    'simulation_speedup', 10, 'How many times faster than real time loop:// plotters run.')
+
+# Status a plotter has to report before it's given a job, and after one to
+# have finished it.
+IDLE_STATE = 'Idle'
+
+
+@dataclasses.dataclass(frozen=True)
+class Job:
+    name: str
+    path: str
+
+
+@dataclasses.dataclass(frozen=True)
+class JobResult:
+    job: Job
+    plotter: str
+    # Lines sent, not counting blank ones.
+    lines: int
+    bytes: int
+    # From taking the job to the plotter being idle again.
+    seconds: float
+    # (line number, line, reply) for each line the plotter rejected.
+    errors: tuple
+
+
+@dataclasses.dataclass
+class PlotterStats:
+    jobs: int = 0
+    lines: int = 0
+    bytes: int = 0
+    errors: int = 0
+    # Time spent on jobs, in seconds.
+    busy: float = 0.0
+
+    def add(self, result):
+        self.jobs += 1
+        self.lines += result.lines
+        self.bytes += result.bytes
+        self.errors += len(result.errors)
+        self.busy += result.seconds
+
+    def summary(self, elapsed):
+        """One line of throughput over elapsed seconds."""
+        lines_per_second = self.lines / self.busy if self.busy else 0.0
+        jobs_per_hour = self.jobs / elapsed * 3600 if elapsed else 0.0
+        utilization = self.busy / elapsed if elapsed else 0.0
+        return (f'{self.jobs} jobs, {self.lines} lines, {self.errors} errors, busy '
+                f'{time_estimator.format_duration(self.busy)} ({utilization:.0%}), '
+                f'{lines_per_second:.0f} lines/s, {jobs_per_hour:.1f} jobs/h')
+
+
+class Plotter:
+    """One plotter of the fleet. Created on the fleet's event loop."""
+
+    def __init__(self, name, port, status_rate=g_code_sender.STATUS_RATE, simulation_speedup=1.0):
+        self.name = name
+        self.controller = None
+        if port.startswith('loop://'):
+            self.controller = simulated_fluidnc.SimulatedFluidNC(simulation_speedup)
+            port = self.controller.url
+        self.sender = g_code_sender.GCodeSender(port, status_rate=status_rate)
+        self.stats = PlotterStats()
+        # Set from the sender's I/O thread whenever a status report arrives.
+        self._status_changed = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self.sender.status_listeners.append(
+            lambda status: loop.call_soon_threadsafe(self._status_changed.set))
+
+    async def wait_idle(self, after=0.0):
+        """Waits for the plotter to report Idle in a report from after
+        time.monotonic() on."""
+        while True:
+            self._status_changed.clear()
+            status = self.sender.status
+            if status is not None and status.state == IDLE_STATE and status.timestamp >= after:
+                return
+            await self._status_changed.wait()
+
+    async def plot(self, job):
+        """Streams a job and waits for the plotter to finish it."""
+        start_time = time.monotonic()
+        first_error = len(self.sender.errors)
+        file_job = await asyncio.to_thread(self.sender.send_file, job.path, wait=True)
+        # Every line is acknowledged, but the last ones may still be moving.
+        await self.wait_idle(after=time.monotonic())
+        return JobResult(job, self.name, file_job.acknowledged_count, os.path.getsize(job.path),
+                         time.monotonic() - start_time,
+                         tuple(self.sender.errors[first_error:]))
+
+    def stop(self):
+        """Drops what's queued and holds the plotter where it is."""
+        self.sender.clear_queue()
+        self.sender.send_stop()
+
+    def close(self):
+        self.sender.close()
+        if self.controller:
+            self.controller.close()
+
+
+async def _work(plotter, jobs, on_result):
+    while True:
+        await plotter.wait_idle()
+        job = await jobs.get()
+        try:
+            result = await plotter.plot(job)
+        except asyncio.CancelledError:
+            plotter.stop()
+            raise
+        except Exception as e:
+            print(f'{job.name}: failed on {plotter.name}: {e!r}')
+            continue
+        finally:
+            jobs.task_done()
+        plotter.stats.add(result)
+        on_result(result)
+
+
+async def run(ports, jobs, status_rate=g_code_sender.STATUS_RATE, on_result=print,
+              simulation_speedup=1.0):
+    """Plots every job on the plotters at ports, each on the first plotter free.
+
+    Args:
+        ports: Serial port of each plotter.
+        jobs: Jobs to plot.
+        status_rate: Status reports requested from each plotter per second.
+        on_result: Called with each JobResult as it's finished.
+        simulation_speedup: How many times faster than real time loop://
+            plotters run.
+
+    Returns:
+        The PlotterStats of each plotter, by name, and the seconds taken.
+    """
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    plotters = []
+    workers = []
+    try:
+        for i, port in enumerate(ports, 1):
+            plotters.append(Plotter(f'plotter_{i} ({port})', port, status_rate,
+                                    simulation_speedup))
+        start_time = time.monotonic()
+        workers = [asyncio.create_task(_work(plotter, queue, on_result))
+                   for plotter in plotters]
+        # Workers only return by failing, which shouldn't wait for the queue.
+        done, _ = await asyncio.wait([asyncio.create_task(queue.join()), *workers],
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+        return {plotter.name: plotter.stats for plotter in plotters}, time.monotonic() - start_time
+    finally:
+        # Also stops any plotter still plotting, if this was cancelled.
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for plotter in plotters:
+            plotter.close()
+
+
+def main(argv):
+    jobs = [Job(os.path.splitext(os.path.basename(path))[0], path) for path in argv[1:]]
+    if not jobs:
+        raise app.UsageError('Give .gcode files to plot.')
+
+    def report(result):
+        errors = f', {len(result.errors)} rejected lines' if result.errors else ''
+        print(f'{result.job.name}: {result.lines} lines on {result.plotter} in '
+              f'{time_estimator.format_duration(result.seconds)}{errors}')
+    stats, elapsed = asyncio.run(run(PORTS.value, jobs, STATUS_RATE.value, report,
+                                     SIMULATION_SPEEDUP.value))
+    print(f'Plotted {sum(plotter_stats.jobs for plotter_stats in stats.values())} of '
+          f'{len(jobs)} jobs on {len(stats)} plotters in '
+          f'{time_estimator.format_duration(elapsed)}')
+    for name, plotter_stats in stats.items():
+        print(f'{name}: {plotter_stats.summary(elapsed)}')
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,75 @@
+"""Renders G-code into an offscreen image of what the plotter would draw."""
+
+import threading
+from PIL import Image
+from PIL import ImageDraw
+from plotter_core import gcode_parser
+
+PEN_UP_MARKER = 'red'
+PEN_DOWN_MARKER = 'purple'
+
+
+class PlotRenderer:
+    """Draws G-code onto a Pillow image.
+
+    Safe to feed from one thread while another takes snapshots.
+    """
+
+    def __init__(self, plotter_width, plotter_height, scale, line_width=2, color='black',
+                 marker_radius=4):
+        self.scale = scale
+        self.height = plotter_height
+        self.line_width = line_width
+        self.color = color
+        self.marker_radius = marker_radius
+        self.image = Image.new('RGB', (plotter_width * scale, plotter_height * scale), 'white')
+        self._draw = ImageDraw.Draw(self.image)
+        self.interpreter = gcode_parser.GCodeInterpreter()
+        self._lock = threading.Lock()
+        # Set whenever the image changes, cleared by snapshot().
+        self.dirty = False
+        self.lines = 0
+
+    def _to_pixels(self, x, y):
+        return x * self.scale, (self.height - y) * self.scale
+
+    def feed(self, line):
+        """Draws one line of G-code."""
+        move = self.interpreter.execute(line)
+        self.lines += 1
+        if move is None:
+            return
+        with self._lock:
+            if move.pen_changed:
+                x, y = self._to_pixels(*move.start)
+                r = self.marker_radius
+                self._draw.ellipse((x - r, y - r, x + r, y + r),
+                                   fill=PEN_DOWN_MARKER if move.pen_down else PEN_UP_MARKER,
+                                   outline='black')
+                self.dirty = True
+            if move.pen_down and not move.pen_changed:
+                points = [self._to_pixels(*move.start)]
+                points.extend(self._to_pixels(x, y) for x, y in move.points.tolist())
+                self._draw.line(points, fill=self.color, width=self.line_width, joint='curve')
+                self.dirty = True
+
+    def feed_lines(self, lines):
+        for line in lines:
+            self.feed(line)
+
+    def snapshot(self):
+        """A copy of the image as it is now."""
+        with self._lock:
+            self.dirty = False
+            return self.image.copy()
+
+    def save(self, path):
+        """Saves the image, e.g. as a PNG."""
+        self.snapshot().save(path)
+
+
+def render(lines, plotter_width, plotter_height, scale, **kwargs):
+    """Renders G-code lines to a new image, without any GUI."""
+    renderer = PlotRenderer(plotter_width, plotter_height, scale, **kwargs)
+    renderer.feed_lines(lines)
+    return renderer.image
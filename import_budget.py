@@ -0,0 +1,70 @@
+r"""Checks every plotter_core module imports quickly, without GUI or SciPy modules.
+
+python import_budget.py --budget_ms=150
+
+Each module is imported in a fresh interpreter with -X importtime, since
+a module that's already imported costs nothing. The best of --runs is
+compared with the budget, and includes NumPy, which most modules need.
+Exits with status 1 if any module is over budget or imports something it
+shouldn't, which fails the CI checks in .github/workflows/checks.yml.
+"""
+
+import pkgutil
+import subprocess
+import sys
+from absl import app
+from absl import flags
+import plotter_core
+
+BUDGET_MS = flags.DEFINE_float('budget_ms', 150, 'Most each module may take to import, in ms.')
+RUNS = flags.DEFINE_integer('runs', 3, 'Imports timed per module. The fastest counts.')
+
+# Top-level modules plotter_core mustn't load on import: GUI toolkits, which
+# a headless machine may not have, and slow ones only some functions use.
+FORBIDDEN = ('tkinter', 'customtkinter', 'PIL', 'cv2', 'scipy')
+
+
+def measure(module):
+    """Seconds to import module in a new interpreter, and the top-level
+    modules it loaded."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         f'import sys, {module}; print(*sys.modules)'],
+        capture_output=True, text=True, check=True)
+    # Lines look like "import time:  self [us] | cumulative | name", nested
+    # imports indented under their importer.
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split('|')
+        if name.rstrip() == f' {module}':
+            seconds = int(cumulative) / 1e6
+            break
+    else:
+        raise RuntimeError(f'No import time for {module}:\n{result.stderr}')
+    return seconds, {name.split('.')[0] for name in result.stdout.split()}
+
+
+def main(argv):
+    del argv  # unused
+    failed = 0
+    modules = [f'plotter_core.{info.name}' for info in pkgutil.iter_modules(plotter_core.__path__)]
+    for module in modules:
+        seconds = None
+        for _ in range(RUNS.value):
+            run_seconds, loaded = measure(module)
+            seconds = run_seconds if seconds is None else min(seconds, run_seconds)
+        problems = []
+        if seconds * 1000 > BUDGET_MS.value:
+            problems.append('over budget')
+        forbidden = sorted(loaded.intersection(FORBIDDEN))
+        if forbidden:
+            problems.append(f'imports {", ".join(forbidden)}')
+        failed += bool(problems)
+        print(f'{module:<30} {seconds * 1000:6.1f} ms  {"; ".join(problems) or "ok"}')
+    print(f'{len(modules) - failed} of {len(modules)} modules within {BUDGET_MS.value:g} ms '
+          f'without importing {", ".join(FORBIDDEN)}')
+    if failed:
+        return 1
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,115 @@
+"""Finds a red-banded pen in camera frames, searching near where it last was.
+
+Blurring the whole frame at full resolution to find the reddest blob is
+slow, so frames are searched coarse-to-fine: the blob is found in a
+downscaled copy with a proportionally smaller blur, then refined at full
+resolution in a small window around it. Once the pen is found, only a
+region of interest around it is searched. The whole frame is scanned
+again when the pen isn't found there.
+"""
+
+import dataclasses
+import time
+import cv2
+import numpy as np
+
+DEFAULT_BLUR_RADIUS = 41
+# Downscaling of the coarse search.
+DEFAULT_SCALE = 4
+# Half the width of the region searched around the last position, in pixels.
+DEFAULT_ROI_RADIUS = 120
+# Blurred redness (0-255) below which the pen counts as lost.
+DEFAULT_MIN_REDNESS = 20
+
+
+@dataclasses.dataclass(frozen=True)
+class Detection:
+    # (x, y) in frame pixels.
+    point: tuple
+    # Blurred redness at point, 0-255.
+    redness: int
+    found: bool
+    # Whether the whole frame had to be searched.
+    full_scan: bool
+    # (x0, y0, x1, y1) searched for the pen.
+    region: tuple
+    # Time taken to process the frame.
+    seconds: float
+
+
+def redness(image):
+    """How much redder than green and blue each pixel of a BGR image is, 0-255."""
+    red = image[:, :, 2].astype(np.int16)
+    return np.clip(2 * red - image[:, :, 0] - image[:, :, 1], 0, 255).astype(np.uint8)
+
+
+def _odd(size):
+    return max(1, int(size) // 2 * 2 + 1)
+
+
+class PenTracker:
+    def __init__(self, blur_radius=DEFAULT_BLUR_RADIUS, scale=DEFAULT_SCALE,
+                 roi_radius=DEFAULT_ROI_RADIUS, min_redness=DEFAULT_MIN_REDNESS):
+        self.blur_radius = _odd(blur_radius)
+        self.scale = max(1, int(scale))
+        self.roi_radius = roi_radius
+        self.min_redness = min_redness
+        self.last_point = None
+
+    def _refine(self, frame, x, y):
+        """Best point of the full-resolution blurred redness within scale pixels of (x, y)."""
+        height, width = frame.shape[:2]
+        # Enough margin that the blur near the searched window isn't cut off.
+        margin = self.scale + self.blur_radius // 2
+        x0, y0 = max(0, x - margin), max(0, y - margin)
+        x1, y1 = min(width, x + margin + 1), min(height, y + margin + 1)
+        blurred = cv2.GaussianBlur(redness(frame[y0:y1, x0:x1]),
+                                   (self.blur_radius, self.blur_radius), 0)
+        wx0, wy0 = max(0, x - self.scale - x0), max(0, y - self.scale - y0)
+        window = blurred[wy0:y - y0 + self.scale + 1, wx0:x - x0 + self.scale + 1]
+        _, best, _, (best_x, best_y) = cv2.minMaxLoc(window)
+        return (x0 + wx0 + best_x, y0 + wy0 + best_y), int(best)
+
+    def _search(self, frame, region):
+        """Coarse-to-fine search of region, returning the point and its redness."""
+        x0, y0, x1, y1 = region
+        image = frame[y0:y1, x0:x1]
+        if self.scale > 1:
+            image = cv2.resize(image, None, fx=1 / self.scale, fy=1 / self.scale,
+                               interpolation=cv2.INTER_AREA)
+        blur = _odd(self.blur_radius / self.scale)
+        coarse = cv2.GaussianBlur(redness(image), (blur, blur), 0)
+        _, _, _, (x, y) = cv2.minMaxLoc(coarse)
+        x = min(x0 + x * self.scale + self.scale // 2, x1 - 1)
+        y = min(y0 + y * self.scale + self.scale // 2, y1 - 1)
+        return self._refine(frame, x, y)
+
+    def _near_edge(self, point, region, frame):
+        """Whether point is close enough to a region edge that isn't the frame's
+        that the pen may be leaving it."""
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = region
+        x, y = point
+        edge = self.blur_radius // 2
+        return ((x0 > 0 and x - x0 < edge) or (y0 > 0 and y - y0 < edge)
+                or (x1 < width and x1 - x <= edge) or (y1 < height and y1 - y <= edge))
+
+    def track(self, frame):
+        """Finds the pen in a BGR frame."""
+        start_time = time.perf_counter()
+        height, width = frame.shape[:2]
+        full_frame = (0, 0, width, height)
+        found = False
+        if self.last_point is not None:
+            x, y = self.last_point
+            region = (max(0, x - self.roi_radius), max(0, y - self.roi_radius),
+                      min(width, x + self.roi_radius + 1), min(height, y + self.roi_radius + 1))
+            point, score = self._search(frame, region)
+            found = score >= self.min_redness and not self._near_edge(point, region, frame)
+        full_scan = not found
+        if full_scan:
+            region = full_frame
+            point, score = self._search(frame, region)
+            found = score >= self.min_redness
+        self.last_point = point if found else None
+        return Detection(point, score, found, full_scan, region, time.perf_counter() - start_time)
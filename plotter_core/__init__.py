@@ -0,0 +1,6 @@
+"""Strokes, fonts, G-code and the serial connection to the plotter.
+
+Nothing here imports a GUI toolkit, so it all works on a headless machine,
+and SciPy is only imported by the functions that use it. import_budget.py
+checks both, and how long each module takes to import.
+"""
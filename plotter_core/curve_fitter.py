@@ -0,0 +1,120 @@
+"""Smooths freehand strokes and resamples them to a chord-error tolerance.
+
+Works on every stroke of a drawing at once: strokes are concatenated into
+one (N, 2) array with their lengths alongside, and smoothing and
+resampling are done with NumPy over all of them together. Repeated points,
+single-point strokes and non-finite coordinates are handled rather than
+rejected.
+"""
+
+import numpy as np
+
+DEFAULT_TOLERANCE = 0.1  # mm
+
+
+def smooth(points, starts, ends):
+    """One pass of a cubic B-spline filter, (p[i-1] + 4 p[i] + p[i+1]) / 6.
+
+    Takes out pixel jitter without moving the first and last point of a
+    stroke. starts and ends index each stroke's first and last point.
+    """
+    if len(points) < 3:
+        return points.copy()
+    smoothed = points.copy()
+    smoothed[1:-1] = (points[:-2] + 4 * points[1:-1] + points[2:]) / 6
+    smoothed[starts] = points[starts]
+    smoothed[ends] = points[ends]
+    return smoothed
+
+
+def _squared_distances(x, y, first, last, segment, inner):
+    """Squared distance of each inner point from its segment's chord.
+
+    first and last index each segment's end points, segment gives the
+    segment of each inner point.
+    """
+    start_x, start_y = x[first], y[first]
+    chord_x, chord_y = x[last] - start_x, y[last] - start_y
+    length_squared = chord_x * chord_x + chord_y * chord_y
+    inverse = np.divide(1.0, length_squared, out=np.zeros(len(first)), where=length_squared > 0)
+    chord_x, chord_y = chord_x[segment], chord_y[segment]
+    offset_x = x[inner] - start_x[segment]
+    offset_y = y[inner] - start_y[segment]
+    t = np.clip((offset_x * chord_x + offset_y * chord_y) * inverse[segment], 0.0, 1.0)
+    dx = offset_x - t * chord_x
+    dy = offset_y - t * chord_y
+    return dx * dx + dy * dy
+
+
+def rdp_mask(points, starts, ends, tolerance):
+    """Which points Ramer-Douglas-Peucker keeps, for every stroke at once.
+
+    Each pass finds the farthest point of every segment that's still too
+    far from its chord and splits there, so the number of passes grows with
+    the depth of the recursion, not the number of strokes. Distances are to
+    the chord segment rather than its line, so closed strokes work.
+    """
+    x = np.ascontiguousarray(points[:, 0])
+    y = np.ascontiguousarray(points[:, 1])
+    keep = np.zeros(len(points), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    first, last = starts, ends
+    while True:
+        open_segments = last - first > 1
+        first, last = first[open_segments], last[open_segments]
+        if not len(first):
+            return keep
+        inner_counts = last - first - 1
+        offsets = np.concatenate([[0], np.cumsum(inner_counts)[:-1]])
+        segment = np.repeat(np.arange(len(first)), inner_counts)
+        inner = np.arange(len(segment)) - offsets[segment] + first[segment] + 1
+        distances = _squared_distances(x, y, first, last, segment, inner)
+        farthest_distance = np.maximum.reduceat(distances, offsets)
+        is_farthest = distances == farthest_distance[segment]
+        farthest = np.minimum.reduceat(np.where(is_farthest, inner, len(points)), offsets)
+        split = farthest_distance > tolerance * tolerance
+        keep[farthest[split]] = True
+        first, last, farthest = first[split], last[split], farthest[split]
+        first, last = np.concatenate([first, farthest]), np.concatenate([farthest, last])
+
+
+def fit(points, lengths, tolerance=DEFAULT_TOLERANCE):
+    """Smooths strokes and keeps just enough points to stay within tolerance.
+
+    Args:
+        points: (N, 2) points of every stroke, one after the other.
+        lengths: Number of points in each stroke.
+        tolerance: Furthest the result may stray from the smoothed strokes.
+
+    Returns:
+        (points, lengths) of the fitted strokes. Strokes keep their order
+        and at least one point each, unless they had no finite points.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    stroke = np.repeat(np.arange(len(lengths)), lengths)
+    # Drop non-finite points and points repeating the one before them.
+    keep = np.isfinite(points).all(axis=1)
+    points, stroke = points[keep], stroke[keep]
+    repeat = np.zeros(len(points), dtype=bool)
+    repeat[1:] = (stroke[1:] == stroke[:-1]) & (points[1:] == points[:-1]).all(axis=1)
+    points, stroke = points[~repeat], stroke[~repeat]
+    if not len(points):
+        return points, np.zeros(0, dtype=np.int64)
+    is_start = np.ones(len(points), dtype=bool)
+    is_start[1:] = stroke[1:] != stroke[:-1]
+    starts = np.flatnonzero(is_start)
+    ends = np.append(starts[1:], len(points)) - 1
+    points = smooth(points, starts, ends)
+    keep = rdp_mask(points, starts, ends, tolerance)
+    return points[keep], np.bincount(stroke[keep], minlength=len(lengths))[np.unique(stroke)]
+
+
+def fit_strokes(strokes, tolerance=DEFAULT_TOLERANCE):
+    """fit() for a list of (N, 2) strokes. Returns a list of strokes."""
+    strokes = [np.asarray(stroke, dtype=float).reshape(-1, 2) for stroke in strokes]
+    if not strokes:
+        return []
+    points, lengths = fit(np.concatenate(strokes), [len(stroke) for stroke in strokes], tolerance)
+    return np.split(points, np.cumsum(lengths)[:-1])
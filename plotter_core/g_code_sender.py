@@ -0,0 +1,567 @@
+"""Handles serial connection to FluidNC running on plotter."""
+
+import codecs
+import collections
+import dataclasses
+import itertools
+import mmap
+import os
+import queue
+import serial
+import threading
+import time
+from plotter_core import gcode_compiler
+from plotter_core import gcode_parser
+
+# Size of FluidNC's serial receive buffer in bytes. The character-counting
+# protocol never has more than this many unacknowledged bytes on the wire.
+RX_BUFFER_SIZE = 128
+# Lines waiting to be written. Producers block once this many are queued.
+COMMAND_QUEUE_SIZE = 1024
+# How long the I/O thread blocks on a read before checking for realtime
+# commands again, in seconds. Bounds the latency of Stop.
+IO_POLL_INTERVAL = 0.002
+# Status reports requested per second by the I/O thread.
+STATUS_RATE = 10
+# Single-byte commands FluidNC acts on immediately, even mid-line:
+# feed hold, cycle start/resume, status query and soft reset.
+FEED_HOLD = '!'
+CYCLE_START = '~'
+STATUS_QUERY = '?'
+SOFT_RESET = '\x18'
+REALTIME_COMMANDS = (FEED_HOLD, CYCLE_START, STATUS_QUERY, SOFT_RESET)
+# Planner blocks FluidNC has by default. Acknowledged lines may be this many
+# moves behind, when status reports don't say (Bf).
+PLANNER_BLOCKS = 16
+# Acknowledged lines remembered, enough for a planner this many blocks deep.
+RECENT_LINES = 256
+
+
+@dataclasses.dataclass(frozen=True)
+class MachineStatus:
+    """One status report, e.g. <Run|MPos:1.000,2.000,5.000|Bf:15,128|FS:7000,0>."""
+    state: str
+    # Machine position (x, y, z) in mm.
+    position: tuple
+    # Free planner blocks and free RX buffer bytes, if FluidNC reports them.
+    planner_blocks_free: int | None = None
+    rx_bytes_free: int | None = None
+    feed_rate: float | None = None
+    # Work coordinate offset, only present in some reports.
+    work_offset: tuple | None = None
+    # time.monotonic() when the report was parsed.
+    timestamp: float = 0.0
+
+
+@dataclasses.dataclass(eq=False)
+class FileJob:
+    """Progress of a file sent with GCodeSender.send_file.
+
+    Line numbers count every line in the file from 1, like an editor does.
+    """
+    path: str
+    start_line: int = 1
+    # Last line handed to the I/O thread, and last line FluidNC acknowledged.
+    # Acknowledged lines may still be waiting in the planner.
+    queued_line: int = 0
+    acknowledged_line: int = 0
+    # Lines acknowledged so far, not counting blank ones.
+    acknowledged_count: int = 0
+    # Every line was queued.
+    done: bool = False
+    # The queue was cleared before every line was queued.
+    cancelled: bool = False
+
+    def resume_line(self, unfinished=()):
+        """Where to pick up after the job was stopped.
+
+        Args:
+            unfinished: Origins of the lines FluidNC acknowledged but may not
+                have run, from GCodeSender.unfinished_lines(). Resetting
+                throws them away, so they're sent again.
+        """
+        lines = [origin[1] for origin in unfinished if origin is not None and origin[0] is self]
+        return max(min(lines, default=self.acknowledged_line + 1), self.start_line)
+
+    def on_written(self, line):
+        pass
+
+    def on_acknowledged(self, line):
+        self.acknowledged_line = line
+        self.acknowledged_count += 1
+
+
+def read_lines(path, start_line=1):
+    """Yields (line number, line) from a file without reading it all in.
+
+    The file is memory-mapped, so only the pages being read are resident.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line_number, line in enumerate(iter(mapped.readline, b''), 1):
+                if line_number >= start_line:
+                    yield line_number, line
+
+
+def resume_gcode(path, line):
+    """G-code that sets the machine up to run a file from the given line.
+
+    Replays the file's lines up to there to find the position, pen height,
+    feed rate and modal state, then lifts the pen, moves over and restores
+    them.
+    """
+    interpreter = gcode_parser.GCodeInterpreter()
+    for line_number, text in read_lines(path):
+        if line_number >= line:
+            break
+        interpreter.execute(text.decode('UTF-8', errors='replace'))
+    gcode = [gcode_compiler.PEN_UP_GCODE, 'G90 G21\n',
+             f'G0 X{interpreter.x:.3f} Y{interpreter.y:.3f}\n']
+    if interpreter.z > gcode_parser.PEN_DOWN_Z:
+        gcode.append(f'G0 Z{interpreter.z:.3f}\n')
+    if interpreter.feed is not None:
+        gcode.append(f'F{interpreter.feed:.1f}\n')
+    # G2/G3 can't be set without axis words, and lines after an arc
+    # always carry their own.
+    if interpreter.motion == 1:
+        gcode.append('G1\n')
+    if not interpreter.absolute:
+        gcode.append('G91\n')
+    if interpreter.units != 1.0:
+        gcode.append('G20\n')
+    return ''.join(gcode)
+
+
+def parse_status(report, work_offset=None):
+    """Parses a status report, or returns None if it isn't a valid one.
+
+    Positions reported as WPos are converted to machine coordinates using
+    work_offset (the last WCO seen), when given.
+    """
+    if not (report.startswith('<') and report.endswith('>')):
+        return None
+    state, *fields = report[1:-1].split('|')
+    values = {}
+    for field in fields:
+        name, _, value = field.partition(':')
+        try:
+            values[name] = tuple(float(x) for x in value.split(','))
+        except ValueError:
+            continue
+    if 'MPos' in values:
+        position = values['MPos']
+    elif 'WPos' in values:
+        offset = values.get('WCO', work_offset) or (0.0,) * len(values['WPos'])
+        position = tuple(p + o for p, o in zip(values['WPos'], offset))
+    else:
+        return None
+    if len(position) != 3:
+        return None
+    buffers = values.get('Bf', (None, None))
+    feed_rate = values.get('FS', values.get('F', (None,)))[0]
+    return MachineStatus(
+        state=state.split(':')[0],
+        position=position,
+        planner_blocks_free=None if buffers[0] is None else int(buffers[0]),
+        rx_bytes_free=None if buffers[1] is None else int(buffers[1]),
+        feed_rate=feed_rate,
+        work_offset=values.get('WCO'),
+        timestamp=time.monotonic())
+
+
+class GCodeSender:
+    """Owns the serial port. All reads and writes happen on one I/O thread.
+
+    G-code lines go through a bounded queue and are streamed with
+    character-counting flow control. Realtime commands skip the queue and
+    are written before the next batch of lines. When position queries are
+    allowed the I/O thread also polls for status status_rate times a second
+    and publishes the latest report as self.status, so any number of
+    threads can read it without touching the port.
+    """
+
+    def __init__(self, serial_port, allow_position_query=True, flow_control=True,
+                 rx_buffer_size=RX_BUFFER_SIZE, command_queue_size=COMMAND_QUEUE_SIZE,
+                 status_rate=STATUS_RATE):
+        # if connection fails, want serial_instance = None so del works
+        self.serial_instance = None
+        self.serial_instance = serial.serial_for_url(
+            serial_port, baudrate=115200, bytesize=8, parity='N',
+            stopbits=1, timeout=IO_POLL_INTERVAL, xonxoff=False, rtscts=False, dsrdtr=False)
+        encoding = 'UTF-8'
+        errors = 'replace'
+        self.tx_encoder = codecs.getincrementalencoder(encoding)(errors)
+        # Without a controller on the other end (e.g. loop://) nothing sends
+        # "ok", so lines are written without waiting for acknowledgements and
+        # the port is never read.
+        self.flow_control = flow_control
+        self.rx_buffer_size = rx_buffer_size
+        self.allow_position_query = allow_position_query
+        # Polling needs replies, which are only read with flow control.
+        self._status_interval = (1 / status_rate if status_rate and allow_position_query
+                                 and flow_control else None)
+        self._next_status_query = 0.0
+        self._work_offset = None
+        # Latest MachineStatus. Replaced, never mutated.
+        self.status = None
+        # Most free planner blocks ever reported, i.e. the planner's size.
+        self.planner_size = None
+        # Origin of each line acknowledged lately, oldest first, and how many
+        # lines were acknowledged in all, and by the last status report.
+        self._acknowledged = collections.deque(maxlen=RECENT_LINES)
+        self._acknowledged_count = 0
+        self._acknowledged_at_status = 0
+        # Origins of the lines a reset threw away before they ran.
+        self._lost = []
+        # (line number, line, line with newline, origin) waiting for the I/O
+        # thread. Lines are bytes. Origin is None, or (owner, index) for lines
+        # whose owner wants to know when they're written and acknowledged:
+        # the I/O thread calls owner.on_written(index) and
+        # owner.on_acknowledged(index), and skips the line if owner.cancelled.
+        self._commands = queue.Queue(maxsize=command_queue_size)
+        self._realtime = queue.SimpleQueue()
+        self._line_numbers = itertools.count(1)
+        # (line number, line, bytes, origin) for each line FluidNC hasn't
+        # acknowledged.
+        self._in_flight = collections.deque()
+        self._in_flight_bytes = 0
+        self._rx_buffer = bytearray()
+        self._wake = threading.Event()
+        self._discard = threading.Event()
+        # Counts the I/O thread's discards, so clear_queue can wait for one.
+        self._discards = 0
+        self._discarded = threading.Condition()
+        # FileJobs still being queued, cancelled by clear_queue.
+        self._file_jobs = set()
+        # Functions called with every MachineStatus, on the I/O thread.
+        self.status_listeners = []
+        self._status_ready = threading.Condition()
+        # (line number, line, reply) for each line FluidNC rejected.
+        self.errors = []
+        self._running = True
+        self._io_thread = threading.Thread(target=self._io_loop, daemon=True)
+        self._io_thread.start()
+        # G90: absolute position, G21: millimeters
+        self.stream('G90 G21\n')
+
+    def send(self, message):
+        """Queues G-code, or sends a realtime command ahead of the queue."""
+        if message in REALTIME_COMMANDS:
+            self.send_realtime(message)
+        else:
+            self.stream(message)
+
+    def send_realtime(self, command):
+        """Sends a realtime command ahead of any queued G-code."""
+        self._realtime.put(self.tx_encoder.encode(command))
+        self._wake.set()
+
+    def stream(self, gcode, wait=False, owner=None):
+        """Queues G-code lines for the I/O thread.
+
+        Lines are streamed using the character-counting protocol: they are
+        written in bulk as long as the bytes in flight fit in the controller's
+        receive buffer, and each ok frees up room for more. Blocks while the
+        command queue is full.
+
+        Args:
+            gcode: One or more newline-separated G-code lines, as str or bytes.
+            wait: Block until every line queued so far has been acknowledged.
+            owner: Optional object told as each line is written and
+                acknowledged, by its index among the non-blank lines. See
+                self._commands.
+
+        Returns:
+            With wait, (line number, line, reply) for each line rejected with
+            an error while waiting. Otherwise an empty list; rejected lines
+            are still printed and recorded in self.errors.
+        """
+        first_error = len(self.errors)
+        if isinstance(gcode, str):
+            gcode = self.tx_encoder.encode(gcode)
+        index = 0
+        for line in gcode.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            origin = None if owner is None else (owner, index)
+            self._commands.put((next(self._line_numbers), line, line + b'\n', origin))
+            self._wake.set()
+            index += 1
+        if not wait:
+            return []
+        self._commands.join()
+        return self.errors[first_error:]
+
+    def send_file(self, path, start_line=1, wait=False, job=None):
+        """Streams a G-code file from disk, starting at the given line.
+
+        The file is memory-mapped and lines are queued as there's room, so
+        memory use doesn't grow with the file. Starting past line 1 first
+        lifts the pen and moves to where the file was at that line. Blocks
+        while the command queue is full; stops queueing if the queue is
+        cleared, e.g. by send_soft_reset or reset_fluidnc.
+
+        Args:
+            path: File to send.
+            start_line: First line to send, counting from 1.
+            wait: Block until every line has been acknowledged.
+            job: FileJob(path, start_line) to track progress in, to read it
+                while the file is still being queued. A new one by default.
+
+        Returns:
+            The FileJob tracking the file's progress. Pass its
+            resume_line(self.unfinished_lines()) to send_file again to pick
+            up where it stopped.
+        """
+        if job is None:
+            job = FileJob(path, start_line)
+        if start_line > 1:
+            self.stream(resume_gcode(path, start_line))
+        self._file_jobs.add(job)
+        try:
+            for line_number, line in read_lines(path, start_line):
+                if job.cancelled:
+                    break
+                line = line.strip()
+                job.queued_line = line_number
+                if not line:
+                    continue
+                self._commands.put(
+                    (next(self._line_numbers), line, line + b'\n', (job, line_number)))
+                self._wake.set()
+            else:
+                job.done = True
+        finally:
+            self._file_jobs.discard(job)
+        if wait:
+            self._commands.join()
+        return job
+
+    def _io_loop(self):
+        pending = None  # Taken from the queue, waiting for room in the RX buffer.
+        while self._running:
+            if self._discard.is_set():
+                pending = self._discard_commands(pending)
+            if self._status_interval and time.monotonic() >= self._next_status_query:
+                self._next_status_query = time.monotonic() + self._status_interval
+                self._realtime.put(self.tx_encoder.encode(STATUS_QUERY))
+            self._write_realtime()
+            if self.flow_control:
+                # Blocks for up to IO_POLL_INTERVAL when nothing is waiting.
+                self._read_replies()
+            pending = self._write_commands(pending)
+            if not self.flow_control and pending is None:
+                self._wake.wait()
+                self._wake.clear()
+
+    def _write_realtime(self):
+        while True:
+            try:
+                command = self._realtime.get_nowait()
+            except queue.Empty:
+                return
+            self.serial_instance.write(command)
+
+    def _write_commands(self, pending):
+        batch = []
+        origins = []
+        written = []
+        while self._realtime.empty():
+            if pending is None:
+                try:
+                    pending = self._commands.get_nowait()
+                except queue.Empty:
+                    break
+            line_number, line, data, origin = pending
+            if origin is not None and origin[0].cancelled:
+                # Queued by send_file just as the queue was cleared.
+                self._commands.task_done()
+                pending = None
+                continue
+            if self.flow_control:
+                if self._in_flight and self._in_flight_bytes + len(data) > self.rx_buffer_size:
+                    break
+                self._in_flight.append((line_number, line, len(data), origin))
+                self._in_flight_bytes += len(data)
+            batch.append(data)
+            origins.append(origin)
+            if origin is not None:
+                written.append(origin)
+            pending = None
+        if batch:
+            self.serial_instance.write(b''.join(batch))
+        for owner, index in written:
+            owner.on_written(index)
+        if not self.flow_control:
+            # Nothing acknowledges lines, so count them once written.
+            for origin in origins:
+                self._acknowledge(origin)
+            for _ in batch:
+                self._commands.task_done()
+        return pending
+
+    def _acknowledge(self, origin):
+        self._acknowledged.append(origin)
+        self._acknowledged_count += 1
+        if origin is not None:
+            owner, index = origin
+            owner.on_acknowledged(index)
+
+    def _read_replies(self):
+        self._rx_buffer += self.serial_instance.read(self.serial_instance.in_waiting or 1)
+        while b'\n' in self._rx_buffer:
+            line, _, self._rx_buffer = self._rx_buffer.partition(b'\n')
+            self._handle_reply(line.decode('UTF-8', errors='replace').strip())
+
+    def _handle_reply(self, reply):
+        if reply.startswith('<') and reply.endswith('>'):
+            status = parse_status(reply, self._work_offset)
+            if status is None:
+                return
+            if status.work_offset is not None:
+                self._work_offset = status.work_offset
+            if status.planner_blocks_free is not None:
+                self.planner_size = max(self.planner_size or 0, status.planner_blocks_free)
+                self._acknowledged_at_status = self._acknowledged_count
+            with self._status_ready:
+                self.status = status
+                self._status_ready.notify_all()
+            for listener in self.status_listeners:
+                listener(status)
+        elif (reply == 'ok' or reply.startswith('error')) and self._in_flight:
+            line_number, line, size, origin = self._in_flight.popleft()
+            self._in_flight_bytes -= size
+            self._acknowledge(origin)
+            if reply != 'ok':
+                line = line.decode('UTF-8', errors='replace')
+                print(f'Line {line_number} "{line}" failed: {reply}')
+                self.errors.append((line_number, line, reply))
+            self._commands.task_done()
+
+    def _discard_commands(self, pending):
+        """Forgets queued and in-flight lines. Runs on the I/O thread."""
+        self._discard.clear()
+        dropped = len(self._in_flight) + (pending is not None)
+        self._in_flight.clear()
+        self._in_flight_bytes = 0
+        while True:
+            try:
+                self._commands.get_nowait()
+            except queue.Empty:
+                break
+            dropped += 1
+        for _ in range(dropped):
+            self._commands.task_done()
+        with self._discarded:
+            self._discards += 1
+            self._discarded.notify_all()
+        return None
+
+    def clear_queue(self):
+        """Drops every line that hasn't been acknowledged yet.
+
+        Waits for the I/O thread to drop them, so lines queued afterwards
+        are kept.
+        """
+        for job in list(self._file_jobs):
+            job.cancelled = True
+        with self._discarded:
+            discards = self._discards
+            self._discard.set()
+            self._wake.set()
+            if threading.current_thread() is not self._io_thread and self._io_thread.is_alive():
+                self._discarded.wait_for(lambda: self._discards > discards or not self._running)
+
+    def send_homing_command(self):
+        print('Homing')
+        self.stream('$H\n')
+
+    def send_unlock(self, wait=False):
+        """Clears an alarm, e.g. after a reset mid-move, without homing."""
+        print('Unlocking')
+        return self.stream('$X\n', wait=wait)
+
+    def send_stop(self):
+        self.send_realtime(FEED_HOLD)
+
+    def send_resume(self):
+        self.send_realtime(CYCLE_START)
+
+    def send_soft_reset(self):
+        """Aborts motion and empties FluidNC's buffers, and ours with them."""
+        self._lost = self.unfinished_lines()[-RECENT_LINES:]
+        self.clear_queue()
+        self.send_realtime(SOFT_RESET)
+
+    def reset_fluidnc(self):
+        """Pulse the reset line for FluidNC"""
+        print("Resetting FluidNC")
+        # The controller forgets everything it had buffered.
+        self._lost = self.unfinished_lines()[-RECENT_LINES:]
+        self.clear_queue()
+        self.serial_instance.rts = True
+        self.serial_instance.dtr = False
+        time.sleep(1)
+        self.serial_instance.rts = False
+        # TODO: progress bar
+        time.sleep(12)
+
+    def unfinished_lines(self):
+        """Origins of the acknowledged lines FluidNC may not have run yet,
+        oldest first, including any a reset threw away.
+
+        That's the lines in the planner at the last status report and every
+        line acknowledged since, or a whole planner's worth if reports don't
+        say how full it is (Bf).
+        """
+        status = self.status
+        if status is None or status.planner_blocks_free is None:
+            count = PLANNER_BLOCKS
+        else:
+            # Counts a line per block. Arcs take several blocks, so this errs
+            # on the side of drawing a little twice rather than leaving gaps.
+            count = (self.planner_size - status.planner_blocks_free +
+                     self._acknowledged_count - self._acknowledged_at_status)
+        # A copy is taken in one go, while the I/O thread may be appending.
+        acknowledged = list(self._acknowledged.copy())
+        return self._lost + (acknowledged[-count:] if count > 0 else [])
+
+    @property
+    def pending_lines(self):
+        """Lines queued or waiting for an ok."""
+        return self._commands.unfinished_tasks
+
+    def get_position(self):
+        """Latest reported [x, y, z] in mm, or None. Never touches the port."""
+        status = self.status
+        if not self.allow_position_query or status is None:
+            return None
+        return list(status.position)
+
+    def wait_for_status(self, newer_than=None, timeout=None):
+        """Blocks until a status report newer than the given one arrives.
+
+        Returns the new MachineStatus, or the latest one (possibly None) on
+        timeout.
+        """
+        with self._status_ready:
+            self._status_ready.wait_for(
+                lambda: self.status is not None and self.status is not newer_than,
+                timeout=timeout)
+            return self.status
+
+    def close(self):
+        """Stops the I/O thread and closes the port."""
+        self._running = False
+        self._wake.set()
+        if self._io_thread.is_alive() and threading.current_thread() is not self._io_thread:
+            self._io_thread.join()
+        if self.serial_instance:
+            self.serial_instance.close()
+
+    def __del__(self):
+        if self.serial_instance:
+            self.serial_instance.close()
@@ -0,0 +1,128 @@
+"""Compiles strokes into G-code for the plotter. Needs no GUI.
+
+Strokes are arrays of (x, y) canvas points. Every point of a job is scaled
+to mm, flipped (the canvas y axis points down, the plotter's up) and rounded
+to 0.1mm in one NumPy pass, and the whole job is formatted into a single
+bytes buffer ready for GCodeSender.stream.
+"""
+
+import dataclasses
+import numpy as np
+from plotter_core import curve_fitter
+from plotter_core import path_simplifier
+
+# Plotter dimensions in mm, and canvas pixels per mm.
+PLOTTER_WIDTH = 556
+PLOTTER_HEIGHT = 405
+CANVAS_SCALE = 3
+SPEED = 7000
+PEN_UP_GCODE = "G0 Z-5\n"
+PEN_DOWN_GCODE = "G0 Z5\n"
+
+
+@dataclasses.dataclass
+class CompiledJob:
+    gcode: bytes
+    # Pen state once the job has run.
+    pen_up: bool
+    # Set when the job was simplified.
+    report: path_simplifier.SimplifyReport | None = None
+    # (x, y) in mm where the last stroke ends, if there were any.
+    end: tuple | None = None
+
+
+def fit_bspline(points):
+    """The original smoothing: splprep, keeping every third sample.
+
+    Superseded by curve_fitter, which is faster, bounds the error and
+    accepts repeated points.
+    """
+    if len(points) <= 3:
+        return points
+    # SciPy takes longer to import than everything else here put together.
+    from scipy.interpolate import splev
+    from scipy.interpolate import splprep
+    x_coords, y_coords = zip(*points)
+    tck, u = splprep([x_coords, y_coords], k=3)
+    bspline = splev(u[::3], tck)
+    return np.array(bspline).T
+
+
+def to_plotter_mm(points, x_scale, y_scale, canvas_height):
+    """Scales canvas points to mm and flips the y coordinate."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    return np.column_stack((x_scale * points[:, 0], y_scale * (canvas_height - points[:, 1])))
+
+
+def compile_strokes(strokes, x_scale, y_scale, canvas_height, feed=SPEED, fit=None,
+                    tolerance=0.0, pen_up=True, continues=False, finished=True,
+                    fit_tolerance=None):
+    """Compiles strokes into G-code.
+
+    Args:
+        strokes: Sequence of (N, 2) arrays or lists of canvas (x, y) points.
+        x_scale, y_scale: mm per canvas pixel.
+        canvas_height: Canvas height in pixels, for flipping y.
+        feed: Feed rate for G1/G2/G3 moves, in mm/min.
+        fit: Optional function that resamples each stroke, e.g. fit_bspline.
+        tolerance: Chord-error tolerance in mm for path_simplifier. 0 sends
+            one G1 per point.
+        pen_up: Pen state before the job.
+        continues: The first stroke continues the one the pen is drawing, so
+            the pen isn't lifted before it.
+        finished: Lift the pen after the last stroke. Otherwise it stays
+            down so a later job can continue the stroke.
+        fit_tolerance: Smooth the strokes with curve_fitter and resample
+            them to this chord-error tolerance in mm. None leaves them be.
+
+    Returns:
+        A CompiledJob.
+    """
+    if fit is not None:
+        strokes = [fit(stroke) if len(stroke) else stroke for stroke in strokes]
+    strokes = [stroke for stroke in strokes if len(stroke)]
+    lengths = [len(stroke) for stroke in strokes]
+    if strokes:
+        points = to_plotter_mm(np.concatenate([np.asarray(s, dtype=float).reshape(-1, 2)
+                                               for s in strokes]), x_scale, y_scale, canvas_height)
+        if fit_tolerance is not None:
+            points, lengths = curve_fitter.fit(points, lengths, fit_tolerance)
+            lengths = lengths.tolist()
+    report = path_simplifier.SimplifyReport() if tolerance > 0 else None
+    parts = []
+    if not pen_up and lengths and not continues:
+        parts.append(PEN_UP_GCODE)
+        pen_up = True
+    if lengths:
+        rounded = np.round(points, 1)
+        move = f"G1 X%.1f Y%.1f F{feed}\n"
+        # Templates and values for every unsimplified point, formatted in one go.
+        template = []
+        values = []
+        start = 0
+        for i, length in enumerate(lengths):
+            stroke = slice(start, start + length)
+            start += length
+            template.append(move)
+            values.append(rounded[stroke.start])
+            if pen_up:
+                template.append(PEN_DOWN_GCODE)
+                pen_up = False
+            if report is None:
+                template.append(move * (length - 1))
+                values.append(rounded[stroke.start + 1:stroke.stop])
+            else:
+                polyline = (move * (length - 1)) % tuple(rounded[stroke.start + 1:stroke.stop].ravel().tolist())
+                moves = path_simplifier.simplify(points[stroke], tolerance)
+                simplified = ''.join(path_simplifier.format_moves(points[stroke.start], moves, feed))
+                report.add(polyline, simplified)
+                template.append(simplified)
+            if i < len(lengths) - 1 or finished:
+                template.append(PEN_UP_GCODE)
+                pen_up = True
+        parts.append(''.join(template) % tuple(np.concatenate(values, axis=None).tolist()))
+    elif finished and not pen_up:
+        parts.append(PEN_UP_GCODE)
+        pen_up = True
+    end = tuple(rounded[-1].tolist()) if lengths else None
+    return CompiledJob(''.join(parts).encode('ascii'), pen_up, report, end)
@@ -0,0 +1,139 @@
+"""Tokenizes G-code and tracks where the plotter goes.
+
+Understands the subset of G-code the plotter uses: G0/G1 moves, G2/G3 arcs
+(I/J centre or R radius), G90/G91, G20/G21 and feed words. Motion modes
+are modal, so lines that only carry coordinates continue the last move.
+"""
+
+import dataclasses
+import math
+import re
+import numpy as np
+
+_COMMENT = re.compile(r'\(.*?\)|;.*')
+_WORD = re.compile(r'([A-Za-z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+# Arcs are split into segments that stray at most this far from the circle.
+ARC_TOLERANCE = 0.05  # mm
+# The pen touches the paper when Z is above this. G0 Z5 is down, Z-5 up.
+PEN_DOWN_Z = 0.0
+_INCH = 25.4
+
+
+def tokenize(line):
+    """[(letter, value)] for each word in a line, e.g. [('G', 1.0), ('X', 3.3)]."""
+    line = _COMMENT.sub('', line)
+    return [(letter.upper(), float(value)) for letter, value in _WORD.findall(line)]
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
+class Move:
+    """Motion caused by one line of G-code."""
+    # (x, y) before the move, and the (N, 2) points it passes through after,
+    # ending at the destination. Arcs are broken into several points.
+    start: tuple
+    points: np.ndarray
+    z_before: float
+    z: float
+    feed: float | None
+    rapid: bool
+
+    @property
+    def pen_down(self):
+        return self.z > PEN_DOWN_Z
+
+    @property
+    def pen_changed(self):
+        return (self.z_before > PEN_DOWN_Z) != (self.z > PEN_DOWN_Z)
+
+
+class GCodeInterpreter:
+    def __init__(self, arc_tolerance=ARC_TOLERANCE):
+        self.arc_tolerance = arc_tolerance
+        self.x = self.y = self.z = 0.0
+        self.feed = None
+        self.motion = None
+        self.absolute = True
+        self.units = 1.0
+
+    def execute(self, line):
+        """Updates the state for one line. Returns a Move, or None if nothing moved."""
+        words = tokenize(line)
+        if not words:
+            return None
+        target = {}
+        motion = None
+        for letter, value in words:
+            if letter == 'G':
+                code = int(value) if value.is_integer() else value
+                if code in (0, 1, 2, 3):
+                    motion = code
+                elif code == 90:
+                    self.absolute = True
+                elif code == 91:
+                    self.absolute = False
+                elif code == 20:
+                    self.units = _INCH
+                elif code == 21:
+                    self.units = 1.0
+            elif letter == 'F':
+                self.feed = value * self.units
+            elif letter in 'XYZIJR':
+                target[letter] = value * self.units
+        if motion is not None:
+            self.motion = motion
+        if self.motion is None or not any(axis in target for axis in 'XYZ'):
+            return None
+        start = (self.x, self.y)
+        z_before = self.z
+        x, y, z = (self._resolve(axis, target, current)
+                   for axis, current in (('X', self.x), ('Y', self.y), ('Z', self.z)))
+        if self.motion in (2, 3) and ((x, y) != start or 'I' in target or 'J' in target):
+            points = self._arc(start, (x, y), target, clockwise=self.motion == 2)
+        else:
+            points = np.array([(x, y)], dtype=float)
+        self.x, self.y, self.z = x, y, z
+        return Move(start, points, z_before, z, self.feed, self.motion == 0)
+
+    def _resolve(self, axis, target, current):
+        if axis not in target:
+            return current
+        return target[axis] if self.absolute else current + target[axis]
+
+    def _arc(self, start, end, target, clockwise):
+        start = np.array(start)
+        end = np.array(end)
+        if 'R' in target:
+            center = _center_from_radius(start, end, target['R'], clockwise)
+            if center is None:
+                return end[None]
+        else:
+            center = start + (target.get('I', 0.0), target.get('J', 0.0))
+        radius = float(np.hypot(*(start - center)))
+        start_angle = math.atan2(*(start - center)[::-1])
+        end_angle = math.atan2(*(end - center)[::-1])
+        sweep = end_angle - start_angle
+        if clockwise and sweep >= 0:
+            sweep -= 2 * math.pi
+        elif not clockwise and sweep <= 0:
+            sweep += 2 * math.pi
+        if radius <= self.arc_tolerance:
+            return end[None]
+        step = 2 * math.acos(1 - self.arc_tolerance / radius)
+        count = max(1, math.ceil(abs(sweep) / step))
+        angles = start_angle + sweep * np.arange(1, count + 1) / count
+        points = center + radius * np.column_stack((np.cos(angles), np.sin(angles)))
+        points[-1] = end
+        return points
+
+
+def _center_from_radius(start, end, radius, clockwise):
+    chord = end - start
+    length = float(np.hypot(*chord))
+    if length == 0 or length > 2 * abs(radius):
+        return None
+    # Negative R means the long way round.
+    offset = math.sqrt(radius ** 2 - (length / 2) ** 2)
+    if clockwise == (radius > 0):
+        offset = -offset
+    normal = np.array((-chord[1], chord[0])) / length
+    return (start + end) / 2 + normal * offset
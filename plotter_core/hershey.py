@@ -0,0 +1,376 @@
+"""Hershey fonts, read glyph by glyph from a memory-mapped store.
+
+Every face is packed into one binary file, fonts/hershey.bin, built from
+the .jhf sources by build_fonts.py. Opening it only reads a small header
+and table of faces; each face's character index is read the first time
+the face is used, and each glyph is decoded the first time it's needed
+and cached, so startup doesn't grow with the number of faces.
+
+Coordinates are in font units relative to the glyph's centre, with y
+pointing down like the canvas.
+
+The store holds, little-endian:
+    _HEADER
+    _FACE for each face
+    _GLYPH for each glyph, grouped by face and sorted by character
+    (x, y) int8 vertices of every glyph, with _PEN_UP between strokes
+"""
+
+import dataclasses
+import functools
+import json
+import os
+import numpy as np
+
+STORE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fonts', 'hershey.bin')
+# Roman Simplex, a single-stroke face that's good for G-code.
+DEFAULT_FACE = 'rowmans'
+ALIGNMENTS = ('left', 'center', 'right')
+
+_MAGIC = b'HERSHEY1'
+_HEADER = np.dtype([('magic', 'S8'), ('faces', '<u4'), ('glyphs', '<u4'), ('vertices', '<u4')])
+_FACE = np.dtype([
+    ('name', 'S16'), ('first', '<u4'), ('count', '<u4'),
+    # The font's nominal cap, base and bottom lines.
+    ('cap_line', 'i1'), ('base_line', 'i1'), ('bottom_line', 'i1'),
+    # Highest and lowest point of any glyph.
+    ('top', 'i1'), ('lowest', 'i1')])
+_GLYPH = np.dtype([
+    ('char', '<u4'), ('left', 'i1'), ('right', 'i1'),
+    ('min_x', 'i1'), ('min_y', 'i1'), ('max_x', 'i1'), ('max_y', 'i1'),
+    # Vertices, including pen-ups, and where they start.
+    ('count', '<u2'), ('offset', '<u4')])
+_PEN_UP = -128
+# .jhf coordinates are encoded as characters offset from "R".
+_ORIGIN = ord('R')
+_JHF_PEN_UP = ' R'
+# Glyphs in a .jhf file are for consecutive characters from space.
+_JHF_FIRST_CHAR = ord(' ')
+# Hershey's usual lines, for .jhf files that don't say.
+_DEFAULT_LINES = {'define_cap_line': -12, 'define_base_line': 9, 'define_bottom_line': 16}
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
+class Glyph:
+    # Horizontal extent, relative to the centre.
+    left: int
+    right: int
+    # (N, 2) vertices of every stroke, and the index each stroke starts at.
+    vertices: np.ndarray
+    stroke_starts: np.ndarray
+    # (min x, min y, max x, max y) of the vertices, or None for a space.
+    bbox: tuple | None
+
+    @functools.cached_property
+    def spans(self):
+        """(start, stop) of each stroke's vertices."""
+        stops = np.append(self.stroke_starts[1:], len(self.vertices))
+        return tuple(zip(self.stroke_starts.tolist(), stops.tolist()))
+
+    def strokes(self):
+        return [self.vertices[start:stop] for start, stop in self.spans]
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
+class PlacedGlyph:
+    """A glyph laid out on the canvas."""
+    char: str
+    # (N, 2) canvas coordinates of each stroke. Empty if the glyph was
+    # unknown or didn't fit on the canvas.
+    strokes: tuple
+    # Where the next glyph's left corner goes.
+    right_corner: tuple
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
+class TextLine:
+    """A line of text laid out on the canvas."""
+    text: str
+    # Canvas position of the line's left edge, after alignment.
+    left_corner: tuple
+    # In canvas units, without trailing spaces.
+    width: float
+    glyphs: tuple
+
+
+def parse_glyph(code):
+    """Decodes one glyph from a line of a .jhf file, after the glyph number."""
+    # First 3 chars are num coord pairs, then the left and right extent.
+    left = ord(code[3]) - _ORIGIN
+    right = ord(code[4]) - _ORIGIN
+    vertices = []
+    stroke_starts = [0]
+    for x_char, y_char in zip(code[5::2], code[6::2]):
+        if x_char + y_char == _JHF_PEN_UP:
+            if stroke_starts[-1] != len(vertices):
+                stroke_starts.append(len(vertices))
+            continue
+        vertices.append((ord(x_char) - _ORIGIN, ord(y_char) - _ORIGIN))
+    vertices = np.array(vertices, dtype=np.int16).reshape(-1, 2)
+    if not len(vertices):
+        stroke_starts = []
+    bbox = (tuple(vertices.min(axis=0).tolist()) + tuple(vertices.max(axis=0).tolist())
+            if len(vertices) else None)
+    return Glyph(left, right, vertices, np.array(stroke_starts, dtype=np.int64), bbox)
+
+
+def read_jhf(path):
+    """The glyphs of a .jhf file by character, and its lines (cap, base, bottom)."""
+    lines = dict(_DEFAULT_LINES)
+    glyphs = {}
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line.startswith('#'):
+                lines.update(json.loads(line[1:]))
+            elif line:
+                glyphs[chr(_JHF_FIRST_CHAR + len(glyphs))] = parse_glyph(line[5:])
+    return glyphs, tuple(int(lines[key]) for key in (
+        'define_cap_line', 'define_base_line', 'define_bottom_line'))
+
+
+def write_store(jhf_paths, path=STORE_PATH):
+    """Packs .jhf files into a store, one face each, named after the file."""
+    faces, glyphs, vertices = [], [], []
+    num_vertices = 0
+    for jhf_path in sorted(jhf_paths):
+        face_glyphs, (cap_line, base_line, bottom_line) = read_jhf(jhf_path)
+        name = os.path.splitext(os.path.basename(jhf_path))[0]
+        bboxes = [parsed.bbox for parsed in face_glyphs.values() if parsed.bbox is not None]
+        faces.append((name.encode(), len(glyphs), len(face_glyphs), cap_line, base_line,
+                      bottom_line, min(bbox[1] for bbox in bboxes),
+                      max(bbox[3] for bbox in bboxes)))
+        for char, parsed in sorted(face_glyphs.items()):
+            packed = []
+            for stroke in parsed.strokes():
+                if packed:
+                    packed.append(((_PEN_UP, _PEN_UP),))
+                packed.append(stroke)
+            packed = np.concatenate(packed) if packed else np.zeros((0, 2))
+            glyphs.append((ord(char), parsed.left, parsed.right) + (parsed.bbox or (0, 0, 0, 0))
+                          + (len(packed), num_vertices))
+            vertices.append(packed.astype(np.int8))
+            num_vertices += len(packed)
+    with open(path, 'wb') as f:
+        f.write(np.array([(_MAGIC, len(faces), len(glyphs), num_vertices)], _HEADER).tobytes())
+        f.write(np.array(faces, _FACE).tobytes())
+        f.write(np.array(glyphs, _GLYPH).tobytes())
+        f.write(np.concatenate(vertices).tobytes())
+
+
+class Face:
+    """One face of a FontStore, with its line metrics in font units."""
+
+    def __init__(self, store, record):
+        self.name = record['name'].decode()
+        self.cap_line = int(record['cap_line'])
+        self.base_line = int(record['base_line'])
+        self.bottom_line = int(record['bottom_line'])
+        self.top = int(record['top'])
+        self.lowest = int(record['lowest'])
+        # Far enough apart that no two lines' glyphs overlap.
+        self.line_height = self.lowest - self.top
+        self._store = store
+        self._first = int(record['first'])
+        self._count = int(record['count'])
+        self._index = None
+
+    def _read_index(self):
+        if self._index is None:
+            index = self._store.glyphs[self._first:self._first + self._count]
+            # Copied out of the map: a face's index is only a few KB.
+            self._index = (np.array(index['char']), np.array(index['right'], dtype=np.int64)
+                           - index['left'])
+        return self._index
+
+    def _find(self, codes):
+        """Row of each character code in this face, or -1 for unknown ones."""
+        chars, _ = self._read_index()
+        rows = np.minimum(np.searchsorted(chars, codes), len(chars) - 1)
+        return np.where(chars[rows] == codes, rows, -1)
+
+    def advances(self, text):
+        """How far each character of text moves the next one along, in font
+        units. Unknown characters take up no space."""
+        _, widths = self._read_index()
+        rows = self._find(np.array([ord(char) for char in text], dtype=np.uint32))
+        return np.where(rows >= 0, widths[rows], 0)
+
+    def glyph(self, char):
+        """Decodes the glyph for char, or returns None if the face doesn't have it."""
+        row = self._find(np.array([ord(char)], dtype=np.uint32))[0]
+        return None if row < 0 else self._decode(self._first + int(row))
+
+    def _decode(self, row):
+        record = self._store.glyphs[row]
+        offset, count = int(record['offset']), int(record['count'])
+        packed = self._store.vertices[offset:offset + count].astype(np.int16)
+        pen_up = packed[:, 0] == _PEN_UP
+        breaks = np.flatnonzero(pen_up)
+        stroke_starts = np.concatenate(([0], breaks - np.arange(len(breaks)))) if count else []
+        bbox = None
+        if count:
+            bbox = (int(record['min_x']), int(record['min_y']),
+                    int(record['max_x']), int(record['max_y']))
+        return Glyph(int(record['left']), int(record['right']), packed[~pen_up],
+                     np.array(stroke_starts, dtype=np.int64), bbox)
+
+
+class FontStore:
+    """The faces in a store file, memory-mapped."""
+
+    def __init__(self, path=STORE_PATH):
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        header = np.ndarray((), _HEADER, data)
+        if header['magic'] != _MAGIC:
+            raise ValueError(f'{path} is not a Hershey font store')
+        offset = _HEADER.itemsize
+        faces = np.ndarray(int(header['faces']), _FACE, data, offset)
+        offset += faces.nbytes
+        self.glyphs = np.ndarray(int(header['glyphs']), _GLYPH, data, offset)
+        offset += self.glyphs.nbytes
+        self.vertices = np.ndarray((int(header['vertices']), 2), np.int8, data, offset)
+        self._records = {record['name'].decode(): record for record in faces}
+        self._faces = {}
+
+    @property
+    def face_names(self):
+        return tuple(self._records)
+
+    def face(self, name=DEFAULT_FACE):
+        if name not in self._faces:
+            if name not in self._records:
+                raise KeyError(f'No font face {name!r}, expected one of '
+                               f'{", ".join(self.face_names)}')
+            self._faces[name] = Face(self, self._records[name])
+        return self._faces[name]
+
+
+@functools.cache
+def store():
+    """The store at STORE_PATH, opened when first needed."""
+    return FontStore()
+
+
+def face(name=DEFAULT_FACE):
+    return store().face(name)
+
+
+@functools.cache
+def glyph(char, face_name=DEFAULT_FACE):
+    """The glyph for char, or None if the face doesn't have it. Each is
+    decoded once."""
+    return face(face_name).glyph(char)
+
+
+def _place(parsed, char, left_corner, scale, fits):
+    if parsed is None:
+        return PlacedGlyph(char, (), left_corner)
+    origin = (left_corner[0] - scale * parsed.left, left_corner[1])
+    right_corner = (origin[0] + scale * parsed.right, origin[1])
+    if fits is not None:
+        if not fits(*right_corner):
+            return PlacedGlyph(char, (), right_corner)
+        if parsed.bbox is not None:
+            min_x, min_y, max_x, max_y = parsed.bbox
+            if not (fits(origin[0] + scale * min_x, origin[1] + scale * min_y) and
+                    fits(origin[0] + scale * max_x, origin[1] + scale * max_y)):
+                return PlacedGlyph(char, (), right_corner)
+    vertices = parsed.vertices * scale + np.array(origin, dtype=float)
+    strokes = tuple(vertices[start:stop] for start, stop in parsed.spans)
+    return PlacedGlyph(char, strokes, right_corner)
+
+
+def place(char, left_corner, scale, fits=None, face_name=DEFAULT_FACE):
+    """Lays out char with its left edge at left_corner.
+
+    Args:
+        char: Character to lay out.
+        left_corner: (x, y) canvas position of the glyph's left edge.
+        scale: Canvas units per font unit.
+        fits: Optional function (x, y) -> bool. Glyphs whose right corner or
+            bounding box doesn't fit are advanced over but not drawn.
+        face_name: Font face to use.
+
+    Returns:
+        A PlacedGlyph. Unknown characters take up no space.
+    """
+    return _place(glyph(char, face_name), char, left_corner, scale, fits)
+
+
+def _wrap(text, edges, max_width):
+    """(start, stop) of each line of a paragraph, breaking at spaces so lines
+    are no wider than max_width, or within words too long for a line.
+
+    edges[i] is where character i starts, with edges[-1] the text's width.
+    """
+    lines = []
+    start = 0
+    while start < len(text):
+        # The furthest stop that fits.
+        limit = int(np.searchsorted(edges, edges[start] + max_width, side='right')) - 1
+        if limit >= len(text):
+            lines.append((start, len(text)))
+            break
+        space = text.rfind(' ', start, limit + 1)
+        if space > start:
+            lines.append((start, space))
+            start = space + 1
+        else:
+            stop = max(limit, start + 1)
+            lines.append((start, stop))
+            start = stop
+        # Spaces at a break don't start the next line.
+        while start < len(text) and text[start] == ' ':
+            start += 1
+    return lines
+
+
+def layout(text, left_corner, scale, width=None, height=None, align='left',
+           face_name=DEFAULT_FACE, line_spacing=1.0, fits=None):
+    """Lays out text over lines, in a box whose top line starts at left_corner.
+
+    Args:
+        text: Text to lay out. Newlines start new lines.
+        left_corner: (x, y) canvas position of the first line's left edge.
+        scale: Canvas units per font unit.
+        width: Width of the box in canvas units. Lines longer than this are
+            wrapped at spaces, and are aligned within it. Without a width,
+            lines aren't wrapped and are aligned with the longest one.
+        height: Height of the box in canvas units. Lines that don't fit in
+            it are left out.
+        align: One of ALIGNMENTS.
+        face_name: Font face to use.
+        line_spacing: Multiple of the face's line height between lines.
+        fits: Optional function (x, y) -> bool, as for place.
+
+    Returns:
+        A list of TextLines.
+    """
+    if align not in ALIGNMENTS:
+        raise ValueError(f'Unknown alignment {align!r}, expected one of {", ".join(ALIGNMENTS)}')
+    font = face(face_name)
+    spans = []
+    for paragraph in text.replace('\r', '').split('\n'):
+        edges = np.concatenate(([0], np.cumsum(font.advances(paragraph)))) * scale
+        wrapped = (_wrap(paragraph, edges, width) if width is not None and paragraph
+                   else [(0, len(paragraph))])
+        for start, stop in wrapped:
+            trimmed = start + len(paragraph[start:stop].rstrip(' '))
+            spans.append((paragraph[start:stop], edges[start:stop + 1] - edges[start],
+                          edges[trimmed] - edges[start]))
+    line_advance = font.line_height * line_spacing * scale
+    if height is not None:
+        # The first line takes a whole line's height, the rest line_advance each.
+        fitting = 1 + int((height - font.line_height * scale) // line_advance)
+        del spans[max(0, fitting):]
+    box = width if width is not None else max((span[2] for span in spans), default=0)
+    lines = []
+    for i, (line_text, edges, line_width) in enumerate(spans):
+        x = left_corner[0] + float({'left': 0, 'center': (box - line_width) / 2,
+                              'right': box - line_width}[align])
+        y = left_corner[1] + i * line_advance
+        glyphs = tuple(_place(glyph(char, face_name), char, (x + edge, y), scale, fits)
+                       for char, edge in zip(line_text, edges.tolist()))
+        lines.append(TextLine(line_text, (x, y), float(line_width), glyphs))
+    return lines
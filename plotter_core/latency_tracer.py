@@ -0,0 +1,166 @@
+"""Traces how long points drawn in "Draw as I draw" mode take to reach the paper.
+
+Each point is timestamped when its motion event is handled and when it's
+added to the drawing. Each batch of points sent to the plotter is
+timestamped when its G-code is generated, when the first line is written,
+when the last line is acknowledged, and when a status report first puts
+the pen at the batch's last point. Time between stages goes into
+fixed-size log-scale histograms, so tracing costs a few timestamps per
+point and no memory growth.
+"""
+
+import collections
+import json
+import threading
+import time
+import numpy as np
+
+STAGES = ('event', 'enqueued', 'generated', 'written', 'acknowledged', 'reported')
+# Histogram bin edges in seconds, 10 per decade from 0.1 ms to 100 s.
+BIN_EDGES = np.geomspace(1e-4, 1e2, 61)
+# A status report within this many mm of a batch's last point means the pen
+# got there.
+REPORT_TOLERANCE = 0.5
+# Batches waiting for the pen to get there. Older ones are given up on.
+MAX_PENDING_BATCHES = 256
+
+
+class Histogram:
+    """Counts of durations in BIN_EDGES bins, plus under- and overflow."""
+
+    def __init__(self):
+        self.counts = np.zeros(len(BIN_EDGES) + 1, dtype=np.int64)
+
+    def add(self, seconds):
+        seconds = np.asarray(seconds, dtype=float).ravel()
+        seconds = seconds[~np.isnan(seconds)]
+        np.add.at(self.counts, np.searchsorted(BIN_EDGES, seconds, side='right'), 1)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        """Upper edge of the bin holding the q-th percentile, or None if empty."""
+        if not self.count:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.count))
+        return float(BIN_EDGES[min(index, len(BIN_EDGES) - 1)])
+
+    def to_dict(self):
+        return {'count': self.count, 'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'counts': self.counts.tolist()}
+
+
+class Batch:
+    """Points sent to the plotter as one job.
+
+    Passed to GCodeSender.stream as the owner of the job's lines.
+    """
+    cancelled = False
+
+    def __init__(self, tracer, point_times, end, lines):
+        self.tracer = tracer
+        # (N, 2) event and enqueued times of the batch's points.
+        self.point_times = point_times
+        # Last point in plotter mm, and how many lines the job has.
+        self.end = end
+        self.lines = lines
+        self.generated = time.perf_counter()
+        self.written = None
+        self.acknowledged = None
+
+    def on_written(self, index):
+        if self.written is None:
+            self.written = time.perf_counter()
+            self.tracer.add('generated', 'written', self.written - self.generated)
+
+    def on_acknowledged(self, index):
+        if index == self.lines - 1:
+            self.acknowledged = time.perf_counter()
+            if self.written is not None:
+                self.tracer.add('written', 'acknowledged', self.acknowledged - self.written)
+
+
+class LatencyTracer:
+    def __init__(self, tolerance=REPORT_TOLERANCE):
+        self.tolerance = tolerance
+        # (event, enqueued) times of points not yet in a batch.
+        self._points = []
+        self._batches = collections.deque(maxlen=MAX_PENDING_BATCHES)
+        self._lock = threading.Lock()
+        self.histograms = {f'{start}->{end}': Histogram() for start, end in zip(STAGES, STAGES[1:])}
+        self.histograms['event->reported'] = Histogram()
+
+    def add(self, start, end, seconds):
+        with self._lock:
+            self.histograms[f'{start}->{end}'].add(seconds)
+
+    def point_added(self, event_time):
+        """Call right after adding a point, with time.perf_counter() from when
+        its event started being handled."""
+        self._points.append((event_time, time.perf_counter()))
+
+    def take_points(self):
+        """Times of the points added since last time, for the next batch."""
+        points, self._points = self._points, []
+        return np.array(points, dtype=float).reshape(-1, 2)
+
+    def batch(self, point_times, end, lines):
+        """Starts tracing a job, right after its G-code was generated.
+
+        Args:
+            point_times: From take_points.
+            end: (x, y) in mm where the job leaves the pen.
+            lines: Lines of G-code in the job.
+
+        Returns:
+            A Batch to pass to GCodeSender.stream as owner.
+        """
+        batch = Batch(self, point_times, np.asarray(end, dtype=float), lines)
+        with self._lock:
+            self.histograms['event->enqueued'].add(point_times[:, 1] - point_times[:, 0])
+            self.histograms['enqueued->generated'].add(batch.generated - point_times[:, 1])
+            self._batches.append(batch)
+        return batch
+
+    def on_status(self, status):
+        """Status listener for GCodeSender. Finishes batches the pen has reached."""
+        now = time.perf_counter()
+        position = np.asarray(status.position[:2])
+        with self._lock:
+            reached = None
+            for i, batch in enumerate(self._batches):
+                # The pen can't get there before FluidNC has the last line.
+                if batch.acknowledged is None:
+                    break
+                if np.hypot(*(batch.end - position)) <= self.tolerance:
+                    reached = i
+                    break
+            if reached is None:
+                return
+            # Batches before the one reached were passed on the way.
+            for _ in range(reached + 1):
+                batch = self._batches.popleft()
+                self.histograms['acknowledged->reported'].add(now - batch.acknowledged)
+                self.histograms['event->reported'].add(now - batch.point_times[:, 0])
+
+    def to_dict(self):
+        with self._lock:
+            return {'bin_edges': BIN_EDGES.tolist(),
+                    'histograms': {name: histogram.to_dict()
+                                   for name, histogram in self.histograms.items()}}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self):
+        """A table of each stage's percentiles, in ms."""
+        def ms(seconds):
+            return '-' if seconds is None else f'{seconds * 1000:.1f}'
+        rows = [f'{"stage":<24} {"count":>7} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9}']
+        for name, histogram in self.to_dict()['histograms'].items():
+            rows.append(f'{name:<24} {histogram["count"]:>7} {ms(histogram["p50"]):>9} '
+                        f'{ms(histogram["p90"]):>9} {ms(histogram["p99"]):>9}')
+        return '\n'.join(rows)
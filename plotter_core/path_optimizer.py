@@ -0,0 +1,129 @@
+"""Reorders and reverses strokes to cut down on pen-up travel.
+
+Strokes are visited greedily, always moving to the nearest unvisited stroke
+end (either end, so strokes can be drawn backwards), using a k-d tree over
+stroke ends. The order is then refined with 2-opt moves limited to a window,
+which keeps both steps fast for tens of thousands of strokes.
+"""
+
+import dataclasses
+import numpy as np
+
+# How many following strokes each 2-opt move considers.
+TWO_OPT_WINDOW = 64
+TWO_OPT_PASSES = 4
+
+
+@dataclasses.dataclass
+class TravelReport:
+    """Pen-up travel before and after optimizing, in the strokes' units."""
+    before: float
+    after: float
+
+    @property
+    def saved(self):
+        return self.before - self.after
+
+
+def travel_distance(strokes, start=(0.0, 0.0)):
+    """Pen-up distance to draw the strokes in order, starting from start."""
+    if not len(strokes):
+        return 0.0
+    starts = np.array([stroke[0] for stroke in strokes], dtype=float)
+    ends = np.array([stroke[-1] for stroke in strokes], dtype=float)
+    previous = np.vstack([np.asarray(start, dtype=float), ends[:-1]])
+    return float(np.hypot(*(starts - previous).T).sum())
+
+
+def optimize_stroke_order(strokes, start=(0.0, 0.0), two_opt_passes=TWO_OPT_PASSES,
+                          window=TWO_OPT_WINDOW):
+    """Reorders strokes, reversing some of them, to shorten pen-up travel.
+
+    Args:
+        strokes: Sequence of (N, 2) point arrays or lists of (x, y).
+        start: Where the pen is before the first stroke.
+        two_opt_passes: Maximum 2-opt refinement passes. 0 skips refinement.
+        window: How many following strokes each 2-opt move considers.
+
+    Returns:
+        (strokes, report). Reversed strokes are returned as reversed views;
+        report is a TravelReport.
+    """
+    strokes = [np.asarray(stroke) for stroke in strokes if len(stroke)]
+    start = np.asarray(start, dtype=float)
+    before = travel_distance(strokes, start)
+    if len(strokes) < 2:
+        return strokes, TravelReport(before, before)
+    starts = np.array([stroke[0] for stroke in strokes], dtype=float)
+    ends = np.array([stroke[-1] for stroke in strokes], dtype=float)
+    order, flipped = _nearest_neighbour(starts, ends, start)
+    # Where the pen goes down and comes up for each stroke, in drawing order.
+    entry = np.where(flipped[:, None], ends[order], starts[order])
+    exit_ = np.where(flipped[:, None], starts[order], ends[order])
+    _two_opt(entry, exit_, order, flipped, start, two_opt_passes, window)
+    ordered = [strokes[i][::-1] if flip else strokes[i] for i, flip in zip(order, flipped)]
+    return ordered, TravelReport(before, travel_distance(ordered, start))
+
+
+def _nearest_neighbour(starts, ends, start):
+    # SciPy is slow to import, so it waits until travel is optimized.
+    from scipy.spatial import cKDTree
+    n = len(starts)
+    points = np.concatenate([starts, ends])
+    # Endpoint id e belongs to stroke e % n; ids >= n are stroke ends, so
+    # picking one means drawing that stroke backwards.
+    ids = np.arange(2 * n)
+    tree = cKDTree(points)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    flipped = np.empty(n, dtype=bool)
+    point = start
+    for step in range(n):
+        k = 8
+        while True:
+            k = min(k, len(ids))
+            _, found = tree.query(point, k=k)
+            found = ids[np.atleast_1d(found)]
+            found = found[~visited[found % n]]
+            if len(found) or k == len(ids):
+                break
+            k *= 4
+        stroke = found[0] % n
+        visited[stroke] = True
+        order[step] = stroke
+        flipped[step] = found[0] >= n
+        point = starts[stroke] if flipped[step] else ends[stroke]
+        remaining = n - step - 1
+        # Rebuild once most of the tree is visited so queries stay short.
+        if remaining and remaining * 4 <= len(ids):
+            ids = ids[~visited[ids % n]]
+            tree = cKDTree(points[ids])
+    return order, flipped
+
+
+def _two_opt(entry, exit_, order, flipped, start, passes, window):
+    """Reverses runs of strokes in place while that shortens travel."""
+    n = len(order)
+    for _ in range(passes):
+        improved = False
+        for i in range(n):
+            previous = exit_[i - 1] if i else start
+            j = np.arange(i, min(i + window, n))
+            after = np.minimum(j + 1, n - 1)
+            last = j == n - 1
+            # Reversing i..j swaps the two links around the run.
+            old = (np.hypot(*(previous - entry[i])) +
+                   np.where(last, 0.0, np.hypot(*(exit_[j] - entry[after]).T)))
+            new = (np.hypot(*(previous - exit_[j]).T) +
+                   np.where(last, 0.0, np.hypot(*(entry[i] - entry[after]).T)))
+            gain = old - new
+            best = int(np.argmax(gain))
+            if gain[best] <= 1e-9:
+                continue
+            end = j[best] + 1
+            entry[i:end], exit_[i:end] = exit_[i:end][::-1].copy(), entry[i:end][::-1].copy()
+            order[i:end] = order[i:end][::-1].copy()
+            flipped[i:end] = ~flipped[i:end][::-1]
+            improved = True
+        if not improved:
+            break
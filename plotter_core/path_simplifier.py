@@ -0,0 +1,217 @@
+"""Cuts down the number of G-code lines needed to draw a stroke.
+
+Runs of points that lie on a circle become a single G2/G3 arc, and what's
+left is simplified with Ramer-Douglas-Peucker. Both keep the drawn path
+within a chord-error tolerance of the original polyline. Coordinates are in
+mm, already scaled and flipped to plotter coordinates.
+"""
+
+import dataclasses
+import numpy as np
+
+DEFAULT_TOLERANCE = 0.05  # mm
+# Fewer points than this are left to RDP.
+MIN_ARC_POINTS = 4
+# Arcs must be long enough that their rounded endpoints don't coincide,
+# which FluidNC would read as a full circle.
+MIN_ARC_CHORD = 0.5  # mm
+# Flatter arcs are better off as straight lines.
+MAX_ARC_RADIUS = 2000.0  # mm
+# Candidate arcs are fitted in batches of about this many points.
+_BATCH_POINTS = 1 << 16
+
+
+@dataclasses.dataclass(frozen=True)
+class Move:
+    """A straight move to end, or an arc around center if it's set."""
+    end: tuple
+    center: tuple | None = None
+    counterclockwise: bool = False
+
+
+@dataclasses.dataclass
+class SimplifyReport:
+    """Size of a job's G-code with one G1 per point, and after simplifying."""
+    lines_before: int = 0
+    bytes_before: int = 0
+    lines_after: int = 0
+    bytes_after: int = 0
+
+    def add(self, before, after):
+        """Counts one stroke's G-code, before and after simplifying."""
+        self.lines_before += before.count('\n')
+        self.bytes_before += len(before)
+        self.lines_after += after.count('\n')
+        self.bytes_after += len(after)
+
+    def __str__(self):
+        return (f'{self.lines_before} lines, {self.bytes_before} bytes -> '
+                f'{self.lines_after} lines, {self.bytes_after} bytes')
+
+
+def rdp(points, tolerance):
+    """Indices of the points Ramer-Douglas-Peucker keeps, in order."""
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        inner = points[first + 1:last]
+        chord = points[last] - points[first]
+        length = np.hypot(*chord)
+        offsets = inner - points[first]
+        if length == 0:
+            distances = np.hypot(*offsets.T)
+        else:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def simplify(points, tolerance=DEFAULT_TOLERANCE):
+    """Moves that draw the polyline starting at points[0] within tolerance."""
+    points = np.asarray(points, dtype=float)
+    moves = []
+    run_start = 0
+    # The longest arc from a point doesn't depend on the arcs before it, so
+    # it's found for every point at once, and only the ones not inside an
+    # earlier arc are used.
+    starts, ends, centers, counterclockwise = _longest_arcs(points, tolerance)
+    for i, end, center, arc_counterclockwise in zip(
+            starts.tolist(), ends.tolist(), centers.tolist(), counterclockwise.tolist()):
+        if i < run_start:
+            continue
+        moves.extend(Move(tuple(points[k])) for k in rdp(points[run_start:i + 1], tolerance)[1:] + run_start)
+        moves.append(Move(tuple(points[end]), tuple(center), arc_counterclockwise))
+        run_start = end
+    moves.extend(Move(tuple(points[k])) for k in rdp(points[run_start:], tolerance)[1:] + run_start)
+    return moves
+
+
+def format_moves(start, moves, feed):
+    """G-code lines for moves, starting from start, at 0.1mm resolution."""
+    lines = []
+    current = np.round(start, 1)
+    for move in moves:
+        end = np.round(move.end, 1)
+        x, y = round(float(end[0]), 1), round(float(end[1]), 1)
+        if move.center is None:
+            lines.append(f"G1 X{x} Y{y} F{feed}\n")
+        else:
+            # Rounding the endpoints moves them off the circle. Put the centre
+            # back on the perpendicular bisector of the rounded chord so both
+            # ends are equidistant from it, as FluidNC requires.
+            chord = end - current
+            normal = np.array((-chord[1], chord[0])) / np.hypot(*chord)
+            middle = (current + end) / 2
+            center = middle + normal * np.dot(np.asarray(move.center) - middle, normal)
+            i, j = np.round(center - current, 3)
+            code = 'G3' if move.counterclockwise else 'G2'
+            lines.append(f"{code} X{x} Y{y} I{i:.3f} J{j:.3f} F{feed}\n")
+        current = end
+    return lines
+
+
+def _fit_arcs(points, starts, sizes, tolerance):
+    """Whether the sizes[k] points from each starts[k] lie on one arc within
+    tolerance, and its centre and direction.
+
+    The arc goes through the first, middle and last points. Every point has
+    to be within tolerance of it, counting the sagitta it bulges away from
+    each segment by, and it has to turn one way by less than a full circle.
+    """
+    fits = np.zeros(len(starts), dtype=bool)
+    centers = np.zeros((len(starts), 2))
+    counterclockwise = np.zeros(len(starts), dtype=bool)
+    # Windows are padded to the longest in their batch by repeating their
+    # last point, so batches hold windows of about the same size.
+    buckets = np.ceil(np.log2(sizes)).astype(int)
+    for bucket in np.unique(buckets).tolist():
+        rows = np.flatnonzero(buckets == bucket)
+        width = int(sizes[rows].max())
+        for batch in np.array_split(rows, -(-len(rows) * width // _BATCH_POINTS)):
+            first, size = starts[batch], sizes[batch]
+            fits[batch], centers[batch], counterclockwise[batch] = _fit_batch(
+                points, first, size, width, tolerance)
+    return fits, centers, counterclockwise
+
+
+def _fit_batch(points, first, size, width, tolerance):
+    last = first + size - 1
+    windows = points[np.minimum(first[:, None] + np.arange(width), last[:, None])]
+    (ax, ay), (bx, by), (cx, cy) = (points[first].T, points[first + size // 2].T, points[last].T)
+    # Centre of the circle through the first, middle and last points.
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    fits = (np.hypot(cx - ax, cy - ay) >= MIN_ARC_CHORD) & (np.abs(d) >= 1e-12)
+    d = np.where(fits, d, 1.0)
+    a2, b2, c2 = ax * ax + ay * ay, bx * bx + by * by, cx * cx + cy * cy
+    center = np.column_stack(((a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d,
+                              (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d))
+    radius = np.hypot(ax - center[:, 0], ay - center[:, 1])
+    fits &= radius <= MAX_ARC_RADIUS
+    offsets = windows - center[:, None]
+    radial_error = np.abs(np.hypot(offsets[..., 0], offsets[..., 1]) - radius[:, None]).max(axis=1)
+    # Padding adds segments of no length, which don't bulge.
+    segments = np.diff(windows, axis=1)
+    half_chords = np.minimum(np.hypot(segments[..., 0], segments[..., 1]) / 2, radius[:, None])
+    sagitta = radius - np.sqrt(radius[:, None] ** 2 - half_chords ** 2).min(axis=1)
+    fits &= radial_error + sagitta <= tolerance
+    # Angle turned along each segment, as seen from the centre.
+    before, after = offsets[:, :-1], offsets[:, 1:]
+    steps = np.arctan2(before[..., 0] * after[..., 1] - before[..., 1] * after[..., 0],
+                       before[..., 0] * after[..., 0] + before[..., 1] * after[..., 1])
+    counterclockwise = steps[:, 0] > 0
+    turning = np.where(counterclockwise[:, None], steps > 0, steps < 0)
+    turning |= np.arange(width - 1) >= size[:, None] - 1
+    fits &= turning.all(axis=1) & (np.abs(steps.sum(axis=1)) < 2 * np.pi - 1e-3)
+    return fits, center, counterclockwise
+
+
+def _longest_arcs(points, tolerance):
+    """Start, end index, centre and direction of the longest arc from every
+    point an arc can start at.
+
+    Arcs are extended from MIN_ARC_POINTS points while they keep fitting,
+    galloping then binary searching, for every start at once.
+    """
+    if len(points) < MIN_ARC_POINTS:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros((0, 2)), np.zeros(0, dtype=bool)
+    starts = np.arange(len(points) - MIN_ARC_POINTS + 1)
+    fits, centers, counterclockwise = _fit_arcs(
+        points, starts, np.full(len(starts), MIN_ARC_POINTS), tolerance)
+    starts, centers, counterclockwise = starts[fits], centers[fits], counterclockwise[fits]
+    ends = starts + MIN_ARC_POINTS - 1
+    steps = np.ones(len(starts), dtype=int)
+    # First end found not to fit, or -1.
+    failed = np.full(len(starts), -1)
+    galloping = ends < len(points) - 1
+    while galloping.any():
+        rows = np.flatnonzero(galloping)
+        candidates = np.minimum(ends[rows] + steps[rows], len(points) - 1)
+        fit, center, turn = _fit_arcs(points, starts[rows], candidates - starts[rows] + 1, tolerance)
+        longer = rows[fit]
+        ends[longer], centers[longer], counterclockwise[longer] = candidates[fit], center[fit], turn[fit]
+        steps[longer] *= 2
+        failed[rows[~fit]] = candidates[~fit]
+        galloping[rows[~fit]] = False
+        galloping[longer] = ends[longer] < len(points) - 1
+    searching = (failed >= 0) & (failed - ends > 1)
+    while searching.any():
+        rows = np.flatnonzero(searching)
+        middles = (ends[rows] + failed[rows]) // 2
+        fit, center, turn = _fit_arcs(points, starts[rows], middles - starts[rows] + 1, tolerance)
+        longer = rows[fit]
+        ends[longer], centers[longer], counterclockwise[longer] = middles[fit], center[fit], turn[fit]
+        failed[rows[~fit]] = middles[~fit]
+        searching[rows] = failed[rows] - ends[rows] > 1
+    return starts, ends, centers, counterclockwise
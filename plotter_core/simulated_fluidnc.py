@@ -0,0 +1,184 @@
+"""A stand-in for FluidNC on a local socket, for running without a plotter.
+
+Speaks as much of FluidNC's serial protocol as GCodeSender uses. Lines wait
+in a receive buffer and are acknowledged with "ok" as they go into a
+planner of limits.planner_blocks moves, which run for as long as their
+length at their feed rate takes, divided by speedup. ? gets a status report
+with Bf and FS, ! holds, ~ resumes and a soft reset empties the buffers.
+A reset while moving or held leaves it in Alarm, refusing lines with
+error:9 until $X unlocks it or $H homes it.
+Connect with GCodeSender(controller.url).
+"""
+
+import collections
+import math
+import socket
+import threading
+import time
+from plotter_core import gcode_parser
+from plotter_core import time_estimator
+
+# Size of the receive buffer reported in Bf, like FluidNC's.
+RX_BUFFER_SIZE = 128
+_BANNER = b"\r\nGrbl 3.7 [FluidNC (simulated) '$' for help]\r\n"
+
+
+class SimulatedFluidNC:
+    def __init__(self, speedup=1.0, limits=time_estimator.MachineLimits()):
+        self.speedup = speedup
+        self.limits = limits
+        self._server = socket.create_server(('127.0.0.1', 0))
+        self.url = f'socket://127.0.0.1:{self._server.getsockname()[1]}'
+        self._connection = None
+        # Guards everything below, and wakes the motion thread.
+        self._changed = threading.Condition()
+        self._received = bytearray()
+        # (x, y, z) points along each planned move and seconds to run it. The
+        # first one is running.
+        self._planner = collections.deque()
+        self._remaining = 0.0
+        # time.monotonic() since when the running move has been moving, or
+        # None while it's held or between moves.
+        self._since = None
+        self._position = (0.0, 0.0, 0.0)
+        self._interpreter = gcode_parser.GCodeInterpreter()
+        self._held = False
+        self._alarm = False
+        self._running = True
+        threading.Thread(target=self._serve, daemon=True).start()
+        threading.Thread(target=self._move, daemon=True).start()
+
+    def close(self):
+        with self._changed:
+            self._running = False
+            self._changed.notify_all()
+        self._server.close()
+        if self._connection:
+            self._connection.close()
+
+    def _serve(self):
+        try:
+            self._connection, _ = self._server.accept()
+            while self._running:
+                data = self._connection.recv(4096)
+                if not data:
+                    break
+                with self._changed:
+                    for byte in data:
+                        self._receive(bytes((byte,)))
+                    self._plan()
+        except OSError:
+            pass  # Closed.
+
+    def _receive(self, char):
+        if char == b'?':
+            self._send(self._status().encode() + b'\r\n')
+        elif char in b'!~':
+            self._held = char == b'!' and bool(self._planner)
+            self._changed.notify_all()
+        elif char == b'\x18':
+            # The pen stops where it's got to, and may have lost steps doing so.
+            self._alarm = self._alarm or bool(self._planner)
+            self._position = self._current_position()
+            self._received.clear()
+            self._planner.clear()
+            self._held = False
+            self._changed.notify_all()
+            interpreter = gcode_parser.GCodeInterpreter()
+            interpreter.x, interpreter.y, interpreter.z = self._position
+            self._interpreter = interpreter
+            self._send(_BANNER)
+        else:
+            self._received += char
+
+    def _status(self):
+        if self._alarm:
+            state = 'Alarm'
+        elif self._held:
+            state = 'Hold:0'
+        else:
+            state = 'Run' if self._planner else 'Idle'
+        position = ','.join(f'{value:.3f}' for value in self._current_position())
+        return (f'<{state}|MPos:{position}|'
+                f'Bf:{self.limits.planner_blocks - len(self._planner)},'
+                f'{RX_BUFFER_SIZE - len(self._received)}|FS:{self._speed():.0f},0>')
+
+    def _speed(self):
+        """How fast the pen is moving, in mm/min."""
+        if not self._planner or self._held:
+            return 0.0
+        path, seconds = self._planner[0]
+        if seconds <= 0:
+            return 0.0
+        return sum(math.dist(a, b) for a, b in zip(path, path[1:])) / seconds * 60
+
+    def _current_position(self):
+        """Where the pen is, partway along the running move."""
+        if not self._planner:
+            return self._position
+        path, seconds = self._planner[0]
+        remaining = self._remaining
+        if self._since is not None:
+            remaining -= time.monotonic() - self._since
+        if seconds <= 0 or remaining <= 0:
+            return path[-1]
+        # Points along the move at the distance it's got to.
+        travelled = (1 - remaining / seconds) * sum(
+            math.dist(a, b) for a, b in zip(path, path[1:]))
+        for a, b in zip(path, path[1:]):
+            step = math.dist(a, b)
+            if travelled <= step:
+                return tuple(p + (q - p) * travelled / step for p, q in zip(a, b))
+            travelled -= step
+        return path[-1]
+
+    def _plan(self):
+        """Acknowledges received lines while the planner has room."""
+        while b'\n' in self._received and len(self._planner) < self.limits.planner_blocks:
+            line, _, rest = self._received.partition(b'\n')
+            self._received[:] = rest
+            text = line.decode('UTF-8', errors='replace').strip()
+            if text.upper() == '$H':
+                self._alarm = False
+                self._position = (0.0, 0.0, 0.0)
+                self._interpreter = gcode_parser.GCodeInterpreter()
+            elif text.upper() == '$X':
+                self._alarm = False
+            elif self._alarm and text:
+                self._send(b'error:9\r\n')
+                continue
+            move = self._interpreter.execute(text)
+            if move is not None:
+                path = [(*move.start, move.z_before),
+                        *((x, y, move.z) for x, y in move.points.tolist())]
+                length = sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+                rate = self.limits.max_rate[0] if move.rapid or not move.feed else move.feed
+                if not self._planner:
+                    self._remaining = length / rate * 60 / self.speedup
+                self._planner.append((path, length / rate * 60 / self.speedup))
+                self._changed.notify_all()
+            self._send(b'ok\r\n')
+
+    def _send(self, data):
+        try:
+            self._connection.sendall(data)
+        except OSError:
+            pass  # Closed.
+
+    def _move(self):
+        """Runs planned moves in (sped up) real time."""
+        with self._changed:
+            while self._running:
+                if not self._planner or self._held:
+                    self._changed.wait()
+                    continue
+                # Woken early by new lines, holds and resets.
+                self._since = time.monotonic()
+                self._changed.wait(self._remaining)
+                self._remaining -= time.monotonic() - self._since
+                self._since = None
+                if self._remaining > 0 or self._held or not self._planner:
+                    continue
+                self._position = self._planner.popleft()[0][-1]
+                self._remaining = self._planner[0][1] if self._planner else 0.0
+                self._plan()
@@ -0,0 +1,190 @@
+"""Compact storage for drawn strokes.
+
+All points live in one contiguous float32 (N, 2) array, and strokes are
+described by the index of their first point. Appending a point and ending a
+stroke are both amortized O(1), and strokes are returned as views into the
+array, so nothing is copied to read them.
+"""
+
+import struct
+import zipfile
+import numpy as np
+
+_INITIAL_CAPACITY = 256
+
+
+class StrokeBuffer:
+    def __init__(self, capacity=_INITIAL_CAPACITY):
+        self._coords = np.empty((max(capacity, 1), 2), dtype=np.float32)
+        self._num_points = 0
+        # Index of the first point of each stroke. The last one is the start
+        # of the stroke being drawn, which may still be empty.
+        self._starts = np.zeros(16, dtype=np.int64)
+        self._num_starts = 1
+        # Whether the pen was lifted after the last point, i.e. the buffer
+        # ends with a finished stroke rather than one still being drawn.
+        self.stroke_ended = False
+        # end_stroke() was called before any point was added, i.e. the buffer
+        # begins by finishing a stroke that started before it.
+        self.starts_with_pen_up = False
+
+    @property
+    def num_points(self):
+        return self._num_points
+
+    @property
+    def is_empty(self):
+        """No points, and no pen lifts either."""
+        return not self._num_points and not self.stroke_ended
+
+    @property
+    def coords(self):
+        """(num_points, 2) view of every point, in order."""
+        return self._coords[:self._num_points]
+
+    @property
+    def next_stroke(self):
+        """Index of the stroke being drawn, or of the next one if none is."""
+        return self._num_starts - 1
+
+    @property
+    def stroke_starts(self):
+        """Index of the first point of every non-empty stroke."""
+        starts = self._starts[:self._num_starts]
+        return starts if starts[-1] < self._num_points else starts[:-1]
+
+    def append(self, x, y):
+        self._reserve(self._num_points + 1)
+        self._coords[self._num_points] = (x, y)
+        self._num_points += 1
+        self.stroke_ended = False
+
+    def extend(self, points):
+        """Appends points to the current stroke."""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if not len(points):
+            return
+        needed = self._num_points + len(points)
+        self._reserve(needed)
+        self._coords[self._num_points:needed] = points
+        self._num_points = needed
+        self.stroke_ended = False
+
+    def _reserve(self, needed):
+        # Memory-mapped points are read-only, so they're copied on first write.
+        if needed > len(self._coords) or not self._coords.flags.writeable:
+            self._coords = _grown(self._coords, self._num_points, needed)
+
+    def end_stroke(self):
+        """Lifts the pen. Does nothing to the strokes if none is being drawn."""
+        if not self._num_points:
+            self.starts_with_pen_up = True
+        self.stroke_ended = True
+        if self._starts[self._num_starts - 1] == self._num_points:
+            return
+        if self._num_starts == len(self._starts):
+            self._starts = _grown(self._starts, self._num_starts)
+        self._starts[self._num_starts] = self._num_points
+        self._num_starts += 1
+
+    def add_stroke(self, points):
+        """Appends points as a stroke of their own."""
+        if self._starts[self._num_starts - 1] != self._num_points:
+            self.end_stroke()
+        self.extend(points)
+        self.end_stroke()
+
+    def extend_strokes(self, other):
+        """Appends every stroke of another buffer."""
+        for stroke in other:
+            self.add_stroke(stroke)
+
+    def pop(self):
+        """Removes and returns the last point of the stroke being drawn."""
+        if self._starts[self._num_starts - 1] == self._num_points:
+            raise IndexError('pop from a finished stroke')
+        self._num_points -= 1
+        return tuple(self._coords[self._num_points])
+
+    def __len__(self):
+        return len(self.stroke_starts)
+
+    def __getitem__(self, index):
+        starts = self.stroke_starts
+        start = starts[index]
+        index = index % len(starts)
+        stop = starts[index + 1] if index + 1 < len(starts) else self._num_points
+        return self._coords[start:stop]
+
+    def __iter__(self):
+        starts = self.stroke_starts
+        stops = np.append(starts[1:], self._num_points)
+        for start, stop in zip(starts, stops):
+            yield self._coords[start:stop]
+
+    def save(self, path):
+        """Writes an uncompressed .npz, which load() can memory-map."""
+        np.savez(path, coords=self.coords, starts=self.stroke_starts,
+                 stroke_ended=self.stroke_ended)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Reads a buffer written by save().
+
+        With mmap, the points are memory-mapped read-only instead of being
+        read in. Appending to the buffer copies them into memory first.
+        """
+        arrays = {}
+        with zipfile.ZipFile(path) as archive:
+            for name in ('coords', 'starts', 'stroke_ended'):
+                info = archive.getinfo(name + '.npy')
+                if mmap and info.compress_type == zipfile.ZIP_STORED:
+                    arrays[name] = _memmap_member(path, info)
+                else:
+                    with archive.open(info) as member:
+                        arrays[name] = np.lib.format.read_array(member)
+        return cls.from_arrays(arrays['coords'], arrays['starts'], bool(arrays['stroke_ended']))
+
+    @classmethod
+    def from_arrays(cls, coords, starts, stroke_ended=True):
+        """A buffer of (N, 2) points, with strokes starting at the indices in starts.
+
+        Uses coords as it is if it's already float32.
+        """
+        buffer = cls(capacity=1)
+        buffer._coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        buffer._num_points = len(buffer._coords)
+        buffer.stroke_ended = stroke_ended
+        starts = np.asarray(starts, dtype=np.int64)
+        if stroke_ended or not len(starts):
+            # Start of the next, still empty, stroke.
+            starts = np.append(starts, buffer._num_points)
+        buffer._starts = starts
+        buffer._num_starts = len(starts)
+        return buffer
+
+
+def _grown(array, used, needed=0):
+    grown = np.empty((max(2 * len(array), needed, 1),) + array.shape[1:], dtype=array.dtype)
+    grown[:used] = array[:used]
+    return grown
+
+
+def _memmap_member(path, info):
+    """Maps an uncompressed .npy member of a zip file without reading it."""
+    with open(path, 'rb') as f:
+        # Local file header: 30 fixed bytes, then the name and extra field.
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack('<HH', f.read(4))
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if not all(shape):
+        return np.fromfile(path, dtype=dtype, count=int(np.prod(shape)),
+                           offset=offset).reshape(shape)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
@@ -0,0 +1,299 @@
+"""Grid index over drawn strokes, for erasing, picking and undoing.
+
+Every stroke ever drawn stays in one StrokeBuffer, numbered in the order
+it was started, and is either live or erased. The canvas is split into
+square cells, each listing the strokes with a segment whose bounding box
+touches it, so a region or point query only looks at strokes nearby before
+testing their segments exactly. Erasing, undoing and redoing only flip
+whether strokes are live, so they cost nothing per point, and erased strokes
+come back exactly as they were.
+"""
+
+import dataclasses
+import math
+import numpy as np
+from plotter_core import stroke_buffer
+
+# Canvas pixels per side of a grid cell.
+DEFAULT_CELL_SIZE = 32
+# Regions covering more cells than this check every stroke's bounds instead,
+# which is quicker than merging that many cells.
+_MAX_CELLS_VISITED = 256
+
+
+@dataclasses.dataclass(frozen=True)
+class Change:
+    """Strokes drawn, erased, or brought back by an undo or redo."""
+    ids: np.ndarray
+    # Whether they're live afterwards.
+    alive: bool
+
+
+class StrokeIndex:
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.buffer = stroke_buffer.StrokeBuffer()
+        # (column, row) -> ids of strokes with a segment near the cell. Erased
+        # strokes stay listed, and popped points may leave strokes listed in
+        # cells they no longer reach; queries check both.
+        self._cells = {}
+        self._alive = np.zeros(16, dtype=bool)
+        # Min x, min y, max x and max y of each stroke.
+        self._bounds = np.zeros((16, 4))
+        # Changes to undo and redo, most recent last.
+        self._undo = []
+        self._redo = []
+
+    @property
+    def next_id(self):
+        """Id of the stroke being drawn, or of the next one if none is."""
+        return self.buffer.next_stroke
+
+    def __len__(self):
+        """Live strokes."""
+        return int(np.count_nonzero(self._alive[:len(self.buffer)]))
+
+    def append(self, x, y):
+        """Adds a point to the stroke being drawn."""
+        stroke = self.buffer.next_stroke
+        starting = len(self.buffer) == stroke
+        previous = (x, y) if starting else tuple(self.buffer.coords[-1])
+        self.buffer.append(x, y)
+        if starting:
+            self._reserve(stroke + 1)
+            self._alive[stroke] = True
+            self._bounds[stroke] = (x, y, x, y)
+        else:
+            bounds = self._bounds[stroke]
+            bounds[:2] = np.minimum(bounds[:2], (x, y))
+            bounds[2:] = np.maximum(bounds[2:], (x, y))
+        self._insert_segment(stroke, previous, (x, y))
+
+    def pop(self):
+        """Removes and returns the last point of the stroke being drawn."""
+        point = self.buffer.pop()
+        stroke = self.buffer.next_stroke
+        if len(self.buffer) == stroke:
+            # Nothing left of it, so the next point starts it afresh.
+            self._alive[stroke] = False
+        return point
+
+    def end_stroke(self):
+        """Finishes the stroke being drawn, as one step to undo."""
+        stroke = self.buffer.next_stroke
+        drawn = len(self.buffer) > stroke
+        self.buffer.end_stroke()
+        if drawn:
+            self._record(Change(np.array([stroke]), True))
+
+    def add_strokes(self, strokes):
+        """Adds finished strokes, e.g. a loaded drawing, as one step to undo.
+
+        Returns the id of each non-empty stroke added.
+        """
+        self.end_stroke()
+        first = self.buffer.next_stroke
+        first_point = self.buffer.num_points
+        for stroke in strokes:
+            if len(stroke):
+                self.buffer.add_stroke(stroke)
+        ids = np.arange(first, self.buffer.next_stroke)
+        if not len(ids):
+            return ids
+        self._reserve(ids[-1] + 1)
+        points = self.buffer.coords[first_point:]
+        starts = self.buffer.stroke_starts[first:] - first_point
+        self._alive[ids] = True
+        self._bounds[ids, :2] = np.minimum.reduceat(points, starts)
+        self._bounds[ids, 2:] = np.maximum.reduceat(points, starts)
+        self._insert_strokes(ids, starts, points)
+        self._record(Change(ids, True))
+        return ids
+
+    def live_ids(self, first=0):
+        """Ids of the live strokes from first on, ascending."""
+        return np.flatnonzero(self._alive[first:len(self.buffer)]) + first
+
+    def strokes(self, ids):
+        """A StrokeBuffer of the strokes ids, in that order."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return stroke_buffer.StrokeBuffer()
+        index, lengths = self._point_index(ids)
+        return stroke_buffer.StrokeBuffer.from_arrays(
+            self.buffer.coords[index], np.cumsum(lengths) - lengths)
+
+    def in_region(self, x0, y0, x1, y1):
+        """Ids of the live strokes with a point or segment in the rectangle,
+        ascending."""
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        ids = self._candidates(x0, y0, x1, y1)
+        bounds = self._bounds[ids]
+        inside = ((bounds[:, 0] >= x0) & (bounds[:, 1] >= y0) &
+                  (bounds[:, 2] <= x1) & (bounds[:, 3] <= y1))
+        starts, ends, labels = self._segments(ids[~inside])
+        meets = _meets_rectangle(starts, ends, x0, y0, x1, y1)
+        return self._sorted_ids(ids[inside], labels[meets])
+
+    def pick(self, x, y, radius):
+        """Id of the live stroke nearest (x, y), or None if none is within radius."""
+        ids = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        if not len(ids):
+            return None
+        starts, ends, labels = self._segments(ids)
+        distances = _distances(starts, ends, np.array((x, y)))
+        nearest = np.argmin(distances)
+        return int(labels[nearest]) if distances[nearest] <= radius else None
+
+    def erase(self, ids):
+        """Erases the live strokes among ids, as one step to undo."""
+        ids = self._sorted_ids(ids)
+        ids = ids[self._alive[ids]]
+        change = Change(ids, False)
+        self._alive[ids] = False
+        if len(ids):
+            self._record(change)
+        return change
+
+    def clear(self):
+        """Erases every stroke, as one step to undo."""
+        return self.erase(self.live_ids())
+
+    def undo(self):
+        """Reverts the last change, returning what that did, or None if there's
+        nothing to undo."""
+        if not self._undo:
+            return None
+        change = self._undo.pop()
+        self._redo.append(change)
+        reverted = Change(change.ids, not change.alive)
+        self._alive[reverted.ids] = reverted.alive
+        return reverted
+
+    def redo(self):
+        """Makes the last change undone again, or returns None if there's none."""
+        if not self._redo:
+            return None
+        change = self._redo.pop()
+        self._undo.append(change)
+        self._alive[change.ids] = change.alive
+        return change
+
+    def _record(self, change):
+        self._undo.append(change)
+        self._redo.clear()
+
+    def _sorted_ids(self, *ids):
+        """Every id in the arrays, once and ascending. Quicker than np.unique
+        for the many ids that erasing everything takes."""
+        found = np.zeros(len(self._alive), dtype=bool)
+        for some in ids:
+            found[np.asarray(some, dtype=np.int64)] = True
+        return np.flatnonzero(found)
+
+    def _reserve(self, needed):
+        if needed > len(self._alive):
+            size = max(2 * len(self._alive), needed)
+            self._alive = np.concatenate((self._alive, np.zeros(size - len(self._alive), bool)))
+            self._bounds = np.concatenate((self._bounds, np.zeros((size - len(self._bounds), 4))))
+
+    def _insert_segment(self, stroke, start, end):
+        size = self.cell_size
+        for column in range(math.floor(min(start[0], end[0]) / size),
+                            math.floor(max(start[0], end[0]) / size) + 1):
+            for row in range(math.floor(min(start[1], end[1]) / size),
+                             math.floor(max(start[1], end[1]) / size) + 1):
+                self._cells.setdefault((column, row), set()).add(stroke)
+
+    def _insert_strokes(self, ids, starts, points):
+        """Lists strokes in every cell their segments' bounds touch."""
+        lengths = np.diff(np.append(starts, len(points)))
+        labels = np.repeat(ids, lengths)
+        # Each point's segment goes to the next point, or nowhere at a stroke's end.
+        ends = np.append(points[1:], points[-1:], axis=0)
+        last = starts + lengths - 1
+        ends[last] = points[last]
+        low = np.floor(np.minimum(points, ends) / self.cell_size).astype(np.int64)
+        high = np.floor(np.maximum(points, ends) / self.cell_size).astype(np.int64)
+        span = high - low
+        # Segments are mostly shorter than a cell, so touch at most 2 x 2 cells.
+        cells = []
+        for offset in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            reaches = (span[:, 0] >= offset[0]) & (span[:, 1] >= offset[1])
+            cells.append(np.column_stack((low[reaches] + offset, labels[reaches])))
+        for i in np.flatnonzero((span > 1).any(axis=1)).tolist():
+            self._insert_segment(int(labels[i]), points[i], ends[i])
+        # Sorted by cell, so each cell's strokes are added together.
+        cells = np.unique(np.concatenate(cells), axis=0)
+        keys = cells[:, :2].tolist()
+        strokes = cells[:, 2].tolist()
+        new_cell = np.flatnonzero((np.diff(cells[:, :2], axis=0) != 0).any(axis=1)) + 1
+        boundaries = [0, *new_cell.tolist(), len(cells)]
+        for start, stop in zip(boundaries, boundaries[1:]):
+            self._cells.setdefault(tuple(keys[start]), set()).update(strokes[start:stop])
+
+    def _candidates(self, x0, y0, x1, y1):
+        """Live strokes whose bounds meet the rectangle."""
+        size = self.cell_size
+        columns = range(math.floor(x0 / size), math.floor(x1 / size) + 1)
+        rows = range(math.floor(y0 / size), math.floor(y1 / size) + 1)
+        if len(columns) * len(rows) > _MAX_CELLS_VISITED:
+            ids = self.live_ids()
+        else:
+            found = set()
+            for column in columns:
+                for row in rows:
+                    found.update(self._cells.get((column, row), ()))
+            ids = np.fromiter(found, dtype=np.int64, count=len(found))
+            ids = ids[self._alive[ids]]
+        bounds = self._bounds[ids]
+        return ids[(bounds[:, 0] <= x1) & (bounds[:, 1] <= y1) &
+                   (bounds[:, 2] >= x0) & (bounds[:, 3] >= y0)]
+
+    def _point_index(self, ids):
+        """Index into buffer.coords of every point of the strokes ids, and
+        each stroke's length."""
+        starts = self.buffer.stroke_starts
+        stops = np.append(starts[1:], self.buffer.num_points)
+        lengths = stops[ids] - starts[ids]
+        offsets = np.repeat(starts[ids] - (np.cumsum(lengths) - lengths), lengths)
+        return offsets + np.arange(len(offsets)), lengths
+
+    def _segments(self, ids):
+        """Start and end of every segment of the strokes ids, and whose it is.
+        Single points are segments of no length."""
+        index, lengths = self._point_index(ids)
+        starts = self.buffer.coords[index]
+        ends = np.append(starts[1:], starts[-1:], axis=0)
+        last = np.cumsum(lengths) - 1
+        ends[last] = starts[last]
+        return starts, ends, np.repeat(ids, lengths)
+
+
+def _meets_rectangle(starts, ends, x0, y0, x1, y1):
+    """Whether each segment touches the rectangle: its bounds overlap the
+    rectangle's, and the rectangle's corners aren't all on one side of it."""
+    low = np.minimum(starts, ends)
+    high = np.maximum(starts, ends)
+    meets = (low[:, 0] <= x1) & (low[:, 1] <= y1) & (high[:, 0] >= x0) & (high[:, 1] >= y0)
+    # Most segments are near the rectangle, not across its corners, so only
+    # the ones that could cut a corner off are checked further.
+    crossing = np.flatnonzero(meets & ~(
+        ((low[:, 0] >= x0) & (high[:, 0] <= x1)) | ((low[:, 1] >= y0) & (high[:, 1] <= y1))))
+    direction = (ends[crossing] - starts[crossing])[:, None, :]
+    corners = np.array(((x0, y0), (x1, y0), (x0, y1), (x1, y1)))
+    offsets = corners[None, :, :] - starts[crossing, None, :]
+    sides = direction[..., 0] * offsets[..., 1] - direction[..., 1] * offsets[..., 0]
+    meets[crossing] = (sides.min(axis=1) <= 0) & (sides.max(axis=1) >= 0)
+    return meets
+
+
+def _distances(starts, ends, point):
+    """Distance from point to each segment."""
+    direction = ends - starts
+    squared_lengths = np.einsum('ij,ij->i', direction, direction)
+    along = np.einsum('ij,ij->i', point - starts, direction)
+    t = np.clip(np.divide(along, squared_lengths, out=np.zeros_like(along),
+                          where=squared_lengths > 0), 0, 1)
+    return np.hypot(*(starts + t[:, None] * direction - point).T)
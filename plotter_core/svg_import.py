@@ -0,0 +1,297 @@
+"""Reads the outlines in an SVG file as strokes.
+
+Supports <path> (all commands, curves and arcs flattened), <line>,
+<polyline>, <polygon>, <rect>, <circle> and <ellipse>, with transforms.
+Fills, strokes widths and styles are ignored: every outline becomes a pen
+stroke.
+"""
+
+import math
+import re
+import warnings
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# Curves and arcs are flattened into this many segments.
+CURVE_SEGMENTS = 16
+ELLIPSE_SEGMENTS = 72
+_MM_PER_UNIT = {'mm': 1.0, 'cm': 10.0, 'in': 25.4, 'pt': 25.4 / 72, 'pc': 25.4 / 6,
+                'px': 25.4 / 96, '': 25.4 / 96}
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_PATH_COMMAND = re.compile(r'[\s,]*([MmLlHhVvCcSsQqTtAaZz])')
+_PATH_NUMBER = re.compile(rf'[\s,]*({_NUMBER})')
+# Arc flags are a single digit, which minified paths run into the number
+# after them, e.g. "a10 10 0 011 10".
+_PATH_FLAG = re.compile(r'[\s,]*([01])')
+_PATH_END = re.compile(r'[\s,]*$')
+# What each path command takes: n for a number, f for a flag.
+_PATH_ARGUMENTS = {'M': 'nn', 'L': 'nn', 'H': 'n', 'V': 'n', 'C': 'nnnnnn', 'S': 'nnnn',
+                   'Q': 'nnnn', 'T': 'nn', 'A': 'nnnffnn', 'Z': ''}
+_TRANSFORM = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)')
+
+
+def load(path):
+    """Strokes in the file, as (N, 2) arrays in mm with y pointing down.
+
+    Returns (strokes, (width, height)). Documents without absolute units
+    are taken to be in CSS pixels (96 per inch).
+    """
+    root = ET.parse(path).getroot()
+    matrix, size = _document_transform(root)
+    strokes = []
+    _collect(root, matrix, strokes)
+    return [stroke for stroke in strokes if len(stroke) > 1], size
+
+
+def _length_mm(value):
+    match = re.fullmatch(rf'\s*({_NUMBER})\s*([a-z%]*)\s*', value or '')
+    if not match or match.group(2) not in _MM_PER_UNIT:
+        return None
+    return float(match.group(1)) * _MM_PER_UNIT[match.group(2)]
+
+
+def _document_transform(root):
+    """Matrix from user units to mm from the document's top left corner, and
+    the document's size in mm."""
+    width = _length_mm(root.get('width'))
+    height = _length_mm(root.get('height'))
+    view_box = root.get('viewBox')
+    if view_box:
+        min_x, min_y, box_width, box_height = (
+            float(x) for x in re.split(r'[\s,]+', view_box.strip()))
+        if width is None:
+            width = box_width * _MM_PER_UNIT['px']
+        if height is None:
+            height = box_height * width / box_width
+        scale = width / box_width
+        # The viewBox's top left corner is the document's.
+        matrix = np.array([(scale, 0, -min_x * scale), (0, scale, -min_y * scale), (0, 0, 1)])
+        return matrix, (width, height)
+    # Without a viewBox, user units are CSS pixels whatever the size says.
+    return np.diag([_MM_PER_UNIT['px'], _MM_PER_UNIT['px'], 1.0]), (width, height)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _collect(element, matrix, strokes):
+    matrix = matrix @ _parse_transform(element.get('transform', ''))
+    tag = _local_name(element.tag)
+    if tag in ('defs', 'clipPath', 'mask', 'symbol', 'metadata', 'title', 'desc'):
+        return
+    shapes = _shape(tag, element)
+    for shape in shapes:
+        points = np.column_stack((shape, np.ones(len(shape)))) @ matrix.T
+        strokes.append(points[:, :2])
+    for child in element:
+        _collect(child, matrix, strokes)
+
+
+def _number(element, name, default=0.0):
+    value = element.get(name)
+    if value is None:
+        return default
+    return float(re.match(_NUMBER, value.strip()).group())
+
+
+def _shape(tag, element):
+    if tag == 'path':
+        return _parse_path(element.get('d', ''))
+    if tag == 'line':
+        return [np.array([(_number(element, 'x1'), _number(element, 'y1')),
+                          (_number(element, 'x2'), _number(element, 'y2'))])]
+    if tag in ('polyline', 'polygon'):
+        values = [float(x) for x in re.findall(_NUMBER, element.get('points', ''))]
+        points = np.array(values[:len(values) // 2 * 2]).reshape(-1, 2)
+        if tag == 'polygon' and len(points):
+            points = np.vstack([points, points[:1]])
+        return [points]
+    if tag == 'rect':
+        x, y = _number(element, 'x'), _number(element, 'y')
+        width, height = _number(element, 'width'), _number(element, 'height')
+        return [np.array([(x, y), (x + width, y), (x + width, y + height), (x, y + height), (x, y)])]
+    if tag in ('circle', 'ellipse'):
+        rx = _number(element, 'r') if tag == 'circle' else _number(element, 'rx')
+        ry = _number(element, 'r') if tag == 'circle' else _number(element, 'ry')
+        angles = np.linspace(0, 2 * math.pi, ELLIPSE_SEGMENTS + 1)
+        return [np.column_stack((_number(element, 'cx') + rx * np.cos(angles),
+                                 _number(element, 'cy') + ry * np.sin(angles)))]
+    return []
+
+
+def _parse_transform(text):
+    matrix = np.eye(3)
+    for name, args in _TRANSFORM.findall(text):
+        values = [float(x) for x in re.findall(_NUMBER, args)]
+        step = np.eye(3)
+        if name == 'matrix' and len(values) == 6:
+            a, b, c, d, e, f = values
+            step = np.array([(a, c, e), (b, d, f), (0, 0, 1)])
+        elif name == 'translate' and values:
+            step[0, 2] = values[0]
+            step[1, 2] = values[1] if len(values) > 1 else 0.0
+        elif name == 'scale' and values:
+            step[0, 0] = values[0]
+            step[1, 1] = values[1] if len(values) > 1 else values[0]
+        elif name == 'rotate' and values:
+            angle = math.radians(values[0])
+            cx, cy = values[1:3] if len(values) == 3 else (0.0, 0.0)
+            cos, sin = math.cos(angle), math.sin(angle)
+            step = np.array([(cos, -sin, cx - cos * cx + sin * cy),
+                             (sin, cos, cy - sin * cx - cos * cy), (0, 0, 1)])
+        elif name == 'skewX' and values:
+            step[0, 1] = math.tan(math.radians(values[0]))
+        elif name == 'skewY' and values:
+            step[1, 0] = math.tan(math.radians(values[0]))
+        matrix = matrix @ step
+    return matrix
+
+
+def _bezier(points, segments=CURVE_SEGMENTS):
+    """Points along a quadratic or cubic Bezier, excluding its start."""
+    points = np.asarray(points, dtype=float)
+    t = np.linspace(0, 1, segments + 1)[1:, None]
+    if len(points) == 3:
+        return (1 - t) ** 2 * points[0] + 2 * (1 - t) * t * points[1] + t ** 2 * points[2]
+    return ((1 - t) ** 3 * points[0] + 3 * (1 - t) ** 2 * t * points[1] +
+            3 * (1 - t) * t ** 2 * points[2] + t ** 3 * points[3])
+
+
+def _arc(start, rx, ry, rotation, large_arc, sweep, end):
+    """Points along an SVG elliptical arc, excluding its start."""
+    if rx == 0 or ry == 0 or np.allclose(start, end):
+        return np.array([end])
+    # Endpoint to centre parameterization, SVG spec appendix F.6.5.
+    phi = math.radians(rotation)
+    cos, sin = math.cos(phi), math.sin(phi)
+    dx, dy = (start[0] - end[0]) / 2, (start[1] - end[1]) / 2
+    x1, y1 = cos * dx + sin * dy, -sin * dx + cos * dy
+    rx, ry = abs(rx), abs(ry)
+    scale = x1 ** 2 / rx ** 2 + y1 ** 2 / ry ** 2
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+    numerator = max(rx ** 2 * ry ** 2 - rx ** 2 * y1 ** 2 - ry ** 2 * x1 ** 2, 0.0)
+    factor = math.sqrt(numerator / (rx ** 2 * y1 ** 2 + ry ** 2 * x1 ** 2))
+    if large_arc == sweep:
+        factor = -factor
+    cx1, cy1 = factor * rx * y1 / ry, -factor * ry * x1 / rx
+    cx = cos * cx1 - sin * cy1 + (start[0] + end[0]) / 2
+    cy = sin * cx1 + cos * cy1 + (start[1] + end[1]) / 2
+    theta = math.atan2((y1 - cy1) / ry, (x1 - cx1) / rx)
+    delta = math.atan2((-y1 - cy1) / ry, (-x1 - cx1) / rx) - theta
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    count = max(2, math.ceil(abs(delta) / (2 * math.pi) * ELLIPSE_SEGMENTS))
+    angles = theta + delta * np.arange(1, count + 1) / count
+    points = np.column_stack((
+        cx + rx * np.cos(angles) * cos - ry * np.sin(angles) * sin,
+        cy + rx * np.cos(angles) * sin + ry * np.sin(angles) * cos))
+    points[-1] = end
+    return points
+
+
+def _arguments(d, i, kinds):
+    """The numbers for a path command at d[i:] and where they end, or None
+    if they aren't all there."""
+    values = []
+    for kind in kinds:
+        match = (_PATH_FLAG if kind == 'f' else _PATH_NUMBER).match(d, i)
+        if not match:
+            return None
+        values.append(float(match.group(1)))
+        i = match.end()
+    return values, i
+
+
+def _parse_path(d):
+    """Strokes drawn by path data. Like browsers, draws what comes before
+    an error and warns about the rest."""
+    strokes = []
+    current = []
+    position = np.zeros(2)
+    subpath_start = np.zeros(2)
+    last_control = None
+    command = None
+    i = 0
+
+    def finish():
+        nonlocal current
+        if len(current) > 1:
+            strokes.append(np.array(current))
+        current = []
+
+    while not _PATH_END.match(d, i):
+        match = _PATH_COMMAND.match(d, i)
+        if match:
+            command = match.group(1)
+            i = match.end()
+            if command in 'Zz':
+                if current:
+                    current.append(tuple(subpath_start))
+                finish()
+                position = subpath_start.copy()
+                current = [tuple(position)]
+                last_control = None
+                continue
+        upper = command.upper() if command else 'Z'
+        # Numbers only repeat the command before them, and Z takes none.
+        arguments = _arguments(d, i, _PATH_ARGUMENTS[upper]) if upper != 'Z' else None
+        if arguments is None:
+            warnings.warn(f'Path data cut short at character {i}: {d[i:i + 20]!r}')
+            break
+        values, i = arguments
+        relative = command.islower()
+        offset = position if relative else np.zeros(2)
+        control = None
+        if upper == 'M':
+            finish()
+            position = offset + values
+            subpath_start = position.copy()
+            current = [tuple(position)]
+            # Further pairs are implicit line-tos.
+            command = 'l' if relative else 'L'
+        elif upper == 'L':
+            position = offset + values
+            current.append(tuple(position))
+        elif upper == 'H':
+            position = np.array((values[0] + (position[0] if relative else 0.0), position[1]))
+            current.append(tuple(position))
+        elif upper == 'V':
+            position = np.array((position[0], values[0] + (position[1] if relative else 0.0)))
+            current.append(tuple(position))
+        elif upper in 'CS':
+            if upper == 'C':
+                first = offset + values[0:2]
+                rest = values[2:]
+            else:
+                # Reflection of the previous curve's second control point.
+                first = (2 * position - last_control[1] if last_control is not None and
+                         last_control[0] == 'C' else position)
+                rest = values
+            second = offset + rest[0:2]
+            end = offset + rest[2:4]
+            current.extend(map(tuple, _bezier([position, first, second, end])))
+            control = ('C', second)
+            position = end
+        elif upper in 'QT':
+            if upper == 'Q':
+                middle = offset + values[0:2]
+                end = offset + values[2:4]
+            else:
+                middle = (2 * position - last_control[1] if last_control is not None and
+                          last_control[0] == 'Q' else position)
+                end = offset + values
+            current.extend(map(tuple, _bezier([position, middle, end])))
+            control = ('Q', middle)
+            position = end
+        elif upper == 'A':
+            end = offset + values[5:7]
+            current.extend(map(tuple, _arc(position, values[0], values[1], values[2],
+                                           bool(values[3]), bool(values[4]), end)))
+            position = end
+        last_control = control
+    finish()
+    return strokes
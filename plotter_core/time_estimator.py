@@ -0,0 +1,302 @@
+"""Estimates how long G-code takes to run, the way FluidNC would plan it.
+
+Moves are planned like Grbl's planner does, with every move computed at
+once in NumPy. Each move accelerates and decelerates at a constant rate
+(a trapezoidal speed profile). Corners are taken at the speed junction
+deviation allows. The machine must always be able to stop within the
+moves its planner holds. Arcs run at the speed FluidNC's arc segments
+allow at each corner between segments.
+"""
+
+import dataclasses
+import math
+import re
+import numpy as np
+from plotter_core import gcode_parser
+
+_COMMENT = re.compile(rb'\(.*?\)|;[^\n]*')
+_WORD = re.compile(rb'[A-Z]\s*[-+]?(?:\d+\.?\d*|\.\d+)|\n')
+_SETTING = re.compile(r'^\s*\$(\d+)\s*=\s*([-+]?[\d.]+)', re.MULTILINE)
+_AXES = 'XYZ'
+
+
+@dataclasses.dataclass(frozen=True)
+class MachineLimits:
+    """Motion settings, named after the matching Grbl/FluidNC $ settings."""
+    # $110-$112, mm/min.
+    max_rate: tuple = (8000.0, 8000.0, 5000.0)
+    # $120-$122, mm/s^2.
+    acceleration: tuple = (500.0, 500.0, 500.0)
+    # $11 and $12, mm.
+    junction_deviation: float = 0.01
+    arc_tolerance: float = 0.002
+    # Moves FluidNC's planner looks ahead over.
+    planner_blocks: int = 16
+
+    @classmethod
+    def from_settings(cls, text, **kwargs):
+        """Limits from a $$ settings dump, e.g. "$110=8000.000" per line.
+
+        Settings that aren't given keep their defaults.
+        """
+        settings = {int(number): float(value) for number, value in _SETTING.findall(text)}
+        defaults = cls(**kwargs)
+        return dataclasses.replace(
+            defaults,
+            max_rate=tuple(settings.get(110 + i, rate) for i, rate in enumerate(defaults.max_rate)),
+            acceleration=tuple(settings.get(120 + i, accel)
+                               for i, accel in enumerate(defaults.acceleration)),
+            junction_deviation=settings.get(11, defaults.junction_deviation),
+            arc_tolerance=settings.get(12, defaults.arc_tolerance))
+
+
+def load_limits(path=None):
+    """MachineLimits from a settings file, or the defaults without one."""
+    if not path:
+        return MachineLimits()
+    with open(path) as f:
+        return MachineLimits.from_settings(f.read())
+
+
+@dataclasses.dataclass(frozen=True)
+class Estimate:
+    seconds: float
+    moves: int
+    # Distance in mm travelled with the pen down and up.
+    draw_distance: float
+    travel_distance: float
+
+    def __str__(self):
+        return format_duration(self.seconds)
+
+
+def format_duration(seconds):
+    """e.g. "1 h 5 min", "12 min 3 s" or "40 s"."""
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours} h {minutes} min'
+    if minutes:
+        return f'{minutes} min {seconds} s'
+    return f'{seconds} s'
+
+
+@dataclasses.dataclass
+class _Moves:
+    """Every move in a job, one row each."""
+    start: np.ndarray  # (N, 3) mm
+    end: np.ndarray  # (N, 3) mm
+    feed: np.ndarray  # mm/min, inf for rapids
+    # Arc centre (x, y) and direction (1 counterclockwise, -1 clockwise), or
+    # NaN and 0 for straight moves.
+    center: np.ndarray
+    turn: np.ndarray
+
+
+def estimate(gcode, limits=MachineLimits()):
+    """Estimates the run time of G-code, given as str or bytes."""
+    if isinstance(gcode, str):
+        gcode = gcode.encode('UTF-8', errors='replace')
+    moves = _parse(gcode)
+    if moves is None:
+        moves = _interpret(gcode)
+    return _plan(moves, limits)
+
+
+def estimate_path(points, feed, limits=MachineLimits(), start_speed=0.0):
+    """Estimates the time to draw straight moves through (N, 2) points in mm,
+    at feed mm/min, from start_speed mm/min and back to a standstill."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) < 2:
+        return Estimate(0.0, 0, 0.0, 0.0)
+    # Pen down, so the distance counts as drawn.
+    points = np.column_stack((points, np.ones(len(points))))
+    count = len(points) - 1
+    return _plan(_Moves(points[:-1], points[1:], np.full(count, float(feed)),
+                        np.full((count, 2), np.nan), np.zeros(count, dtype=int)), limits,
+                 start_speed)
+
+
+def _forward_fill(column, first):
+    """Replaces NaNs with the last value before them, or first."""
+    valid = ~np.isnan(column)
+    index = np.maximum.accumulate(np.where(valid, np.arange(len(column)), -1))
+    return np.where(index >= 0, column[np.maximum(index, 0)], first)
+
+
+def _parse(gcode):
+    """Moves in G-code, or None if it uses something only the interpreter handles.
+
+    Handles the absolute, millimetre G-code the compiler emits. Each line's
+    words are pulled out with one regex pass and modal values are
+    forward-filled across lines with NumPy.
+    """
+    words = np.array(_WORD.findall(_COMMENT.sub(b'', gcode).upper() + b'\n'))
+    if words.dtype.itemsize < 2:
+        return _empty_moves()
+    # Split each word into its letter and number without a Python loop.
+    letters = words.astype('S1')
+    newline = letters == b'\n'
+    width = words.dtype.itemsize
+    numbers = words.view(np.uint8).reshape(len(words), width)[:, 1:].copy().view(f'S{width - 1}')
+    numbers = numbers.ravel()
+    numbers[newline] = b'0'
+    values = numbers.astype(float)
+    line = np.cumsum(newline) - newline
+    num_lines = int(line[-1]) + 1
+    g_codes = values[letters == b'G']
+    if np.isin(g_codes, (20, 91)).any():
+        return None
+    columns = {}
+    for letter in (b'X', b'Y', b'Z', b'F', b'I', b'J', b'R'):
+        column = np.full(num_lines, np.nan)
+        mask = letters == letter
+        column[line[mask]] = values[mask]
+        columns[letter] = column
+    motion = np.full(num_lines, np.nan)
+    is_motion = (letters == b'G') & np.isin(values, (0, 1, 2, 3))
+    motion[line[is_motion]] = values[is_motion]
+    has_axis = ~(np.isnan(columns[b'X']) & np.isnan(columns[b'Y']) & np.isnan(columns[b'Z']))
+    motion = _forward_fill(motion, np.nan)
+    position = np.column_stack([_forward_fill(columns[axis.encode()], 0.0) for axis in _AXES])
+    feed = _forward_fill(columns[b'F'], np.inf)
+    is_move = has_axis & ~np.isnan(motion)
+    # Every move starts where the line before it left the machine.
+    start = np.vstack([np.zeros((1, 3)), position[:-1]])[is_move]
+    end = position[is_move]
+    motion = motion[is_move]
+    feed = np.where(motion == 0, np.inf, feed[is_move])
+    arc = np.isin(motion, (2, 3))
+    center = np.full((len(end), 2), np.nan)
+    offsets = np.column_stack((np.nan_to_num(columns[b'I'][is_move]),
+                               np.nan_to_num(columns[b'J'][is_move])))
+    center[arc] = start[arc, :2] + offsets[arc]
+    turn = np.where(motion == 3, 1, np.where(motion == 2, -1, 0))
+    with_radius = arc & ~np.isnan(columns[b'R'][is_move])
+    for i in np.flatnonzero(with_radius):
+        # R arcs are rare, so these go one at a time.
+        found = gcode_parser._center_from_radius(start[i, :2], end[i, :2],
+                                                 columns[b'R'][is_move][i], turn[i] < 0)
+        if found is None:
+            turn[i] = 0
+        else:
+            center[i] = found
+    return _Moves(start, end, feed, center, turn)
+
+
+def _empty_moves():
+    return _Moves(np.zeros((0, 3)), np.zeros((0, 3)), np.zeros(0), np.zeros((0, 2)),
+                  np.zeros(0, dtype=int))
+
+
+def _interpret(gcode):
+    """Moves found by running every line through gcode_parser. Slower, but
+    handles relative moves and inches. Arcs become their chords."""
+    interpreter = gcode_parser.GCodeInterpreter()
+    starts, ends, feeds = [], [], []
+    for text in gcode.decode('UTF-8', errors='replace').splitlines():
+        move = interpreter.execute(text)
+        if move is None:
+            continue
+        points = np.column_stack((move.points, np.full(len(move.points), move.z)))
+        starts.append(np.vstack([(*move.start, move.z_before), points[:-1]]))
+        ends.append(points)
+        feed = np.inf if move.rapid or move.feed is None else move.feed
+        feeds.append(np.full(len(points), feed))
+    if not starts:
+        return _empty_moves()
+    count = sum(len(feed) for feed in feeds)
+    return _Moves(np.concatenate(starts), np.concatenate(ends), np.concatenate(feeds),
+                  np.full((count, 2), np.nan), np.zeros(count, dtype=int))
+
+
+def _axis_limit(limits, directions):
+    """Per-axis limits, scaled to the largest allowed along each direction."""
+    with np.errstate(divide='ignore'):
+        return np.min(np.asarray(limits) / np.abs(directions), axis=1)
+
+
+def _plan(moves, limits, start_speed=0.0):
+    delta = moves.end - moves.start
+    arc = moves.turn != 0
+    # Straight moves: length and direction.
+    length = np.linalg.norm(delta, axis=1)
+    entry = np.divide(delta, length[:, None], out=np.zeros_like(delta), where=length[:, None] > 0)
+    exit_ = entry.copy()
+    radius = np.zeros(len(delta))
+    if arc.any():
+        from_center = moves.start[arc, :2] - moves.center[arc]
+        to_center = moves.end[arc, :2] - moves.center[arc]
+        radius[arc] = np.hypot(*from_center.T)
+        turn = moves.turn[arc]
+        sweep = (np.arctan2(to_center[:, 1], to_center[:, 0]) -
+                 np.arctan2(from_center[:, 1], from_center[:, 0]))
+        # Sweep the way the arc turns; ending where it started is a full circle.
+        sweep = np.where(turn * sweep <= 0, sweep + turn * 2 * math.pi, sweep)
+        length[arc] = np.hypot(radius[arc] * sweep, delta[arc, 2])
+        for rows, offset in ((entry, from_center), (exit_, to_center)):
+            tangent = turn[:, None] * np.column_stack((-offset[:, 1], offset[:, 0]))
+            tangent /= np.maximum(radius[arc], 1e-12)[:, None]
+            rows[arc] = np.column_stack((tangent, np.zeros(len(tangent))))
+    keep = length > 1e-9
+    length, entry, exit_ = length[keep], entry[keep], exit_[keep]
+    feed, arc, radius = moves.feed[keep], arc[keep], radius[keep]
+    pen_down = moves.end[keep, 2] > gcode_parser.PEN_DOWN_Z
+    count = len(length)
+    if not count:
+        return Estimate(0.0, 0, 0.0, 0.0)
+
+    # Acceleration (mm/s^2) and top speed (mm/s) of each move.
+    acceleration = np.where(arc, min(limits.acceleration[:2]),
+                            _axis_limit(limits.acceleration, entry))
+    speed = np.minimum(feed, np.where(arc, min(limits.max_rate[:2]),
+                                      _axis_limit(limits.max_rate, entry))) / 60
+    # FluidNC cuts arcs into segments no more than arc_tolerance off the
+    # circle and takes each corner between them at the junction speed. Arcs
+    # no bigger than that are one segment, and run like straight moves.
+    segmented = arc & (radius > limits.arc_tolerance)
+    if segmented.any():
+        # sin(theta / 2) for the corner between segments, as below.
+        sin_half = 1 - limits.arc_tolerance / radius[segmented]
+        corner = acceleration[segmented] * limits.junction_deviation * sin_half / (1 - sin_half)
+        speed[segmented] = np.minimum(speed[segmented], np.sqrt(corner))
+
+    # Squared speed allowed at the start of each move.
+    cos_theta = -np.einsum('ij,ij->i', exit_[:-1], entry[1:])
+    junction_vector = entry[1:] - exit_[:-1]
+    junction_vector /= np.maximum(np.linalg.norm(junction_vector, axis=1), 1e-12)[:, None]
+    junction_acceleration = _axis_limit(limits.acceleration, junction_vector)
+    sin_half = np.sqrt(np.clip(0.5 * (1 - cos_theta), 0, 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        junction = np.where(
+            cos_theta > 0.999999, 0.0,
+            np.where(cos_theta < -0.999999, np.inf,
+                     junction_acceleration * limits.junction_deviation * sin_half / (1 - sin_half)))
+    speed_squared = speed ** 2
+    junction = np.minimum(junction, np.minimum(speed_squared[:-1], speed_squared[1:]))
+    start_limit = min((start_speed / 60) ** 2, speed_squared[0])
+    entry_limit = np.concatenate([[start_limit], junction, [0.0]])
+
+    # Squared speed gained or lost over each move at full acceleration.
+    ramp = 2 * acceleration * length
+    ramp_sum = np.concatenate([[0.0], np.cumsum(ramp)])
+    # The planner only looks ahead planner_blocks moves, and must be able to
+    # stop at the end of them.
+    lookahead = np.minimum(np.arange(count + 1) + limits.planner_blocks, count)
+    entry_limit = np.minimum(entry_limit, ramp_sum[lookahead] - ramp_sum)
+    # Backward pass: v[i]^2 <= v[i+1]^2 + ramp[i] for every later move, which
+    # is a running minimum over the prefix sums.
+    backward = (np.minimum.accumulate((entry_limit + ramp_sum)[::-1])[::-1]) - ramp_sum
+    # Forward pass: v[i]^2 <= v[i-1]^2 + ramp[i-1].
+    entry_squared = np.minimum.accumulate(backward - ramp_sum) + ramp_sum
+    entry_squared = np.maximum(entry_squared, 0.0)
+    start_speed = np.sqrt(entry_squared[:-1])
+    end_speed = np.sqrt(entry_squared[1:])
+
+    # Trapezoid, or a triangle when the move is too short to reach top speed.
+    peak = np.minimum(speed, np.sqrt((ramp + entry_squared[:-1] + entry_squared[1:]) / 2))
+    cruise = np.maximum(length - (2 * peak ** 2 - entry_squared[:-1] - entry_squared[1:]) /
+                        (2 * acceleration), 0.0)
+    seconds = (2 * peak - start_speed - end_speed) / acceleration + cruise / peak
+    return Estimate(float(seconds.sum()), count, float(length[pen_down].sum()),
+                    float(length[~pen_down].sum()))
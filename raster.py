@@ -0,0 +1,258 @@
+"""Turns images into strokes: scanline hatching, cross-hatching and stippling.
+
+Images are resampled to one pixel per `resolution` mm and cut into square
+tiles, which are processed in parallel on a process pool. Hatch lines are
+found by sampling every line of a tile at once with cv2.remap and taking
+the runs darker than a threshold. Lines cut at tile edges are joined back
+up afterwards. Stipples are placed by weighted Voronoi stippling: each tile
+gets dots in proportion to its darkness, and Lloyd's algorithm moves every
+dot to the darkness-weighted centroid of its Voronoi cell, with cells
+found by cv2.distanceTransformWithLabels.
+
+Strokes come back as a StrokeBuffer in canvas pixels, like DrawingApp's.
+"""
+
+import concurrent.futures
+import dataclasses
+import multiprocessing
+import os
+import numpy as np
+from plotter_core import gcode_compiler
+from plotter_core import stroke_buffer
+
+STYLES = ('hatch', 'crosshatch', 'stipple')
+DEFAULT_RESOLUTION = 0.1  # mm
+# Dots are about a pen width across, so stippling needs less detail.
+STIPPLE_RESOLUTION = 0.5  # mm
+DEFAULT_SPACING = 0.8  # mm between hatch lines
+# Cross-hatching layers, each drawn where the image is darker than the last.
+CROSSHATCH_ANGLES = (45.0, 135.0, 0.0, 90.0)
+# Hatch runs shorter than this are left out, rather than lifting the pen
+# for a dot.
+MIN_RUN = 0.5  # mm
+DEFAULT_DOTS = 20_000
+LLOYD_ITERATIONS = 20
+TILE_SIZE = 512  # pixels
+
+
+@dataclasses.dataclass(frozen=True)
+class Placement:
+    """Where an image goes on the plotter, in mm."""
+    left: float = 0.0
+    top: float = 0.0
+    width: float = gcode_compiler.PLOTTER_WIDTH
+    # Fit within this height too, keeping the aspect ratio.
+    height: float = gcode_compiler.PLOTTER_HEIGHT
+
+
+def load_darkness(path, placement=Placement(), resolution=DEFAULT_RESOLUTION):
+    """Reads an image as darkness from 0 (white) to 255 (black), one pixel per
+    resolution mm, scaled to fit placement."""
+    # OpenCV is slow to import, so the app only loads it for an image.
+    import cv2
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"Can't read image {path}")
+    scale = min(placement.width / image.shape[1], placement.height / image.shape[0]) / resolution
+    size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return 255 - cv2.resize(image, size, interpolation=interpolation)
+
+
+def _tiles(shape, tile_size):
+    """(y0, y1, x0, x1) of each tile covering an image."""
+    return [(y, min(y + tile_size, shape[0]), x, min(x + tile_size, shape[1]))
+            for y in range(0, shape[0], tile_size) for x in range(0, shape[1], tile_size)]
+
+
+def _map(function, tasks, workers):
+    if workers == 1 or len(tasks) < 2:
+        return [function(*task) for task in tasks]
+    # Spawned rather than forked: the app converts images on a background
+    # thread, and forking a process with Tk and other threads running can
+    # deadlock the children or hand them its X connection.
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(function, *zip(*tasks)))
+
+
+def _hatch_tile(tile, origin, angle, spacing, threshold, resolution):
+    """Runs of each hatch line that are darker than threshold in one tile.
+
+    Hatch line k is every point p with p . normal = k * spacing, in mm from
+    the image's corner; u is the distance along it.
+
+    Returns:
+        (line, u_start, u_end) arrays, in mm.
+    """
+    import cv2
+    height, width = tile.shape
+    direction = np.array((np.cos(np.radians(angle)), np.sin(np.radians(angle))))
+    normal = np.array((-direction[1], direction[0]))
+    # Tile corners in mm, to find the lines and stretch of them crossing it.
+    corners = (np.asarray(origin)[::-1] + np.array(
+        [(0, 0), (width, 0), (0, height), (width, height)])) * resolution
+    v, u = corners @ normal, corners @ direction
+    lines = np.arange(np.ceil(v.min() / spacing), np.floor(v.max() / spacing) + 1)
+    along = np.arange(np.floor(u.min() / resolution), np.ceil(u.max() / resolution) + 1) * resolution
+    if not len(lines) or not len(along):
+        empty = np.zeros(0)
+        return empty, empty, empty
+    # Every sample of every line, in tile pixels, sampled in one go. Samples
+    # off the tile belong to other tiles.
+    points = (lines[:, None, None] * spacing * normal + along[None, :, None] * direction) / resolution
+    points -= np.asarray(origin)[::-1]
+    inside = ((points >= 0) & (points < (width, height))).all(axis=2)
+    points = (points - 0.5).astype(np.float32)
+    samples = cv2.remap(tile, points[..., 0], points[..., 1], cv2.INTER_LINEAR,
+                        borderMode=cv2.BORDER_REPLICATE)
+    dark = np.zeros((len(lines), len(along) + 2), dtype=np.int8)
+    dark[:, 1:-1] = inside & (samples > threshold)
+    edges = np.diff(dark, axis=1)
+    line, start = np.nonzero(edges == 1)
+    _, end = np.nonzero(edges == -1)
+    return lines[line], along[start], along[end - 1]
+
+
+def _join_runs(line, start, end, resolution):
+    """Joins runs of the same line that meet, e.g. at tile edges."""
+    order = np.lexsort((start, line))
+    line, start, end = line[order], start[order], end[order]
+    if not len(line):
+        return line, start, end
+    # A run starting within a sample of where the previous one ended carries it on.
+    new = np.ones(len(line), dtype=bool)
+    new[1:] = (line[1:] != line[:-1]) | (start[1:] > end[:-1] + 1.5 * resolution)
+    first = np.flatnonzero(new)
+    return line[first], start[first], np.maximum.reduceat(end, first)
+
+
+def hatch(darkness, angles=(45.0,), spacing=DEFAULT_SPACING, placement=Placement(),
+          resolution=DEFAULT_RESOLUTION, min_run=MIN_RUN, tile_size=TILE_SIZE, workers=None):
+    """Hatch lines over the dark parts of an image.
+
+    With several angles, the first layer covers everything darker than
+    white and each following one only what's darker again, so darker
+    areas get more layers.
+
+    Args:
+        darkness: From load_darkness.
+        angles: Direction of each layer's lines, in degrees.
+        spacing: mm between lines.
+        placement: Where the image is on the plotter.
+        resolution: mm per darkness pixel.
+        min_run: Shortest line drawn, in mm.
+        tile_size: Tile size in pixels.
+        workers: Processes to use. 1 does everything in this one.
+
+    Returns:
+        A StrokeBuffer of two-point strokes, in canvas pixels.
+    """
+    tiles = _tiles(darkness.shape, tile_size)
+    tasks = []
+    for layer, angle in enumerate(angles):
+        threshold = 255 * (layer + 0.5) / len(angles)
+        for y0, y1, x0, x1 in tiles:
+            tasks.append((darkness[y0:y1, x0:x1], (y0, x0), angle, spacing, threshold, resolution))
+    runs = _map(_hatch_tile, tasks, workers or os.cpu_count())
+    strokes = []
+    for layer, angle in enumerate(angles):
+        layer_runs = runs[layer * len(tiles):(layer + 1) * len(tiles)]
+        line, start, end = _join_runs(*(np.concatenate(parts) for parts in zip(*layer_runs)),
+                                      resolution)
+        keep = end - start >= min_run
+        line, start, end = line[keep], start[keep], end[keep]
+        direction = np.array((np.cos(np.radians(angle)), np.sin(np.radians(angle))))
+        normal = np.array((-direction[1], direction[0]))
+        offset = line[:, None] * spacing * normal
+        # Alternate directions, so neighbouring lines join up end to start.
+        flip = (line % 2).astype(bool)
+        start, end = np.where(flip, end, start), np.where(flip, start, end)
+        strokes.append(np.stack([offset + start[:, None] * direction,
+                                 offset + end[:, None] * direction], axis=1))
+    segments = np.concatenate(strokes) if strokes else np.zeros((0, 2, 2))
+    return _to_canvas(segments.reshape(-1, 2), np.arange(0, 2 * len(segments), 2), placement)
+
+
+def _stipple_tile(tile, origin, dots, iterations, seed):
+    """Dots over one tile, in tile pixels, by weighted Voronoi stippling."""
+    import cv2
+    weight = tile.astype(np.float64)
+    total = weight.sum()
+    if not dots or total <= 0:
+        return np.zeros((0, 2))
+    height, width = tile.shape
+    rng = np.random.default_rng(seed)
+    # Start from dots placed with probability proportional to darkness.
+    index = rng.choice(tile.size, size=dots, p=(weight / total).ravel())
+    points = np.column_stack((index % width, index // width)) + rng.uniform(0, 1, (dots, 2))
+    ys, xs = np.mgrid[0:height, 0:width]
+    xs, ys, weight = xs.ravel() + 0.5, ys.ravel() + 0.5, weight.ravel()
+    for _ in range(iterations):
+        # Voronoi cells: every pixel labelled with the nearest dot, as the
+        # label distanceTransformWithLabels gives the nearest zero pixel.
+        pixels = np.unique(np.minimum(points.astype(np.int64), (width - 1, height - 1)), axis=0)
+        seeds = np.ones((height, width), dtype=np.uint8)
+        seeds[pixels[:, 1], pixels[:, 0]] = 0
+        _, labels = cv2.distanceTransformWithLabels(seeds, cv2.DIST_L2, cv2.DIST_MASK_5,
+                                                    labelType=cv2.DIST_LABEL_PIXEL)
+        labels = labels.ravel()
+        cell_weight = np.bincount(labels, weight)
+        filled = cell_weight > 0
+        centroid_x = np.bincount(labels, weight * xs)[filled] / cell_weight[filled]
+        centroid_y = np.bincount(labels, weight * ys)[filled] / cell_weight[filled]
+        points = np.column_stack((centroid_x, centroid_y))
+    return points + np.asarray(origin)[::-1]
+
+
+def stipple(darkness, dots=DEFAULT_DOTS, placement=Placement(), resolution=DEFAULT_RESOLUTION,
+            iterations=LLOYD_ITERATIONS, tile_size=TILE_SIZE, workers=None, seed=0):
+    """Dots spread over an image so they're densest where it's darkest.
+
+    Args:
+        darkness: From load_darkness.
+        dots: About how many dots to place.
+        placement: Where the image is on the plotter.
+        resolution: mm per darkness pixel.
+        iterations: Lloyd iterations per tile.
+        tile_size: Tile size in pixels.
+        workers: Processes to use. 1 does everything in this one.
+        seed: For the starting dots.
+
+    Returns:
+        A StrokeBuffer of one-point strokes, in canvas pixels.
+    """
+    tiles = _tiles(darkness.shape, tile_size)
+    sums = np.array([darkness[y0:y1, x0:x1].sum(dtype=np.float64) for y0, y1, x0, x1 in tiles])
+    counts = np.round(dots * sums / max(sums.sum(), 1)).astype(int)
+    tasks = [(darkness[y0:y1, x0:x1], (y0, x0), count, iterations, (seed, i))
+             for i, ((y0, y1, x0, x1), count) in enumerate(zip(tiles, counts))]
+    points = np.concatenate([np.zeros((0, 2))] + _map(_stipple_tile, tasks,
+                                                      workers or os.cpu_count()))
+    return _to_canvas(points * resolution, np.arange(len(points)), placement)
+
+
+def _to_canvas(points, starts, placement):
+    """StrokeBuffer in canvas pixels of points in mm from the image's corner."""
+    points = (points + (placement.left, placement.top)) * gcode_compiler.CANVAS_SCALE
+    return stroke_buffer.StrokeBuffer.from_arrays(points, starts)
+
+
+def image_strokes(path, style='crosshatch', placement=Placement(), resolution=None,
+                  spacing=DEFAULT_SPACING, dots=DEFAULT_DOTS, workers=None):
+    """Strokes for an image file, in one of STYLES.
+
+    resolution defaults to STIPPLE_RESOLUTION for stippling and
+    DEFAULT_RESOLUTION otherwise.
+    """
+    if resolution is None:
+        resolution = STIPPLE_RESOLUTION if style == 'stipple' else DEFAULT_RESOLUTION
+    darkness = load_darkness(path, placement, resolution)
+    if style == 'hatch':
+        return hatch(darkness, spacing=spacing, placement=placement, resolution=resolution,
+                     workers=workers)
+    if style == 'crosshatch':
+        return hatch(darkness, CROSSHATCH_ANGLES, spacing, placement, resolution, workers=workers)
+    if style == 'stipple':
+        return stipple(darkness, dots, placement, resolution, workers=workers)
+    raise ValueError(f'Unknown style {style!r}, expected one of {", ".join(STYLES)}')
@@ -7,6 +7,7 @@ If you don't know the camera index, run `python stream_video.py` and it will
 print the available cameras. --camera_index=0 will probably be a built-in webcam.
 """
 import cv2
+import camera
 from absl import app
 from absl import flags
 
@@ -44,22 +45,28 @@ def main(argv):
     cv2.namedWindow("preview")
     video_capture = cv2.VideoCapture(CAMERA_INDEX.value)
 
-    if video_capture.isOpened(): # try to get the first frame
-        rval, frame = video_capture.read()
-    else:
-        rval = False
+    if not video_capture.isOpened():
+        cv2.destroyWindow("preview")
+        return
 
     print("Press Esc to exit (with image window selected).")
-    while rval:
-        bright_coords = brightest_pixel(frame)
-        cv2.circle(img=frame, center=bright_coords, radius=5, color=BLUE, thickness=2)
-        cv2.imshow("preview", frame)
-        rval, frame = video_capture.read()
-        key = cv2.waitKey(20)
+    # Frames are captured and processed on their own threads, so the preview
+    # always shows the newest one.
+    capture = camera.Capture(video_capture)
+    results = camera.process(capture.frames, lambda frame: brightest_pixel(frame.image))
+    while not results.finished:
+        result = results.get(timeout=0.01)
+        if result is not None:
+            frame, bright_coords = result
+            cv2.circle(img=frame.image, center=bright_coords, radius=5, color=BLUE, thickness=2)
+            cv2.putText(frame.image, camera.stats(capture, results, frame), (10, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, BLUE, 2)
+            cv2.imshow("preview", frame.image)
+        key = cv2.waitKey(1)
         if key == 27: # exit on ESC
             break
 
-    video_capture.release()
+    capture.close()
     cv2.destroyWindow("preview")
 
 if __name__ == "__main__":
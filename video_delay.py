@@ -0,0 +1,87 @@
+r"""Checks the video plotter draws a pen it can keep up with within max_delay.
+
+python video_delay.py --max_delay=0.5
+
+A pen goes round a circle in front of a synthetic camera at --speed times
+the plotter's feed rate, and its points are streamed in real time to a
+simulated FluidNC. The plotter starts over the first point, as if the pen
+had been put down there. Exits with status 1 if any point is expected to
+be drawn more than --max_delay seconds after its frame was captured.
+"""
+
+import time
+from absl import app
+from absl import flags
+import numpy as np
+from plotter_core import g_code_sender
+from plotter_core import gcode_compiler
+from plotter_core import simulated_fluidnc
+import video_plotter
+
+MAX_DELAY = flags.DEFINE_float('max_delay', video_plotter.DEFAULT_MAX_DELAY,
+                               'Most seconds from a frame being captured to its point being drawn.')
+SPEED = flags.DEFINE_float('speed', 0.9, 'Speed of the pen, as a fraction of the feed rate.')
+SECONDS = flags.DEFINE_float('seconds', 5.0, 'How long the pen draws for.')
+FPS = flags.DEFINE_float('fps', 30.0, 'Frames captured per second.')
+SEED = flags.DEFINE_integer('seed', 0, 'Seed for the tracking noise.')
+
+FRAME_SIZE = (640, 480)
+# Circle the pen goes round, in frame pixels.
+CENTER = np.array((320.0, 240.0))
+RADIUS = 100.0
+# Spread of tracked positions around the pen, in frame pixels.
+TRACKING_NOISE = 1.0
+# Seconds the plotter may take to get over the first point.
+POSITIONING_TIMEOUT = 30.0
+
+
+def move_to(sender, x, y):
+    """Moves the plotter to (x, y) mm and waits until it's there."""
+    sender.stream(f'G0 X{x:.3f} Y{y:.3f}\n')
+    deadline = time.monotonic() + POSITIONING_TIMEOUT
+    status = None
+    while time.monotonic() < deadline:
+        status = sender.wait_for_status(newer_than=status, timeout=1)
+        if (status is not None and status.state == 'Idle'
+                and np.hypot(status.position[0] - x, status.position[1] - y) < 0.01):
+            return
+    raise RuntimeError(f'Plotter never got to ({x}, {y}): {status}')
+
+
+def main(argv):
+    del argv  # unused
+    controller = simulated_fluidnc.SimulatedFluidNC()
+    sender = g_code_sender.GCodeSender(controller.url)
+    try:
+        plotter = video_plotter.VideoPlotter(sender, FRAME_SIZE, max_delay=MAX_DELAY.value)
+        # Radians per second for the pen to go at --speed along the wider axis.
+        angular_speed = (SPEED.value * plotter.feed / 60
+                         / (RADIUS * max(plotter.x_scale, plotter.y_scale)))
+
+        def pen(seconds):
+            angle = angular_speed * seconds
+            return CENTER + RADIUS * np.array((np.cos(angle), np.sin(angle)))
+        start = gcode_compiler.to_plotter_mm(pen(0)[None], plotter.x_scale, plotter.y_scale,
+                                             FRAME_SIZE[1])[0]
+        move_to(sender, *start)
+        rng = np.random.default_rng(SEED.value)
+        start_time = time.perf_counter()
+        for frame in range(round(SECONDS.value * FPS.value)):
+            time.sleep(max(0.0, start_time + frame / FPS.value - time.perf_counter()))
+            captured = time.perf_counter()
+            plotter.add(tuple(pen(captured - start_time) + rng.normal(0, TRACKING_NOISE, 2)),
+                        captured)
+        plotter.close()
+    finally:
+        sender.close()
+        controller.close()
+    print(plotter.stats)
+    within = plotter.stats.worst_delay <= MAX_DELAY.value
+    print(f'Worst delay {plotter.stats.worst_delay:.3f} s for a pen at {SPEED.value:g} times '
+          f'the feed rate, {"within" if within else "over"} {MAX_DELAY.value:g} s')
+    if not within:
+        return 1
+
+
+if __name__ == '__main__':
+    app.run(main)
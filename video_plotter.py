@@ -0,0 +1,375 @@
+"""Plots a pen tracked on camera as it moves, within a fixed delay.
+
+Each tracked position goes through a constant-velocity Kalman filter, which
+smooths jitter and rejects jumps. The pen counts as down while it's seen
+and up once it's been missing for a few frames. Points are compiled into
+G-code a few at a time and streamed to the plotter.
+
+The plotter can't always keep up with a hand. A point reaches the paper
+after waiting to be sent, waiting for the moves sent before it and being
+drawn, so the motion still queued for the plotter is modelled from path
+length and feed rate, starting from where the plotter last reported being,
+and corrected with status reports. Points are held back while that queue
+is more than the plotter needs to stop plus a lookahead, and when held
+points could no longer be drawn within max_delay of being captured, they
+are decimated until they can. A hand faster than the plotter can follow
+even then just has the pen cut straight to where it is now.
+"""
+
+import dataclasses
+import time
+import numpy as np
+from plotter_core import curve_fitter
+from plotter_core import gcode_compiler
+from plotter_core import time_estimator
+
+# Longest a point should take from capture to being drawn, in seconds.
+DEFAULT_MAX_DELAY = 0.5
+# Seconds of queued motion, beyond what the plotter needs to stop from the
+# feed rate, that keep the planner busy. More is held back.
+DEFAULT_LOOKAHEAD = 0.1
+# Frames the pen has to be seen to put it down, and missed to lift it.
+PEN_DOWN_FRAMES = 3
+PEN_UP_FRAMES = 5
+# Tracking noise in frame pixels, and how hard the pen accelerates in
+# pixels/s^2, for the Kalman filter.
+MEASUREMENT_NOISE = 2.0
+ACCELERATION_NOISE = 1000.0
+# Spread of the velocity of a pen just found, in pixels/s.
+INITIAL_SPEED_NOISE = 5000.0
+# Squared Mahalanobis distance beyond which a detection is taken as a
+# glitch: 99.9% of real ones fall within it.
+GATE = 13.8
+# A status report within this many mm of the queued path puts the pen on it.
+POSITION_TOLERANCE = 1.0
+# How far in mm sent paths may stray from the smoothed points. A camera
+# pixel is most of a mm on the plotter, so finer detail is noise.
+DEFAULT_CHORD_TOLERANCE = 0.5
+# Points closer than this in mm to the one before are skipped. Tiny moves
+# that zigzag with tracking noise make the plotter stop at every corner.
+MIN_STEP = 2.0
+# Decimation tolerances tried in turn, in mm.
+DECIMATION_TOLERANCES = (0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+
+
+class KalmanFilter:
+    """Constant-velocity Kalman filter over (x, y, vx, vy)."""
+
+    def __init__(self, measurement_noise=MEASUREMENT_NOISE,
+                 acceleration_noise=ACCELERATION_NOISE):
+        self.measurement_variance = measurement_noise ** 2
+        self.acceleration_variance = acceleration_noise ** 2
+        self.state = None
+        self.covariance = None
+
+    def reset(self, point):
+        self.state = np.array([point[0], point[1], 0.0, 0.0])
+        self.covariance = np.diag([self.measurement_variance] * 2 + [INITIAL_SPEED_NOISE ** 2] * 2)
+
+    def predict(self, dt):
+        transition = np.eye(4)
+        transition[0, 2] = transition[1, 3] = dt
+        # White-noise acceleration, per axis.
+        q = self.acceleration_variance * np.array([[dt ** 4 / 4, dt ** 3 / 2],
+                                                   [dt ** 3 / 2, dt ** 2]])
+        noise = np.zeros((4, 4))
+        noise[np.ix_([0, 2], [0, 2])] = q
+        noise[np.ix_([1, 3], [1, 3])] = q
+        self.state = transition @ self.state
+        self.covariance = transition @ self.covariance @ transition.T + noise
+
+    def update(self, point, gate=GATE):
+        """Corrects the state with a measured position.
+
+        Returns False, changing nothing, if the measurement is further than
+        gate from the prediction.
+        """
+        innovation = np.asarray(point, dtype=float) - self.state[:2]
+        innovation_covariance = self.covariance[:2, :2] + self.measurement_variance * np.eye(2)
+        inverse = np.linalg.inv(innovation_covariance)
+        if innovation @ inverse @ innovation > gate:
+            return False
+        gain = self.covariance[:, :2] @ inverse
+        self.state = self.state + gain @ innovation
+        self.covariance = (np.eye(4) - gain @ np.eye(2, 4)) @ self.covariance
+        return True
+
+    @property
+    def position(self):
+        return tuple(self.state[:2])
+
+
+class MotionBacklog:
+    """Estimates how long the plotter needs to finish the moves sent to it.
+
+    Everything sent since the plotter was last known to be somewhere is
+    timed with time_estimator as one run, since the planner joins up moves
+    that arrive before it stops. Status reports re-time what's left from
+    the reported position and speed. Until one comes, the plotter is taken
+    to be at start.
+    """
+
+    def __init__(self, feed, limits, start=(0.0, 0.0)):
+        self.feed = feed
+        self.limits = limits
+        # Points sent that may not be drawn yet, in mm, starting where the
+        # plotter was last known to be, and when it was there
+        # (time.perf_counter()).
+        self.path = np.array([start], dtype=float)
+        self.path_time = 0.0
+        # How fast it was going then, in mm/min.
+        self.path_speed = 0.0
+        # When the moves sent should be done.
+        self.busy_until = 0.0
+
+    def duration(self, path, start_speed=0.0):
+        """Seconds to draw path, from start_speed mm/min."""
+        return time_estimator.estimate_path(path, self.feed, self.limits, start_speed).seconds
+
+    def seconds(self, now):
+        """Seconds of motion left at time now."""
+        return max(0.0, self.busy_until - now)
+
+    def seconds_with(self, points, now):
+        """Seconds of motion left at time now if points, in mm, were added."""
+        path, path_time, path_speed = self._extended(points, now)
+        return max(0.0, path_time + self.duration(path, path_speed) - now)
+
+    def add(self, points, now):
+        """Adds the points of moves just sent, in mm."""
+        self.path, self.path_time, self.path_speed = self._extended(points, now)
+        self.busy_until = self.path_time + self.duration(self.path, self.path_speed)
+
+    def _extended(self, points, now):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.busy_until <= now:
+            # The plotter is idle where the last move left it.
+            return np.vstack([self.path[-1:], points]), now, 0.0
+        return np.vstack([self.path, points]), self.path_time, self.path_speed
+
+    def on_status(self, position, now, speed=0.0):
+        """Re-times what's left from a reported (x, y) position and speed in
+        mm/min at time now."""
+        if len(self.path) < 2:
+            # Nothing's queued, so the next move starts from there.
+            self.path, self.path_time = np.array([position], dtype=float), now
+            return
+        starts, ends = self.path[:-1], self.path[1:]
+        chords = ends - starts
+        length_squared = np.maximum((chords ** 2).sum(axis=1), 1e-12)
+        t = np.clip(((np.asarray(position) - starts) * chords).sum(axis=1) / length_squared, 0, 1)
+        distances = np.hypot(*(starts + t[:, None] * chords - position).T)
+        near = np.flatnonzero(distances <= POSITION_TOLERANCE)
+        if not len(near):
+            return
+        # The earliest match, since the path may cross itself.
+        segment = near[0]
+        self.path = np.vstack([position, self.path[segment + 1:]])
+        self.path_time, self.path_speed = now, speed
+        self.busy_until = now + self.duration(self.path, speed)
+
+
+@dataclasses.dataclass
+class Stats:
+    frames: int = 0
+    # Smoothed points while the pen was down, and how many were decimated
+    # away before being sent.
+    points: int = 0
+    decimated: int = 0
+    lines: int = 0
+    # Frames the pen was seen but the detection was rejected as a glitch.
+    rejected: int = 0
+    # Largest expected capture-to-drawn delay of a point sent, in seconds.
+    worst_delay: float = 0.0
+
+
+class VideoPlotter:
+    """Turns tracked pen positions into G-code streamed to a GCodeSender.
+
+    Call add() for every frame, from one thread.
+    """
+
+    def __init__(self, gcode_sender, frame_size, max_delay=DEFAULT_MAX_DELAY,
+                 lookahead=DEFAULT_LOOKAHEAD, feed=gcode_compiler.SPEED,
+                 chord_tolerance=DEFAULT_CHORD_TOLERANCE, limits=time_estimator.MachineLimits()):
+        self.gcode_sender = gcode_sender
+        width, height = frame_size
+        # The frame maps onto the whole plotter, y flipped like the canvas.
+        self.x_scale = gcode_compiler.PLOTTER_WIDTH / width
+        self.y_scale = gcode_compiler.PLOTTER_HEIGHT / height
+        self.frame_height = height
+        self.max_delay = max_delay
+        # Holding back points while the plotter has less than it needs to
+        # stop queued would slow it down for them.
+        self.lookahead = lookahead + feed / 60 / min(limits.acceleration[:2])
+        self.feed = feed
+        self.chord_tolerance = chord_tolerance
+        self.filter = KalmanFilter()
+        self.backlog = MotionBacklog(feed, limits)
+        self.pen_down = False
+        # Whether the G-code sent so far leaves the plotter's pen up.
+        self.plotter_pen_up = True
+        self._seen = 0
+        self._missed = 0
+        self._last_time = None
+        self._last_status = None
+        # Last point held or sent, in frame pixels.
+        self._last_point = None
+        # Smoothed strokes held back, as lists of frame pixels, whether the
+        # pen lifts after the last one, and when the first point was captured.
+        self._held = []
+        self._held_ended = False
+        self._oldest = None
+        self.stats = Stats()
+
+    def add(self, point, captured):
+        """Takes the tracked position in a frame, or None if the pen wasn't found.
+
+        Args:
+            point: (x, y) in frame pixels, or None.
+            captured: time.perf_counter() when the frame was captured.
+
+        Returns:
+            The smoothed position, or None while the pen is up.
+        """
+        self.stats.frames += 1
+        if self.filter.state is not None and self._last_time is not None:
+            self.filter.predict(max(captured - self._last_time, 0.0))
+        self._last_time = captured
+        if point is not None:
+            if self.filter.state is None or not self.pen_down and not self._seen:
+                self.filter.reset(point)
+            elif not self.filter.update(point):
+                self.stats.rejected += 1
+                if self.pen_down:
+                    point = None
+                else:
+                    # Nothing's drawn yet, so start again from here.
+                    self.filter.reset(point)
+                    self._seen = 0
+        if point is None:
+            self._seen = 0
+            self._missed += 1
+            if self.pen_down and self._missed >= PEN_UP_FRAMES:
+                self.lift()
+        else:
+            self._missed = 0
+            self._seen += 1
+            if not self.pen_down and self._seen >= PEN_DOWN_FRAMES:
+                self.pen_down = True
+        smoothed = None
+        if self.pen_down and point is not None:
+            smoothed = self.filter.position
+            self.stats.points += 1
+            starts_stroke = self._held_ended or not self._held and self.plotter_pen_up
+            if not starts_stroke and np.hypot(
+                    (smoothed[0] - self._last_point[0]) * self.x_scale,
+                    (smoothed[1] - self._last_point[1]) * self.y_scale) < MIN_STEP:
+                self.stats.decimated += 1
+            else:
+                if not self._held or self._held_ended:
+                    self._held.append([])
+                    self._held_ended = False
+                self._held[-1].append(smoothed)
+                self._last_point = smoothed
+                if self._oldest is None:
+                    self._oldest = captured
+        self.flush()
+        return smoothed
+
+    def lift(self):
+        """Ends the stroke. The pen lifts once what's held is sent."""
+        self.pen_down = False
+        if self._held:
+            self._held_ended = True
+        elif not self.plotter_pen_up:
+            self._held, self._held_ended = [[]], True
+            self._oldest = time.perf_counter()
+        self.flush()
+
+    def _update_backlog(self, now):
+        status = self.gcode_sender.status
+        if status is not None and status is not self._last_status:
+            self._last_status = status
+            age = time.monotonic() - status.timestamp
+            # Without a reported speed, what's left is timed from a standstill,
+            # which can only overestimate it.
+            self.backlog.on_status(status.position[:2], now - age, status.feed_rate or 0.0)
+
+    def _decimate(self, path, starts, ends, allowed, now):
+        """Which points of path to keep so it's drawn within allowed seconds of now.
+
+        Each stroke, from starts to ends, is simplified with
+        Ramer-Douglas-Peucker to chord_tolerance, as the compiler would
+        anyway, then at growing tolerances. If that's not enough, the pen
+        goes straight to the end of each stroke, and failing that only the
+        end of the newest stroke is kept.
+        """
+        for tolerance in (self.chord_tolerance,
+                          *(t for t in DECIMATION_TOLERANCES if t > self.chord_tolerance)):
+            keep = curve_fitter.rdp_mask(path, starts, ends, tolerance)
+            if self.backlog.seconds_with(path[keep][1:], now) <= allowed:
+                return keep
+        keep = np.zeros(len(path), dtype=bool)
+        keep[0] = True
+        keep[ends] = True
+        if self.backlog.seconds_with(path[keep][1:], now) <= allowed:
+            return keep
+        keep[ends[:-1]] = False
+        keep[0] = True
+        return keep
+
+    def flush(self, force=False):
+        """Sends held strokes if the plotter is ready for them.
+
+        They're held while it has more than lookahead seconds of motion
+        queued, unless force.
+        """
+        if not self._held:
+            return
+        now = time.perf_counter()
+        self._update_backlog(now)
+        backlog = self.backlog.seconds(now)
+        if backlog > self.lookahead and not force:
+            return
+        lengths = [len(stroke) for stroke in self._held]
+        pixels = np.array([point for stroke in self._held for point in stroke]).reshape(-1, 2)
+        points = gcode_compiler.to_plotter_mm(pixels, self.x_scale, self.y_scale,
+                                              self.frame_height)
+        # The path starts where the moves sent so far end, or where the
+        # plotter is. That's part of the first stroke if it carries on the
+        # one being drawn.
+        path = np.vstack([self.backlog.path[-1:], points])
+        ends = np.cumsum(lengths)
+        starts = ends - lengths + 1
+        if self.plotter_pen_up:
+            starts, ends = np.concatenate([[0], starts]), np.concatenate([[0], ends])
+        else:
+            starts[0] = 0
+        nonempty = ends >= starts
+        starts, ends = starts[nonempty], ends[nonempty]
+        allowed = self.max_delay - (now - self._oldest)
+        keep = self._decimate(path, starts, ends, allowed, now) if len(points) else np.ones(1, bool)
+        self.stats.worst_delay = max(self.stats.worst_delay, now - self._oldest
+                                     + self.backlog.seconds_with(path[keep][1:], now))
+        keep = keep[1:]
+        self.stats.decimated += len(keep) - int(keep.sum())
+        strokes = [stroke[kept] for stroke, kept in zip(np.split(pixels, np.cumsum(lengths)[:-1]),
+                                                         np.split(keep, np.cumsum(lengths)[:-1]))]
+        # The pen lifts first if the stroke it's drawing was held empty or
+        # decimated away.
+        job = gcode_compiler.compile_strokes(
+            strokes, self.x_scale, self.y_scale, self.frame_height, feed=self.feed,
+            tolerance=self.chord_tolerance, pen_up=self.plotter_pen_up,
+            continues=not self.plotter_pen_up and len(strokes[0]) > 0, finished=self._held_ended)
+        self._held, self._held_ended, self._oldest = [], False, None
+        self.plotter_pen_up = job.pen_up
+        if job.gcode:
+            self.gcode_sender.stream(job.gcode)
+            self.stats.lines += job.gcode.count(b'\n')
+        self.backlog.add(points[keep], now)
+
+    def close(self):
+        """Lifts the pen and sends everything held."""
+        self.lift()
+        self.flush(force=True)
@@ -1,24 +1,45 @@
 """Listens for G-code on a serial port and draws what the plotter would draw."""
 
 import tkinter as tk
+from tkinter import filedialog
 import threading
+from PIL import ImageTk
+import serial
+import gcode_renderer
+
+# How often the preview window is refreshed from the offscreen image.
+PREVIEW_FPS = 15
+# Longest a read of the port blocks, in seconds, and so how long closing the
+# preview can take to stop the reading thread.
+READ_TIMEOUT = 0.5
+
 
 class VirtualPlotter:
     def __init__(self, root, serial_instance, plotter_width, plotter_height, canvas_scale):
         self.root = root
         self.serial_instance = serial_instance
-        self.line_width = 2
-        self.color = 'black'
-        self.scale = canvas_scale
-        self.height = plotter_height
+        # The sender's short timeout would have the reading thread poll. It
+        # only reads the port itself with flow control, which a port drawn
+        # here doesn't have.
+        self.serial_instance.timeout = READ_TIMEOUT
+        self._stop = threading.Event()
+        # G-code is parsed and drawn offscreen on a background thread. Only
+        # the Tk thread touches the canvas, copying the image over at
+        # PREVIEW_FPS.
+        self.renderer = gcode_renderer.PlotRenderer(plotter_width, plotter_height, canvas_scale)
         preview_window = tk.Toplevel(self.root)
         preview_window.title("Virtual Plotter")
-        
+        preview_window.protocol('WM_DELETE_WINDOW', self.close)
+        self._preview_window = preview_window
+
         preview_canvas = tk.Canvas(
-            preview_window, bg='white', 
+            preview_window, bg='white',
             width=plotter_width * canvas_scale, height=plotter_height * canvas_scale)
         preview_canvas.pack()
         self.preview_canvas = preview_canvas
+        self._photo = ImageTk.PhotoImage(self.renderer.snapshot())
+        self._image_item = preview_canvas.create_image(0, 0, anchor='nw', image=self._photo)
+        tk.Button(preview_window, text="Save preview as PNG", command=self.save_preview).pack()
         self._preview_thread = threading.Thread(
             target=self.draw_preview,
             args=(
@@ -26,35 +47,38 @@ class VirtualPlotter:
             daemon=True,
         )
         self._preview_thread.start()
+        self.refresh()
 
     def draw_preview(self):
-        last_x, last_y = None, None
-        pen_down = False
-        r = 4
-        while not self.serial_instance.closed:
-            line = self.serial_instance.read_until().decode("UTF-8")
-            if "G0 Z-5" in line:
-                if last_x is not None and last_y is not None:
-                    self.preview_canvas.create_oval(last_x-r, last_y-r, last_x+r, last_y+r, fill='red')
-                pen_down = False
-                continue
-            if "G0 Z5" in line:
-                if last_x is not None and last_y is not None:
-                    self.preview_canvas.create_oval(last_x-r, last_y-r, last_x+r, last_y+r, fill='purple')
-                pen_down = True
-                continue
-            if "G1" in line:
-                try:
-                    xScaled = float(line[line.index("X")+1:].split(" ")[0])
-                    yScaled = float(line[line.index("Y")+1:].split(" ")[0])
-                except Exception as e:
-                    print(e)
-                    print('line', line)
-                    continue
-                x = xScaled * self.scale
-                y = (self.height - yScaled) * self.scale
-                if pen_down:
-                    self.preview_canvas.create_line(last_x, last_y, x, y, width=self.line_width, fill=self.color)
-
-                last_x, last_y = x, y
+        received = bytearray()
+        while not self._stop.is_set() and not self.serial_instance.closed:
+            # Reads time out, so lines can arrive in pieces.
+            try:
+                received += self.serial_instance.read(self.serial_instance.in_waiting or 1)
+            except serial.SerialException:
+                break  # Closed.
+            while b'\n' in received:
+                line, _, received = received.partition(b'\n')
+                self.renderer.feed(line.decode("UTF-8", errors="replace"))
+
+    def close(self):
+        """Stops reading the port and closes the preview window."""
+        self._stop.set()
+        self._preview_window.destroy()
+
+    def refresh(self):
+        if self._stop.is_set():
+            return
+        if self.renderer.dirty:
+            self._photo = ImageTk.PhotoImage(self.renderer.snapshot())
+            self.preview_canvas.itemconfig(self._image_item, image=self._photo)
+        self.root.after(1000 // PREVIEW_FPS, self.refresh)
+
+    def save_preview(self):
+        filename = filedialog.asksaveasfilename(defaultextension='.png',
+                                                filetypes=[('PNG', '*.png')])
+        if filename:
+            self.export_png(filename)
 
+    def export_png(self, path):
+        self.renderer.save(path)